@@ -0,0 +1,153 @@
+"""
+broadcast: envío secuencial (bucle anterior) frente al motor concurrente con
+límites, contra una Bot API falsa local (asyncio, solo stdlib).
+
+La API falsa añade latencia por petición, aplica el límite global de Telegram
+(responde 429 con retry_after si se supera) y corta conexiones al azar.
+
+    python -m bench.broadcast --recipients 300 --latency 0.08
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qs
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from broadcast import Broadcaster
+
+TOKEN = "123456:bench"
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float, global_limit: int, error_rate: float, rnd_seed: int = 0):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.error_rate = error_rate
+        self.rnd = random.Random(rnd_seed)
+        self.window = []          # instantes de los envíos aceptados (último segundo)
+        self.delivered = {}       # chat_id -> nº de mensajes entregados
+        self.throttled = 0
+        self.dropped = 0
+        self.message_id = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                path = lines[0].split(" ")[1]
+                headers = {k.lower(): v.strip() for k, v in (l.split(":", 1) for l in lines[1:] if ":" in l)}
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                if "json" in headers.get("content-type", ""):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+                status, payload = await self._api(path.rsplit("/", 1)[-1], params)
+                if payload is None:
+                    # Error de red simulado: se corta la conexión sin responder
+                    writer.close()
+                    return
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _api(self, method, params):
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+
+        await asyncio.sleep(self.latency)
+        if self.rnd.random() < self.error_rate:
+            self.dropped += 1
+            return 0, None
+
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 1.0]
+        if len(self.window) >= self.global_limit:
+            self.throttled += 1
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                         "parameters": {"retry_after": 1}}
+        self.window.append(now)
+
+        chat_id = int(params["chat_id"])
+        self.delivered[chat_id] = self.delivered.get(chat_id, 0) + 1
+        self.message_id += 1
+        return 200, {"ok": True, "result": {
+            "message_id": self.message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+        }}
+
+
+async def sequential(bot, chat_ids, text):
+    # Bucle anterior de los jobs
+    t0 = time.monotonic()
+    sent = 0
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            sent += 1
+        except Exception:
+            pass
+    return {"sent": sent, "failed": len(chat_ids) - sent, "elapsed_s": time.monotonic() - t0}
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency, args.telegram_limit, args.error_rate)
+    port = await api.start()
+    request = HTTPXRequest(connection_pool_size=args.concurrency + 4)
+    bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot", request=request)
+    chat_ids = list(range(10_000, 10_000 + args.recipients))
+    text = "📅 Resumen de prueba"
+
+    async with bot:
+        old = await sequential(bot, chat_ids, text)
+        old_dropped = api.dropped
+        api.delivered.clear()
+
+        engine = Broadcaster(global_rate=args.rate, concurrency=args.concurrency, backoff_base=0.05)
+        new = await engine.broadcast(bot, chat_ids, text)
+
+    await api.stop()
+
+    attempts = sum(r["attempts"] for r in new["results"])
+    dup = sum(1 for n in api.delivered.values() if n > 1)
+    print(f"destinatarios={args.recipients} latencia={args.latency * 1000:.0f} ms "
+          f"límite API={args.telegram_limit}/s errores red={args.error_rate:.0%}")
+    print(f"secuencial : {old['sent']:4d} entregados, {old['failed']:3d} perdidos en {old['elapsed_s']:6.2f} s "
+          f"({old_dropped} cortes sin reintento)")
+    print(f"motor      : {new['sent']:4d} entregados, {new['failed']:3d} perdidos en {new['elapsed_s']:6.2f} s "
+          f"({attempts} intentos, {api.throttled} respuestas 429, {dup} duplicados)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recipients", type=int, default=300)
+    ap.add_argument("--latency", type=float, default=0.08, help="s por petición en la API falsa")
+    ap.add_argument("--telegram-limit", type=int, default=30, help="mensajes/s antes de responder 429")
+    ap.add_argument("--error-rate", type=float, default=0.02)
+    ap.add_argument("--rate", type=float, default=25, help="límite global del motor (mensajes/s)")
+    ap.add_argument("--concurrency", type=int, default=10)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+callback_dispatch: coste de encontrar el handler de un callback_data con la
+cadena de if de handle_callback (mismas comparaciones y en el mismo orden que
+tenía) frente a callback_router.resolve(). Comprueba también las rutas con
+_check_routes().
+
+    python -m bench.callback_dispatch --n 200000
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import bot  # noqa: E402
+from bot import (  # noqa: E402
+    CB_ADMIN_CREATE_PERSON, CB_ADMIN_PERSONS, CB_ADMIN_PERSONS_FILTER, CB_ADMIN_PERSON_ASSIGN,
+    CB_ADMIN_PERSON_DELETE, CB_ADMIN_PERSON_DELETE_CONFIRM, CB_ADMIN_PERSON_REACTIVATE,
+    CB_ADMIN_PERSON_SUSPEND, CB_ADMIN_PERSON_VIEW, CB_ADMIN_PICK_TG, CB_ADMIN_REQUESTS,
+    CB_ADMIN_SEARCH_PERSON, CB_BACK_CAT, CB_BACK_MENU, CB_BACK_PANEL, CB_BACK_QTY, CB_BACK_TYPE,
+    CB_CAT, CB_DATE, CB_MENU_ADD, CB_MENU_ADMIN, CB_MENU_PANEL, CB_MENU_RANK, CB_MENU_REPORT,
+    CB_MENU_ROOT, CB_MENU_UNDO, CB_PANEL_DRINKS, CB_PANEL_MENU, CB_PANEL_NEWER, CB_PANEL_OLDER,
+    CB_QTY, CB_RANK_MENU, CB_RANK_TYPES, CB_RANK_USERS, CB_RANK_USERS_CURR, CB_RANK_USERS_PREV,
+    CB_TYPE, CB_UNDO_CANCEL, CB_UNDO_CONFIRM, CB_UNDO_PICK, CB_YEAR,
+)
+
+# Orden de la cadena anterior: (exacta | prefijo, clave)
+LEGACY_CHAIN = [
+    ("eq", CB_MENU_RANK), ("eq", CB_RANK_MENU), ("eq", CB_MENU_ROOT), ("eq", CB_RANK_USERS),
+    ("eq", CB_RANK_USERS_PREV), ("eq", CB_RANK_USERS_CURR), ("eq", CB_RANK_TYPES),
+    ("eq", CB_BACK_MENU), ("eq", CB_BACK_PANEL), ("eq", CB_BACK_CAT), ("eq", CB_BACK_TYPE), ("eq", CB_BACK_QTY),
+    ("eq", CB_MENU_ADD), ("eq", CB_MENU_UNDO), ("eq", CB_MENU_REPORT),
+    ("eq", CB_MENU_PANEL), ("eq", CB_PANEL_MENU), ("eq", CB_PANEL_DRINKS),
+    ("pre", CB_PANEL_OLDER), ("pre", CB_PANEL_NEWER),
+    ("eq", CB_MENU_ADMIN), ("eq", CB_ADMIN_PERSONS), ("pre", CB_ADMIN_PERSONS_FILTER), ("eq", CB_ADMIN_SEARCH_PERSON),
+    ("pre", CB_ADMIN_PERSON_VIEW), ("pre", CB_ADMIN_PERSON_ASSIGN), ("pre", CB_ADMIN_PICK_TG),
+    ("eq", CB_ADMIN_REQUESTS), ("eq", CB_ADMIN_CREATE_PERSON), ("pre", CB_ADMIN_PERSON_SUSPEND),
+    ("pre", CB_ADMIN_PERSON_REACTIVATE), ("pre", CB_ADMIN_PERSON_DELETE), ("pre", CB_ADMIN_PERSON_DELETE_CONFIRM),
+    ("pre", CB_YEAR), ("pre", CB_CAT), ("pre", CB_TYPE), ("pre", CB_QTY), ("pre", CB_DATE),
+    ("pre", CB_UNDO_PICK), ("pre", CB_UNDO_CONFIRM), ("eq", CB_UNDO_CANCEL),
+]
+
+
+def legacy_resolve(data: str):
+    for kind, key in LEGACY_CHAIN:
+        if (data == key) if kind == "eq" else data.startswith(key):
+            return key
+    return None
+
+
+def workload(n: int, seed: int = 0) -> list:
+    """Mezcla parecida al uso real: sobre todo añadir y rankings, poco admin."""
+    rnd = random.Random(seed)
+    weighted = [
+        (CB_MENU_ADD, 10), (f"{CB_CAT}BEER", 10), (f"{CB_TYPE}3", 10), (f"{CB_QTY}1", 10), (f"{CB_DATE}today", 10),
+        (CB_MENU_RANK, 6), (CB_RANK_USERS, 5), (CB_RANK_TYPES, 3), (CB_MENU_PANEL, 4), (CB_PANEL_DRINKS, 3),
+        (f"{CB_PANEL_OLDER}1234", 2), (f"{CB_YEAR}2025", 2), (f"{CB_UNDO_CONFIRM}99", 1), (CB_UNDO_CANCEL, 1),
+        (CB_BACK_MENU, 3), (f"{CB_ADMIN_PERSON_VIEW}7", 1), (f"{CB_ADMIN_PERSON_DELETE_CONFIRM}7", 1),
+    ]
+    keys = [k for k, _ in weighted]
+    weights = [w for _, w in weighted]
+    return rnd.choices(keys, weights, k=n)
+
+
+def timeit(fn, datas) -> float:
+    t0 = time.perf_counter()
+    for d in datas:
+        fn(d)
+    return (time.perf_counter() - t0) / len(datas) * 1e9
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000)
+    args = ap.parse_args()
+
+    bot._check_routes()
+    router = bot.callback_router
+    print(f"rutas: {len(router.exact)} exactas + {len(router.prefixes)} prefijos; todas las CB_* cubiertas")
+
+    datas = workload(args.n)
+    # Misma ruta con los dos métodos
+    for d in set(datas):
+        assert router.resolve(d)[0].key == legacy_resolve(d), d
+
+    legacy = timeit(legacy_resolve, datas)
+    new = timeit(router.resolve, datas)
+    worst = f"{CB_UNDO_CONFIRM}99"
+    print(f"cadena de if : {legacy:6.0f} ns/callback (peor caso '{worst}': {timeit(legacy_resolve, [worst] * 20000):.0f} ns)")
+    print(f"router       : {new:6.0f} ns/callback (peor caso '{worst}': {timeit(router.resolve, [worst] * 20000):.0f} ns)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+concurrency: latencia por update con varios usuarios a la vez, procesando en
+serie (Application por defecto), con concurrent_updates sin orden por usuario y
+con PerUserUpdateProcessor.
+
+Cada usuario recorre el flujo de añadir consumición (ADD_CAT → ADD_TYPE →
+ADD_QTY → ADD_DATE) tocando más rápido de lo que tarda el handler; algunos
+además piden un ranking lento. El trabajo de cada handler va al executor de BD
+(run_db), como en el bot. Se cuentan los pasos que un handler vio fuera de
+orden en context.user_data.
+
+    python -m bench.concurrency --users 40 --ranking-ms 300
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from telegram import Bot, Update
+from telegram.ext import Application, CallbackQueryHandler
+
+from bench.broadcast import FakeBotAPI, TOKEN
+from db_async import run_db
+from update_processor import PerUserUpdateProcessor
+
+FLOW = ["ADD_CAT", "ADD_TYPE", "ADD_QTY", "ADD_DATE"]
+
+
+class Run:
+    def __init__(self):
+        self.injected = {}
+        self.done = {}
+        self.out_of_order = 0
+
+
+def _app(processor, run: Run, args, port: int) -> Application:
+    bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot")
+    builder = Application.builder().bot(bot).updater(None)
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    app = builder.build()
+
+    async def on_tap(update: Update, context):
+        data = update.callback_query.data
+        if data == "RANK":
+            await run_db(time.sleep, args.ranking_ms / 1000)
+        else:
+            step = FLOW.index(data)
+            expected = FLOW[step - 1] if step else None
+            if context.user_data.get("state") != expected:
+                run.out_of_order += 1
+            await run_db(time.sleep, args.step_ms / 1000)
+            context.user_data["state"] = data if step < len(FLOW) - 1 else None
+        run.done[update.update_id] = time.monotonic()
+
+    app.add_handler(CallbackQueryHandler(on_tap))
+    return app
+
+
+def _update(bot, update_id: int, user_id: int, data: str) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "bench", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        },
+    }, bot)
+
+
+async def _user(app, run: Run, user_id: int, rnd: random.Random, args, ids):
+    taps = list(FLOW)
+    if rnd.random() < args.ranking_share:
+        taps.insert(rnd.randrange(len(taps) + 1), "RANK")
+    await asyncio.sleep(rnd.uniform(0, args.spread))
+    for data in taps:
+        update_id = next(ids)
+        run.injected[update_id] = time.monotonic()
+        await app.update_queue.put(_update(app.bot, update_id, user_id, data))
+        await asyncio.sleep(rnd.expovariate(1000 / args.tap_ms))
+
+
+async def _measure(name: str, processor, args, port: int):
+    run = Run()
+    app = _app(processor, run, args, port)
+    rnd = random.Random(7)
+    ids = iter(range(1, 1_000_000))
+    async with app:
+        await app.start()
+        t0 = time.monotonic()
+        await asyncio.gather(*(_user(app, run, 1000 + u, rnd, args, ids) for u in range(args.users)))
+        while len(run.done) < len(run.injected):
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - t0
+        await app.stop()
+
+    lat = sorted((run.done[i] - t) * 1000 for i, t in run.injected.items())
+    p95 = lat[int(len(lat) * 0.95) - 1]
+    print(f"{name:23s}: p50 {statistics.median(lat):7.1f} ms  p95 {p95:7.1f} ms  máx {lat[-1]:7.1f} ms  "
+          f"total {elapsed:5.2f} s  fuera de orden {run.out_of_order}")
+
+
+async def run(args):
+    print(f"usuarios={args.users} paso={args.step_ms} ms ranking={args.ranking_ms} ms "
+          f"({args.ranking_share:.0%} de usuarios) concurrencia={args.concurrency}")
+    # Solo para el getMe de initialize(); los handlers no llaman a la API
+    api = FakeBotAPI(0, 1, 0)
+    port = await api.start()
+    await _measure("serie (por defecto)", None, args, port)
+    await _measure("concurrente sin orden", args.concurrency, args, port)
+    await _measure("concurrente por usuario", PerUserUpdateProcessor(args.concurrency), args, port)
+    await api.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--step-ms", type=float, default=20)
+    ap.add_argument("--ranking-ms", type=float, default=300)
+    ap.add_argument("--ranking-share", type=float, default=0.3)
+    ap.add_argument("--tap-ms", type=float, default=15, help="ms medios entre toques de un usuario")
+    ap.add_argument("--spread", type=float, default=1.0, help="s en los que llegan los usuarios")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Asesor de índices: ejecuta todas las funciones públicas de db.py que consultan
+la BD (las que instrumenta db._instrument_module) sobre datos sembrados, pide
+EXPLAIN (FORMAT JSON) de cada sentencia antes de ejecutarla y marca los
+Seq Scan sobre tablas grandes (drink_events, person_day_drink).
+
+    BENCH_DATABASE_URL=... python -m bench.explain --events 100000 --years 5
+
+Devuelve 1 si encuentra algún Seq Scan marcado y 2 si alguna función pública
+de db.py no tiene caso en _calls (hay que añadírselo).
+"""
+import argparse
+import datetime as dt
+import functools
+import inspect
+import json
+import sys
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+import db
+from bench.seed import use_bench_database, seed
+
+BIG_TABLES = {"drink_events", "person_day_drink"}
+# Recorren las tablas enteras a propósito (reconstruir / verificar el rollup), o
+# son raras y un índice solo para ellas costaría en cada insert: admin_delete_person
+# borra también los eventos anulados, que no están en los índices parciales (is_void=FALSE)
+FULL_SCAN_EXPECTED = {"rebuild_person_day_drink", "check_person_day_drink", "admin_delete_person"}
+SCRATCH_NAME = "BenchExplainTmp"
+SCRATCH_TG = 990_001
+FAR_PERIOD = 1900  # periodos de resumen que no chocan con datos reales
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+# (función db, sentencia nº) -> lista de nodos Seq Scan
+_plans = []
+_current = {"fn": None, "n": 0}
+
+
+def _scan_nodes(plan, out):
+    if plan.get("Node Type") == "Seq Scan":
+        out.append((plan.get("Relation Name"), plan.get("Plan Rows")))
+    for child in plan.get("Plans", []):
+        _scan_nodes(child, out)
+    return out
+
+
+class _ExplainMixin:
+    def execute(self, query, vars=None):
+        sql = query.decode() if isinstance(query, bytes) else query
+        if _current["fn"] and sql.lstrip().upper().startswith(EXPLAINABLE):
+            _current["n"] += 1
+            # EXPLAIN sin ANALYZE no ejecuta: vale también para INSERT/UPDATE/DELETE
+            plain = self.connection.cursor(cursor_factory=extensions.cursor)
+            plain.execute("EXPLAIN (FORMAT JSON) " + sql, vars)
+            plan = plain.fetchone()[0]
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            _plans.append((_current["fn"], _current["n"], _scan_nodes(plan[0]["Plan"], [])))
+        return super().execute(query, vars)
+
+
+class ExplainDictCursor(_ExplainMixin, RealDictCursor):
+    pass
+
+
+class ExplainTupleCursor(_ExplainMixin, extensions.cursor):
+    pass
+
+
+class ExplainConnection(extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory
+        kwargs["cursor_factory"] = ExplainDictCursor if issubclass(factory, RealDictCursor) else ExplainTupleCursor
+        return super().cursor(*args, **kwargs)
+
+
+def _install():
+    # El pool conecta con psycopg2.connect(dsn, cursor_factory=CountingCursor)
+    db.close_pool()
+    db.psycopg2.connect = functools.partial(psycopg2.connect, connection_factory=ExplainConnection)
+
+
+def db_query_functions() -> set:
+    """Funciones de db.py que pasan por la BD (mismo criterio que db._instrument_module)."""
+    return {
+        name for name, obj in vars(db).items()
+        if name not in db._NOT_INSTRUMENTED and (not name.startswith("_") or name in db._INSTRUMENTED_PRIVATE)
+        and inspect.isfunction(obj) and obj.__module__ == db.__name__
+    }
+
+
+def _cleanup():
+    # Deja repetible la ejecución: sin persona temporal, marcas ni outbox de pruebas
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM person_accounts WHERE telegram_user_id IN (%s, %s);", (SCRATCH_TG, SCRATCH_TG + 1))
+            cur.execute("DELETE FROM pending_telegrams WHERE telegram_user_id=%s;", (SCRATCH_TG,))
+            cur.execute("DELETE FROM persons WHERE name=%s;", (SCRATCH_NAME,))
+            cur.execute("DELETE FROM monthly_summaries_sent WHERE year=%s;", (FAR_PERIOD,))
+            cur.execute("DELETE FROM weekly_summaries_sent WHERE year=%s;", (FAR_PERIOD,))
+            cur.execute("DELETE FROM beer_year_summaries_sent WHERE year_start=%s;", (FAR_PERIOD,))
+            cur.execute("DELETE FROM summary_outbox;")
+            conn.commit()
+    db.invalidate_identity(telegram_user_id=SCRATCH_TG)
+    db.invalidate_identity(telegram_user_id=SCRATCH_TG + 1)
+
+
+def _calls(person_id: int, year: int):
+    """(nombre de la función de db.py[ (variante)], llamada). Se ejecutan en orden."""
+    today = dt.date(year, 6, 15)
+    ws = today - dt.timedelta(days=today.weekday())
+    we = ws + dt.timedelta(days=6)
+    ms, me = dt.date(year, 6, 1), dt.date(year, 6, 30)
+    ys, ye = dt.date(year, 1, 1), dt.date(year, 12, 31)
+    periods = {"week": (ws, we), "month": (ms, me), "year": (ys, ye)}
+    drink_type_id = next(iter(db.drink_catalog()["by_id"]))
+
+    state = {}
+
+    def add():
+        state.update(db.insert_event(person_id, 0, drink_type_id, 1, today))
+
+    def add_scratch():
+        db.add_person(SCRATCH_NAME)
+        state["scratch"] = db.search_persons_by_name(SCRATCH_NAME)[0]["id"]
+
+    def claim():
+        state["claimed"] = db.claim_outbox_batch(10, 0)
+
+    def complete():
+        db.complete_outbox_batch([(r["id"], r["attempts"], "SENT", 1, None, 0) for r in state["claimed"]])
+
+    return [
+        ("migrate", db.migrate),
+        ("init_db", db.init_db),
+        ("load_drink_catalog", db.load_drink_catalog),
+
+        # Identidad y personas
+        ("_load_assigned_person", lambda: db._load_assigned_person(0)),
+        ("is_admin", lambda: db.is_admin(0)),
+        ("list_available_persons", db.list_available_persons),
+        ("list_active_telegram_user_ids", db.list_active_telegram_user_ids),
+        ("list_active_persons", db.list_active_persons),
+        ("list_persons_by_status", lambda: db.list_persons_by_status("ACTIVE")),
+        ("list_persons_without_active_telegram", db.list_persons_without_active_telegram),
+        ("search_persons_by_name", lambda: db.search_persons_by_name("Bench")),
+        ("add_person", add_scratch),
+        ("upsert_pending_telegram", lambda: db.upsert_pending_telegram(SCRATCH_TG, "bench", "Bench Explain")),
+        ("list_pending_telegrams", db.list_pending_telegrams),
+        ("delete_pending_telegram", lambda: db.delete_pending_telegram(SCRATCH_TG)),
+        ("assign_person", lambda: db.assign_person(SCRATCH_TG, state["scratch"])),
+        ("admin_assign_telegram_to_person", lambda: db.admin_assign_telegram_to_person(state["scratch"], SCRATCH_TG + 1)),
+        ("deactivate_person", lambda: db.deactivate_person(state["scratch"])),
+        ("admin_suspend_person", lambda: db.admin_suspend_person(state["scratch"])),
+        ("admin_reactivate_person", lambda: db.admin_reactivate_person(state["scratch"])),
+        ("get_person_profile", lambda: db.get_person_profile(person_id)),
+
+        # Eventos
+        ("is_first_event_of_year", lambda: db.is_first_event_of_year(person_id, year)),
+        ("insert_event", add),
+        ("void_event", lambda: db.void_event(person_id, 0, state["id"])),
+        ("list_last_events", lambda: db.list_last_events(person_id)),
+        ("list_user_events_page", lambda: db.list_user_events_page(person_id)),
+        ("list_user_events_page(before)", lambda: db.list_user_events_page(person_id, before_id=state["id"])),
+        ("list_user_events_page(after)", lambda: db.list_user_events_page(person_id, after_id=1)),
+
+        # Informes
+        ("list_years_with_data", db.list_years_with_data),
+        ("list_calendar_years_with_data", db.list_calendar_years_with_data),
+        ("report_year", lambda: db.report_year(year)),
+        ("get_person_year_totals", lambda: db.get_person_year_totals(person_id, year)),
+        ("month_summary", lambda: db.month_summary(year, 6)),
+        ("monthly_shame_report", lambda: db.monthly_shame_report(year, 6)),
+        ("person_year_breakdown", lambda: db.person_year_breakdown(person_id, year)),
+        ("year_drinks_totals", lambda: db.year_drinks_totals(year)),
+        ("year_drink_type_person_totals", lambda: db.year_drink_type_person_totals(year)),
+        ("user_stats_periods", lambda: db.user_stats_periods(periods, year_key="year")),
+        ("user_year_stats", lambda: db.user_year_stats(year)),
+        ("period_activity_summary", lambda: db.period_activity_summary(ms, me)),
+        ("range_drinks_totals", lambda: db.range_drinks_totals(ms, me)),
+        ("drink_type_person_totals_periods", lambda: db.drink_type_person_totals_periods(periods)),
+        ("group_month_summary", lambda: db.group_month_summary(year)),
+
+        # Resúmenes automáticos y outbox
+        ("monthly_summary_already_sent", lambda: db.monthly_summary_already_sent(FAR_PERIOD, 1)),
+        ("mark_monthly_summary_sent", lambda: db.mark_monthly_summary_sent(FAR_PERIOD, 1)),
+        ("weekly_summary_already_sent", lambda: db.weekly_summary_already_sent(FAR_PERIOD, 1)),
+        ("mark_weekly_summary_sent", lambda: db.mark_weekly_summary_sent(FAR_PERIOD, 1)),
+        ("beer_year_summary_already_sent", lambda: db.beer_year_summary_already_sent(FAR_PERIOD)),
+        ("mark_beer_year_summary_sent", lambda: db.mark_beer_year_summary_sent(FAR_PERIOD)),
+        ("enqueue_summary", lambda: db.enqueue_summary("monthly", (FAR_PERIOD, 2), "bench")),
+        ("claim_outbox_batch", claim),
+        ("complete_outbox_batch", complete),
+        ("outbox_stats", db.outbox_stats),
+        ("data_version", lambda: db.data_version(year, year + 1)),
+
+        # Mantenimiento (al final: borra la persona temporal y reconstruye el rollup)
+        ("admin_delete_person", lambda: db.admin_delete_person(state["scratch"])),
+        ("check_person_day_drink", db.check_person_day_drink),
+        ("rebuild_person_day_drink", db.rebuild_person_day_drink),
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--year", type=int, default=2025)
+    ap.add_argument("--persons", type=int, default=40)
+    ap.add_argument("--events", type=int, default=100000)
+    ap.add_argument("--years", type=int, default=5, help="años de histórico sembrados hasta --year")
+    args = ap.parse_args()
+
+    use_bench_database()
+    person_ids = seed(args.persons, args.events, dt.date(args.year - args.years + 1, 1, 1), dt.date(args.year, 12, 31))
+    _cleanup()
+    _install()
+
+    calls = _calls(person_ids[0], args.year)
+    missing = db_query_functions() - {name.split("(")[0] for name, _ in calls}
+    if missing:
+        print(f"Funciones de db.py sin caso en _calls: {', '.join(sorted(missing))}")
+        return 2
+
+    for name, call in calls:
+        _current["fn"], _current["n"] = name, 0
+        call()
+    _current["fn"] = None
+
+    flagged = 0
+    for fn, n, scans in _plans:
+        big = [(rel, rows) for rel, rows in scans if rel in BIG_TABLES]
+        expected = fn in FULL_SCAN_EXPECTED
+        flagged += bool(big) and not expected
+        mark = ("full" if expected else "SEQ ") if big else "ok  "
+        detail = ", ".join(f"Seq Scan {rel} (~{rows} filas)" for rel, rows in scans) or "solo índices"
+        print(f"{mark}{fn} #{n}: {detail}")
+
+    _cleanup()
+    print(f"\n{len(calls)} llamadas, {len(_plans)} sentencias, {flagged} con Seq Scan sobre {', '.join(sorted(BIG_TABLES))}"
+          f" (sin contar {', '.join(sorted(FULL_SCAN_EXPECTED))})")
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
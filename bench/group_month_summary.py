@@ -0,0 +1,90 @@
+"""
+group_month_summary: 12 queries (una por mes, sobre drink_events) frente a la
+consulta única sobre person_day_drink.
+
+    BENCH_DATABASE_URL=... python -m bench.group_month_summary --events 50000
+"""
+import argparse
+import calendar
+import datetime as dt
+import time
+
+import db
+from bench.seed import use_bench_database, seed
+
+
+def legacy_group_month_summary(year: int):
+    # Implementación anterior: una conexión y tres escaneos por mes
+    out = []
+    for m in range(1, 13):
+        days_in_month = calendar.monthrange(year, m)[1]
+        start_date = dt.date(year, m, 1)
+        end_date = dt.date(year, m, days_in_month)
+        with db.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                WITH active_days AS (
+                  SELECT e.consumed_at::date AS d
+                  FROM drink_events e
+                  WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
+                  GROUP BY d
+                ),
+                liters_by_day AS (
+                  SELECT e.consumed_at::date AS d,
+                         COALESCE(SUM(e.volume_liters_total), 0) AS liters_day
+                  FROM drink_events e
+                  WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
+                  GROUP BY d
+                )
+                SELECT
+                  COALESCE((SELECT SUM(volume_liters_total) FROM drink_events WHERE is_void=FALSE AND consumed_at BETWEEN %s AND %s), 0) AS liters_total,
+                  COALESCE((SELECT COUNT(*) FROM active_days), 0)::INT AS active_days,
+                  COALESCE((SELECT COUNT(*) FROM liters_by_day WHERE liters_day >= 3.0), 0)::INT AS strong_days
+                """, (start_date, end_date, start_date, end_date, start_date, end_date))
+                r = cur.fetchone()
+        liters_total = float(r["liters_total"] or 0)
+        active_days = int(r["active_days"] or 0)
+        out.append({
+            "month": m,
+            "liters_total": liters_total,
+            "active_days": active_days,
+            "avg_per_active_day": (liters_total / active_days) if active_days else 0.0,
+            "avg_per_calendar_day": liters_total / days_in_month,
+            "zero_days": days_in_month - active_days,
+            "strong_days": int(r["strong_days"] or 0),
+            "days_in_month": days_in_month,
+        })
+    return out
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--year", type=int, default=2025)
+    ap.add_argument("--persons", type=int, default=20)
+    ap.add_argument("--events", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    use_bench_database()
+    seed(args.persons, args.events, dt.date(args.year, 1, 1), dt.date(args.year, 12, 31))
+
+    t_old, old = _best_of(lambda: legacy_group_month_summary(args.year), args.repeat)
+    t_new, new = _best_of(lambda: db.group_month_summary(args.year), args.repeat)
+
+    print(f"eventos={args.events} personas={args.persons} año={args.year}")
+    print(f"antes  (12 queries): {t_old * 1000:8.1f} ms")
+    print(f"ahora  (1 query)   : {t_new * 1000:8.1f} ms")
+    print(f"salida idéntica    : {old == new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Mide cuánto se bloquea el event loop mientras corre un informe pesado,
+llamándolo directamente (como antes) o a través de db_async.run_db.
+
+    python -m bench.loop_stall            # informe real (necesita DATABASE_URL)
+    python -m bench.loop_stall --fake 0.5 # simula una query de 0,5 s sin BD
+"""
+import argparse
+import asyncio
+import datetime as dt
+import time
+import functools
+
+TICK_S = 0.005
+
+
+async def _ticker(stop: asyncio.Event, lags: list):
+    # Cada tick debería despertar a los TICK_S; el retraso es el bloqueo del loop
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK_S)
+        lags.append(time.perf_counter() - t0 - TICK_S)
+
+
+async def _measure(report, offload: bool):
+    from db_async import run_db
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(stop, lags))
+    await asyncio.sleep(TICK_S * 4)
+
+    t0 = time.perf_counter()
+    if offload:
+        await run_db(report)
+    else:
+        report()
+    elapsed = time.perf_counter() - t0
+
+    await asyncio.sleep(TICK_S * 4)
+    stop.set()
+    await ticker
+    return {"report_s": elapsed, "max_stall_s": max(lags, default=0.0)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fake", type=float, default=None, help="segundos de query simulada (sin BD)")
+    ap.add_argument("--year", type=int, default=dt.date.today().year)
+    args = ap.parse_args()
+
+    if args.fake is not None:
+        report = functools.partial(time.sleep, args.fake)
+    else:
+        import db
+        report = functools.partial(db.user_year_stats, args.year)
+        report()  # calienta pool y caché del servidor
+
+    for offload in (False, True):
+        r = asyncio.run(_measure(report, offload))
+        mode = "run_db " if offload else "directo"
+        print(f"{mode}: informe {r['report_s'] * 1000:8.1f} ms · bloqueo máx. del loop {r['max_stall_s'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
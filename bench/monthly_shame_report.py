@@ -0,0 +1,306 @@
+"""
+monthly_shame_report: post-proceso anterior (re-ordena cada día dos veces y busca
+con next(...) por persona y día) frente al motor sobre arrays por persona.
+
+Sin base de datos: genera un grid sintético (personas x días del mes) y compara
+salida y tiempos del post-proceso.
+
+    python -m bench.monthly_shame_report --persons 60
+
+Con --db compara además la función completa sobre BENCH_DATABASE_URL:
+
+    BENCH_DATABASE_URL=... python -m bench.monthly_shame_report --db --events 50000
+"""
+import argparse
+import calendar
+import datetime as dt
+import random
+import time
+from decimal import Decimal
+
+import db
+from bench.seed import use_bench_database, seed
+
+
+def legacy_monthly_shame_report(year: int, month: int, close_liters: float = 0.5):
+    # Implementación anterior completa (query densa + post-proceso), referencia dorada
+    start, end = db._month_range(year, month)
+
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            # Personas activas del mes (han registrado algo)
+            cur.execute("""
+            SELECT DISTINCT p.id AS person_id, p.name AS name
+            FROM person_day_drink r
+            JOIN persons p ON p.id = r.person_id
+            WHERE r.day >= %s
+              AND r.day < %s
+              AND p.status='ACTIVE'
+            ORDER BY p.name;
+            """, (start, end))
+            persons = cur.fetchall()
+
+            # Mínimo 2 personas activas para no humillar a alguien solo
+            if len(persons) < 2:
+                return None
+
+            person_ids = [r["person_id"] for r in persons]
+
+            # Grid día x persona con litros diarios y acumulados
+            cur.execute("""
+            WITH calendar AS (
+              SELECT generate_series(%s::date, (%s::date - interval '1 day'), interval '1 day')::date AS day
+            ),
+            daily AS (
+              SELECT
+                r.person_id,
+                r.day,
+                SUM(r.liters)::numeric AS liters
+              FROM person_day_drink r
+              WHERE r.day >= %s
+                AND r.day < %s
+                AND r.person_id = ANY(%s)
+              GROUP BY r.person_id, r.day
+            ),
+            grid AS (
+              SELECT
+                c.day,
+                p.id AS person_id,
+                p.name AS name,
+                COALESCE(d.liters, 0)::numeric AS liters
+              FROM calendar c
+              CROSS JOIN (SELECT id, name FROM persons WHERE id = ANY(%s)) p
+              LEFT JOIN daily d
+                ON d.person_id = p.id AND d.day = c.day
+            )
+            SELECT
+              day,
+              person_id,
+              name,
+              liters,
+              SUM(liters) OVER (PARTITION BY person_id ORDER BY day) AS cum_liters
+            FROM grid
+            ORDER BY day ASC, name ASC;
+            """, (start, end, start, end, person_ids, person_ids))
+            rows = cur.fetchall()
+
+    return legacy_postprocess(year, month, rows, close_liters)
+
+
+def legacy_postprocess(year: int, month: int, rows, close_liters: float = 0.5):
+    # Post-proceso anterior, tal cual: O(días x personas²)
+    days = []
+    by_day = {}  # day -> list of dicts (name, liters, cum_liters)
+    for r in rows:
+        day = r["day"]
+        if day not in by_day:
+            by_day[day] = []
+            days.append(day)
+        by_day[day].append({
+            "person_id": r["person_id"],
+            "name": r["name"],
+            "liters": float(r["liters"] or 0),
+            "cum_liters": float(r["cum_liters"] or 0),
+        })
+
+    def rank_day(entries):
+        # ranking por litros acumulados (desc). Desempate por nombre.
+        sorted_entries = sorted(entries, key=lambda x: (x["cum_liters"], x["name"]), reverse=True)
+        for i, e in enumerate(sorted_entries, 1):
+            e["_rank"] = i
+        leader = sorted_entries[0] if sorted_entries else None
+        return sorted_entries, leader
+
+    leaders = set()
+    first_lead_day = {}
+    ranks_by_person = {}   # name -> list of ranks over days (solo días con cum>0)
+    final_cum = {}         # name -> cum en el último día
+    daily_liters_by_day = {}
+
+    for day in days:
+        entries = by_day[day]
+        daily_liters_by_day[day] = sum(e["liters"] for e in entries)
+
+        ranked, leader = rank_day(entries)
+        if leader and leader["cum_liters"] > 0:
+            leaders.add(leader["name"])
+            first_lead_day.setdefault(leader["name"], day)
+
+        for e in ranked:
+            if e["cum_liters"] > 0:
+                ranks_by_person.setdefault(e["name"], []).append(e["_rank"])
+
+    last_day = days[-1]
+    final_entries, final_leader = rank_day(by_day[last_day])
+    final_ranking = [(e["name"], e["cum_liters"]) for e in final_entries]
+    for e in final_entries:
+        final_cum[e["name"]] = e["cum_liters"]
+
+    # 1) Falso líder: fue líder algún día pero NO termina líder
+    false_leader = None
+    if final_leader:
+        for name in sorted(leaders, key=lambda n: first_lead_day.get(n)):
+            if name != final_leader["name"]:
+                final_rank = next((i for i, (n, _) in enumerate(final_ranking, 1) if n == name), None)
+                false_leader = {"name": name, "first_day": first_lead_day.get(name), "final_rank": final_rank}
+                break
+
+    # 2) Mayor caída: mejor rank (mínimo) vs rank final
+    biggest_drop = None
+    max_drop = 0
+    for name, ranks in ranks_by_person.items():
+        if not ranks:
+            continue
+        best_rank = min(ranks)
+        final_rank = next((i for i, (n, _) in enumerate(final_ranking, 1) if n == name), None)
+        if final_rank is None:
+            continue
+        drop = final_rank - best_rank
+        if drop > max_drop:
+            max_drop = drop
+            biggest_drop = {"name": name, "best_rank": best_rank, "final_rank": final_rank, "drop": drop}
+
+    # 3) Casi campeón: días a <= close_liters del líder sin ser líder
+    almost_counts = {}
+    for day in days:
+        ranked, leader = rank_day(by_day[day])
+        if not leader or leader["cum_liters"] <= 0:
+            continue
+        leader_name = leader["name"]
+        leader_c = leader["cum_liters"]
+        for e in ranked[1:]:
+            if e["cum_liters"] <= 0 or e["name"] == leader_name:
+                continue
+            if leader_c - e["cum_liters"] <= close_liters:
+                almost_counts[e["name"]] = almost_counts.get(e["name"], 0) + 1
+
+    almost_champion = None
+    if almost_counts:
+        name = max(almost_counts.keys(), key=lambda n: (almost_counts[n], float(final_cum.get(n, 0)), n))
+        almost_champion = {"name": name, "times": almost_counts[name]}
+
+    # 4) Fantasma: más días en blanco (solo entre los que han bebido alguna vez ese mes)
+    days_in_month = len(days)
+    blank_counts = {}
+    for name in final_cum.keys():
+        blank = 0
+        for day in days:
+            entry = next((e for e in by_day[day] if e["name"] == name), None)
+            if entry and entry["liters"] == 0:
+                blank += 1
+        blank_counts[name] = blank
+
+    ghost = None
+    if blank_counts:
+        gname = max(blank_counts.keys(), key=lambda n: (blank_counts[n], n))
+        ghost = {"name": gname, "blank_days": blank_counts[gname], "days": days_in_month}
+
+    # 5) Semana más triste (lunes-domingo) dentro del rango del mes
+    week_totals = {}
+    for day, total in daily_liters_by_day.items():
+        week_start = day - dt.timedelta(days=day.weekday())  # lunes
+        week_totals[week_start] = week_totals.get(week_start, 0.0) + float(total)
+
+    saddest_week = None
+    if week_totals:
+        w = min(week_totals.keys(), key=lambda d: (week_totals[d], d))
+        saddest_week = {"week_start": w, "liters": float(week_totals[w])}
+
+    return {
+        "year": year,
+        "month": month,
+        "final_leader": final_leader["name"] if final_leader else None,
+        "final_ranking": final_ranking,  # list[(name, liters)]
+        "false_leader": false_leader,
+        "biggest_drop": biggest_drop,
+        "almost_champion": almost_champion,
+        "ghost": ghost,
+        "saddest_week": saddest_week,
+    }
+
+
+def synthetic_rows(n_persons: int, year: int, month: int, rnd_seed: int = 0):
+    """Grid denso (día, persona) como el de la query, ordenado por día y nombre."""
+    rnd = random.Random(rnd_seed)
+    days_in_month = calendar.monthrange(year, month)[1]
+    names = [f"Bench{i:04d}" for i in range(n_persons)]
+    sizes = [Decimal("0.200"), Decimal("0.330"), Decimal("0.500"), Decimal("1.000")]
+    cum = {n: Decimal(0) for n in names}
+    rows = []
+    for d in range(1, days_in_month + 1):
+        day = dt.date(year, month, d)
+        for pid, name in enumerate(names):
+            liters = Decimal(0)
+            if rnd.random() < 0.4:
+                liters = sum(rnd.choice(sizes) for _ in range(rnd.randint(1, 4)))
+            cum[name] += liters
+            rows.append({"day": day, "person_id": pid, "name": name, "liters": liters, "cum_liters": cum[name]})
+    return rows
+
+
+def new_postprocess(year: int, month: int, rows, close_liters: float = 0.5):
+    # Arrays por persona a partir del grid denso sintético
+    days, names, pos, liters, cum = [], [], {}, [], []
+    for r in rows:
+        if not days or days[-1] != r["day"]:
+            days.append(r["day"])
+        i = pos.get(r["person_id"])
+        if i is None:
+            i = pos[r["person_id"]] = len(names)
+            names.append(r["name"])
+            liters.append([])
+            cum.append([])
+        liters[i].append(float(r["liters"] or 0))
+        cum[i].append(float(r["cum_liters"] or 0))
+    return {"year": year, "month": month, **db._shame_stats(days, names, liters, cum, close_liters)}
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--year", type=int, default=2025)
+    ap.add_argument("--month", type=int, default=3)
+    ap.add_argument("--persons", type=int, default=60)
+    ap.add_argument("--seeds", type=int, default=20, help="grids sintéticos a comparar")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--db", action="store_true")
+    ap.add_argument("--events", type=int, default=50000)
+    args = ap.parse_args()
+
+    mismatches = 0
+    for s in range(args.seeds):
+        rows = synthetic_rows(args.persons, args.year, args.month, rnd_seed=s)
+        for close in (0.0, 0.5, 2.0):
+            if legacy_postprocess(args.year, args.month, rows, close) != new_postprocess(args.year, args.month, rows, close):
+                mismatches += 1
+                print(f"DIFERENCIA seed={s} close_liters={close}")
+
+    rows = synthetic_rows(args.persons, args.year, args.month)
+    t_old, _ = _best_of(lambda: legacy_postprocess(args.year, args.month, rows), args.repeat)
+    t_new, _ = _best_of(lambda: new_postprocess(args.year, args.month, rows), args.repeat)
+
+    print(f"personas={args.persons} mes={args.year}-{args.month:02d} grids={args.seeds}")
+    print(f"post-proceso antes : {t_old * 1000:8.1f} ms")
+    print(f"post-proceso ahora : {t_new * 1000:8.1f} ms")
+    print(f"salida idéntica    : {mismatches == 0}")
+
+    if args.db:
+        use_bench_database()
+        seed(args.persons, args.events, dt.date(args.year, 1, 1), dt.date(args.year, 12, 31))
+        t_old, old = _best_of(lambda: legacy_monthly_shame_report(args.year, args.month), args.repeat)
+        t_new, new = _best_of(lambda: db.monthly_shame_report(args.year, args.month), args.repeat)
+        print(f"función completa antes: {t_old * 1000:8.1f} ms")
+        print(f"función completa ahora: {t_new * 1000:8.1f} ms")
+        print(f"salida idéntica (BD)  : {old == new}")
+
+
+if __name__ == "__main__":
+    main()
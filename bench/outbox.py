@@ -0,0 +1,102 @@
+"""
+Outbox de resúmenes: rendimiento del worker según concurrencia y entrega tras
+un "crash" a mitad de lote, contra la Bot API falsa de bench.broadcast.
+
+    BENCH_DATABASE_URL=... python -m bench.outbox --recipients 500
+
+Vacía summary_outbox de BENCH_DATABASE_URL.
+"""
+import argparse
+import asyncio
+import time
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+import db
+import outbox
+from bench.broadcast import FakeBotAPI, TOKEN
+from bench.seed import use_bench_database
+from broadcast import Broadcaster
+
+
+def _fill(n: int, key: str):
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM summary_outbox;")
+            cur.execute("""
+            INSERT INTO summary_outbox(summary_key, chat_id, text)
+            SELECT %s, 10000 + g, 'Resumen de prueba' FROM generate_series(0, %s - 1) AS g;
+            """, (key, n))
+            conn.commit()
+
+
+def _check(api: FakeBotAPI, n: int):
+    missing = n - len(api.delivered)
+    dup = sum(1 for v in api.delivered.values() if v > 1)
+    return missing, dup
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency, args.telegram_limit, args.error_rate)
+    port = await api.start()
+    bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot",
+              request=HTTPXRequest(connection_pool_size=max(args.concurrency) + 4))
+    outbox.OUTBOX_RETRY_BASE_S = 0.2  # reintentos en segundos, no minutos
+
+    async with bot:
+        print(f"destinatarios={args.recipients} latencia={args.latency * 1000:.0f} ms "
+              f"límite API={args.telegram_limit}/s errores red={args.error_rate:.0%}")
+        for c in args.concurrency:
+            _fill(args.recipients, f"bench:c{c}")
+            api.delivered.clear()
+            engine = Broadcaster(global_rate=args.rate, concurrency=c, max_attempts=3, backoff_base=0.05)
+            t0 = time.monotonic()
+            totals = {"sent": 0}
+            while totals["sent"] < args.recipients:
+                step = await outbox.drain_outbox(bot, engine, batch=args.batch)
+                totals["sent"] += step["sent"]
+                if not step["sent"] and not step["retry"]:
+                    await asyncio.sleep(0.2)  # esperando a que venzan los reintentos
+            elapsed = time.monotonic() - t0
+            missing, dup = _check(api, args.recipients)
+            print(f"concurrencia {c:3d}: {args.recipients / elapsed:7.1f} msg/s "
+                  f"({elapsed:5.2f} s, {missing} sin entregar, {dup} duplicados)")
+
+        # Crash: un worker reserva un lote y muere sin enviar ni cerrarlo
+        _fill(args.recipients, "bench:crash")
+        api.delivered.clear()
+        claimed = db.claim_outbox_batch(args.batch, 1.0)
+        await asyncio.sleep(1.1)  # vence el lease
+        engine = Broadcaster(global_rate=args.rate, concurrency=max(args.concurrency), backoff_base=0.05)
+        sent = 0
+        while sent < args.recipients:
+            step = await outbox.drain_outbox(bot, engine, batch=args.batch)
+            sent += step["sent"]
+            if not step["sent"]:
+                await asyncio.sleep(0.2)
+        missing, dup = _check(api, args.recipients)
+        print(f"tras crash con {len(claimed)} reservados: {missing} sin entregar, {dup} duplicados")
+        print(db.outbox_stats())
+
+    await api.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recipients", type=int, default=500)
+    ap.add_argument("--latency", type=float, default=0.08)
+    ap.add_argument("--telegram-limit", type=int, default=1000, help="mensajes/s antes de responder 429")
+    ap.add_argument("--error-rate", type=float, default=0.02)
+    ap.add_argument("--rate", type=float, default=1000, help="límite global del motor (mensajes/s)")
+    ap.add_argument("--batch", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 20])
+    args = ap.parse_args()
+
+    use_bench_database()
+    db.init_db()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
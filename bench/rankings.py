@@ -0,0 +1,152 @@
+"""
+rankings: consultas de los botones de ranking antes y ahora, para semana, mes y año.
+
+- Por usuarios: user_stats_range de la semana y del mes más user_year_stats,
+  frente a la consulta única de user_stats_periods.
+- Por tipos de bebida: dos consultas por periodo (totales por bebida y por
+  bebida x persona) frente a la consulta única de drink_type_person_totals_periods.
+
+    BENCH_DATABASE_URL=... python -m bench.rankings --events 50000
+
+Suspende una persona para que los totales globales la cuenten y el ranking por
+persona no. Compara salida y tiempos.
+"""
+import argparse
+import datetime as dt
+import time
+
+import db
+from bench.seed import use_bench_database, seed
+
+
+def legacy_user_stats_range(start_date: dt.date, end_date: dt.date):
+    # Entrada anterior por rango (una consulta por periodo) sobre el motor actual
+    rows = db._user_stats_rows({"range": (start_date, end_date)})["range"]
+    return [db._user_stats_item(r) for r in rows]
+
+
+def legacy_drink_type_person_totals_range(start_date: dt.date, end_date: dt.date):
+    # Implementación anterior: totales por (bebida x persona ACTIVE) de un rango
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT
+              dt.category AS category,
+              dt.label AS label,
+              p.name AS person,
+              COALESCE(SUM(r.units), 0)::INT AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
+              (dt.volume_liters IS NOT NULL) AS has_liters
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            JOIN persons p ON p.id = r.person_id
+            WHERE r.day BETWEEN %s AND %s
+              AND p.status='ACTIVE'
+            GROUP BY dt.category, dt.label, p.name, dt.volume_liters
+            HAVING COALESCE(SUM(r.units),0) > 0
+            ORDER BY dt.category, dt.label, litros DESC, unidades DESC, p.name ASC;
+            """, (start_date, end_date))
+            return cur.fetchall()
+
+
+def legacy_drink_type_totals_range(start_date: dt.date, end_date: dt.date):
+    # Implementación anterior: totales por bebida (todas las personas) de un rango
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT
+              dt.category AS category,
+              dt.label AS label,
+              COALESCE(SUM(r.units), 0)::INT AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
+              (dt.volume_liters IS NOT NULL) AS has_liters
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            WHERE r.day BETWEEN %s AND %s
+            GROUP BY dt.category, dt.label, dt.volume_liters
+            HAVING COALESCE(SUM(r.units),0) > 0
+            ORDER BY dt.category, dt.label;
+            """, (start_date, end_date))
+            return cur.fetchall()
+
+
+def _periods(today: dt.date) -> dict:
+    ws = today - dt.timedelta(days=today.weekday())
+    ms = today.replace(day=1)
+    me = (ms + dt.timedelta(days=32)).replace(day=1) - dt.timedelta(days=1)
+    return {
+        "week": (ws, ws + dt.timedelta(days=6)),
+        "month": (ms, me),
+        "year": (dt.date(today.year, 1, 1), dt.date(today.year, 12, 31)),
+    }
+
+
+def legacy_users(periods: dict) -> dict:
+    return {
+        "week": legacy_user_stats_range(*periods["week"]),
+        "month": legacy_user_stats_range(*periods["month"]),
+        "year": db.user_year_stats(periods["year"][0].year),
+    }
+
+
+def new_users(periods: dict) -> dict:
+    return db.user_stats_periods(periods, year_key="year")
+
+
+def legacy_types(periods: dict) -> dict:
+    return {
+        key: {
+            "totals": [dict(r) for r in legacy_drink_type_totals_range(*rng)],
+            "persons": [dict(r) for r in legacy_drink_type_person_totals_range(*rng)],
+        }
+        for key, rng in periods.items()
+    }
+
+
+def new_types(periods: dict) -> dict:
+    # Lo que hace render_types_block con las filas de cada periodo
+    fields = ("category", "label", "person", "unidades", "litros", "has_liters")
+    out = {}
+    for key, rows in db.drink_type_person_totals_periods(periods).items():
+        out[key] = {
+            "totals": db.drink_type_totals_from_person_rows(rows),
+            "persons": [{f: r[f] for f in fields} for r in rows if r["active"]],
+        }
+    return out
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--persons", type=int, default=40)
+    ap.add_argument("--events", type=int, default=50000)
+    ap.add_argument("--today", type=dt.date.fromisoformat, default=dt.date(2025, 6, 18))
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    use_bench_database()
+    person_ids = seed(args.persons, args.events, dt.date(args.today.year, 1, 1), dt.date(args.today.year, 12, 31))
+    db.admin_suspend_person(person_ids[0])
+    periods = _periods(args.today)
+
+    print(f"personas={args.persons} eventos={args.events} hoy={args.today}")
+    for name, legacy, new in (("usuarios", legacy_users, new_users), ("tipos", legacy_types, new_types)):
+        with db.track_queries() as q_old:
+            t_old, old = _best_of(lambda: legacy(periods), args.repeat)
+        with db.track_queries() as q_new:
+            t_new, new = _best_of(lambda: new(periods), args.repeat)
+        print(f"ranking por {name:8s} antes: {t_old * 1000:8.1f} ms ({q_old['queries'] // args.repeat} consultas)")
+        print(f"ranking por {name:8s} ahora: {t_new * 1000:8.1f} ms ({q_new['queries'] // args.repeat} consultas)")
+        print(f"salida idéntica ({name}): {old == new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+reports: tiempo de cada función de informes de db.py a varios tamaños de datos,
+con datos de seed_realistic (mismo seed -> mismos datos). Escribe JSON para
+comparar entre commits.
+
+    BENCH_DATABASE_URL=... python -m bench.reports --sizes 10000,100000 --out base.json
+    BENCH_DATABASE_URL=... python -m bench.reports --sizes 10000,100000 --out new.json --compare base.json
+
+Por función y tamaño: min/mediana/p95/media en ms sobre --repeat ejecuciones
+(tras una de calentamiento), consultas por llamada y filas devueltas. Sin --out
+el JSON va a stdout; el progreso y la comparación, a stderr.
+"""
+import argparse
+import datetime as dt
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import db
+from bench.seed import seed_realistic, use_bench_database
+
+# Ratio nueva/base a partir del que --compare marca una regresión
+REGRESSION_RATIO = 1.2
+
+
+def cases(data: dict) -> list:
+    """
+    (nombre, función, args[, filas]) sobre el último año de los datos y su persona
+    más activa. filas(resultado) -> nº de filas; por defecto _rows.
+    """
+    year = data["beer_years"][-1]
+    pid = data["person_ids"][0]
+    ms, me = dt.date(year, 6, 1), dt.date(year, 6, 30)
+    ws = dt.date(year, 6, 15) - dt.timedelta(days=dt.date(year, 6, 15).weekday())
+    we = ws + dt.timedelta(days=6)
+    ys, ye = dt.date(year, 1, 1), dt.date(year, 12, 31)
+    periods = {"week": (ws, we), "month": (ms, me), "year": (ys, ye)}
+    return [
+        ("report_year", db.report_year, (year,)),
+        ("list_years_with_data", db.list_years_with_data, ()),
+        ("list_calendar_years_with_data", db.list_calendar_years_with_data, ()),
+        ("month_summary", db.month_summary, (year, 6)),
+        ("monthly_shame_report", db.monthly_shame_report, (year, 6)),
+        ("group_month_summary", db.group_month_summary, (year,)),
+        ("user_year_stats", db.user_year_stats, (year,)),
+        ("user_stats_periods", db.user_stats_periods, (periods, "year")),
+        ("period_activity_summary:week", db.period_activity_summary, (ws, we)),
+        ("period_activity_summary:month", db.period_activity_summary, (ms, me)),
+        ("range_drinks_totals:month", db.range_drinks_totals, (ms, me)),
+        ("drink_type_person_totals_periods", db.drink_type_person_totals_periods, (periods,)),
+        ("year_drinks_totals", db.year_drinks_totals, (year,)),
+        ("year_drink_type_person_totals", db.year_drink_type_person_totals, (year,)),
+        ("person_year_breakdown", db.person_year_breakdown, (pid, year)),
+        ("get_person_year_totals", db.get_person_year_totals, (pid, year)),
+        ("get_person_profile", db.get_person_profile, (pid,)),
+        ("list_last_events", db.list_last_events, (pid, 5)),
+        ("list_user_events_page:first", db.list_user_events_page, (pid, 15), _page_rows),
+        ("list_user_events_page:older", db.list_user_events_page, (pid, 15, _middle_event_id(pid)), _page_rows),
+    ]
+
+
+def _middle_event_id(person_id: int) -> int:
+    # Cursor a mitad del historial: una página "más antiguas" lejos del final
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT id FROM drink_events WHERE person_id=%s AND is_void=FALSE
+            ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM drink_events WHERE person_id=%s AND is_void=FALSE) LIMIT 1;
+            """, (person_id, person_id))
+            row = cur.fetchone()
+            return row["id"] if row else 0
+
+
+def _rows(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, dict):
+        # Resultados por periodo ({"week": [...], ...}): filas de sus listas
+        lists = [v for v in result.values() if isinstance(v, list)]
+        return sum(map(len, lists)) if lists else len(result)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def _page_rows(result) -> int:
+    # list_user_events_page -> (página, hay_más_antiguas, hay_más_nuevas)
+    return len(result[0])
+
+
+def time_case(fn, args, repeat: int, rows=_rows) -> dict:
+    fn(*args)  # calentamiento: caché del catálogo, planes, buffers
+    times = []
+    for _ in range(repeat):
+        with db.track_queries() as stats:
+            t0 = time.perf_counter()
+            result = fn(*args)
+            times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {
+        "min_ms": round(times[0], 3),
+        "median_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[min(len(times) - 1, int(0.95 * len(times)))], 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "queries": stats["queries"],
+        "rows": rows(result),
+    }
+
+
+def run_size(n_events: int, args) -> dict:
+    years = list(range(args.first_year, args.first_year + args.years))
+    t0 = time.perf_counter()
+    data = seed_realistic(args.persons, n_events, years, rnd_seed=args.seed)
+    seed_s = time.perf_counter() - t0
+    results = {}
+    for name, fn, fn_args, *rows in cases(data):
+        results[name] = time_case(fn, fn_args, args.repeat, *rows)
+        r = results[name]
+        print(f"  {name:38s} {r['median_ms']:9.2f} ms (p95 {r['p95_ms']:8.2f}) {r['queries']:3d} q {r['rows']:6d} filas", file=sys.stderr)
+    return {"events": n_events, "persons": args.persons, "beer_years": years, "seed_s": round(seed_s, 2), "results": results}
+
+
+def _meta(args) -> dict:
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SHOW server_version;")
+            pg = cur.fetchone()["server_version"]
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "postgres": pg,
+        "args": vars(args),
+    }
+
+
+def compare(base: dict, new: dict) -> int:
+    """
+    Imprime (en stderr: stdout puede llevar el JSON) la mediana base/nueva por
+    función y tamaño. Devuelve el nº de regresiones.
+    """
+    err = sys.stderr
+    base_sizes = {s["events"]: s["results"] for s in base["sizes"]}
+    regressions = 0
+    print(f"\ncomparación con {(base['meta'].get('commit') or '?')[:10]}:", file=err)
+    for size in new["sizes"]:
+        old = base_sizes.get(size["events"])
+        if old is None:
+            print(f"  {size['events']} eventos: sin datos en la base", file=err)
+            continue
+        print(f"  {size['events']} eventos", file=err)
+        for name, r in size["results"].items():
+            if name not in old:
+                continue
+            ratio = r["median_ms"] / old[name]["median_ms"] if old[name]["median_ms"] else float("inf")
+            flag = "  ⚠ regresión" if ratio >= REGRESSION_RATIO else ""
+            regressions += bool(flag)
+            print(f"    {name:38s} {old[name]['median_ms']:9.2f} -> {r['median_ms']:9.2f} ms  x{ratio:5.2f}{flag}", file=err)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000", help="nº de eventos por ejecución, separados por comas")
+    ap.add_argument("--persons", type=int, default=40)
+    ap.add_argument("--first-year", type=int, default=2022, help="primer año cervecero")
+    ap.add_argument("--years", type=int, default=3, help="nº de años cerveceros")
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="fichero JSON de resultados (por defecto, stdout)")
+    ap.add_argument("--compare", help="JSON de una ejecución anterior; sale con 1 si hay regresiones")
+    args = ap.parse_args()
+
+    use_bench_database()
+    out = {"meta": _meta(args), "sizes": []}
+    for n_events in (int(x) for x in args.sizes.split(",")):
+        print(f"{n_events} eventos, {args.persons} personas, {args.years} años", file=sys.stderr)
+        out["sizes"].append(run_size(n_events, args))
+
+    text = json.dumps(out, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"resultados en {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        if compare(base, out):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Generadores deterministas de datos sintéticos para benchmarks.
+
+- seed: eventos uniformes (días, personas y tipos al azar).
+- seed_realistic: varios años cerveceros con la forma del uso real (más los
+  viernes y sábados, pocas personas con mucho consumo, cañas y tercios más que
+  chupitos, anulaciones) y todos los tipos de DRINKS_SEED presentes.
+
+Escribe en BENCH_DATABASE_URL (nunca en DATABASE_URL): la base de datos
+se vacía de eventos antes de sembrar, así que debe ser desechable.
+"""
+import os
+import sys
+import random
+import datetime as dt
+
+from psycopg2.extras import execute_values
+
+import db
+
+
+def use_bench_database():
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if not url:
+        sys.exit("Define BENCH_DATABASE_URL apuntando a una base de datos desechable.")
+    db.close_pool()
+    db.DATABASE_URL = url
+
+
+def seed(n_persons: int, n_events: int, start: dt.date, end: dt.date, rnd_seed: int = 0, void_ratio: float = 0.05):
+    """
+    Vacía drink_events/person_day_drink y genera n_events eventos de n_persons personas
+    ACTIVE entre start y end (inclusive). Devuelve los ids de las personas.
+    """
+    db.init_db()
+    rnd = random.Random(rnd_seed)
+    types = list(db.drink_catalog()["by_id"].values())
+    days = (end - start).days + 1
+
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            person_ids = _reset(cur, n_persons)
+            rows = []
+            for _ in range(n_events):
+                t = rnd.choice(types)
+                qty = rnd.randint(1, 4)
+                day = start + dt.timedelta(days=rnd.randrange(days))
+                vol = None if t["volume_liters"] is None else t["volume_liters"] * qty
+                rows.append((
+                    rnd.choice(person_ids), 0, t["id"], qty, day, db.beer_year_start_for(day),
+                    vol, t["unit_price_eur"] * qty, rnd.random() < void_ratio,
+                ))
+            execute_values(cur, """
+                INSERT INTO drink_events(
+                  person_id, telegram_user_id, drink_type_id, quantity, consumed_at,
+                  year_start, volume_liters_total, price_eur_total, is_void
+                ) VALUES %s;
+            """, rows, page_size=5000)
+            conn.commit()
+
+    _finish()
+    return person_ids
+
+
+# Lunes..domingo: el grueso cae en viernes y sábado
+WEEKDAY_WEIGHTS = (0.55, 0.6, 0.75, 1.0, 1.9, 2.2, 1.0)
+# Popularidad por código de DRINKS_SEED (los que no estén pesan 1)
+DRINK_WEIGHTS = {
+    "CANA": 30, "TERCIO": 18, "JARRA": 10, "BOTELLIN": 8, "CORTAITA": 6, "JARRITA": 6, "LATA33": 6,
+    "TANQUE": 4, "LATA50": 3, "LITRO": 2, "CUBATA": 6, "PIEDRA": 2, "CHUPITO": 5,
+}
+QTY_WEIGHTS = {1: 62, 2: 22, 3: 9, 4: 4, 6: 3}
+
+
+def _day_weight(day: dt.date) -> float:
+    w = WEEKDAY_WEIGHTS[day.weekday()]
+    if day.month in (7, 8):
+        w *= 1.2  # verano
+    if (day.month == 12 and day.day >= 15) or (day.month == 1 and day.day <= 6):
+        w *= 1.4  # Navidad (y cierre del año cervecero)
+    return w
+
+
+def seed_realistic(n_persons: int, n_events: int, beer_years: list, rnd_seed: int = 0, void_ratio: float = 0.03):
+    """
+    Vacía drink_events/person_day_drink y genera n_events eventos repartidos en
+    los años cerveceros beer_years (7 ene -> 6 ene). Los ids siguen el orden de
+    consumed_at, como en uso real. Devuelve {"person_ids" (de más a menos
+    activa), "start", "end", "beer_years"}.
+    """
+    db.init_db()
+    rnd = random.Random(rnd_seed)
+    catalog = db.drink_catalog()["by_id"]
+    types = sorted(catalog.values(), key=lambda t: t["id"])
+    type_weights = [DRINK_WEIGHTS.get(t["code"], 1) for t in types]
+    start = db.beer_year_range(min(beer_years))[0]
+    end = db.beer_year_range(max(beer_years))[1]
+    days = [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+    day_weights = [_day_weight(d) for d in days]
+
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            person_ids = _reset(cur, n_persons)
+            # Actividad de cola larga: unos pocos beben mucho, la mayoría poco
+            activity = sorted((rnd.lognormvariate(0, 1) for _ in person_ids), reverse=True)
+
+            picked_types = rnd.choices(types, type_weights, k=n_events)
+            picked_types[:len(types)] = types  # todos los tipos aparecen al menos una vez
+            rows = []
+            for t, pid, day, qty in zip(
+                picked_types,
+                rnd.choices(person_ids, activity, k=n_events),
+                rnd.choices(days, day_weights, k=n_events),
+                rnd.choices(list(QTY_WEIGHTS), list(QTY_WEIGHTS.values()), k=n_events),
+            ):
+                vol = None if t["volume_liters"] is None else t["volume_liters"] * qty
+                created = dt.datetime.combine(day, dt.time(18)) + dt.timedelta(minutes=rnd.randrange(8 * 60))
+                rows.append((
+                    pid, 0, t["id"], qty, day, db.beer_year_start_for(day),
+                    vol, t["unit_price_eur"] * qty, rnd.random() < void_ratio, created,
+                ))
+            rows.sort(key=lambda r: r[9])
+            execute_values(cur, """
+                INSERT INTO drink_events(
+                  person_id, telegram_user_id, drink_type_id, quantity, consumed_at,
+                  year_start, volume_liters_total, price_eur_total, is_void, created_at
+                ) VALUES %s;
+            """, rows, page_size=5000)
+            conn.commit()
+
+    _finish()
+    return {"person_ids": person_ids, "start": start, "end": end, "beer_years": sorted(beer_years)}
+
+
+def _reset(cur, n_persons: int) -> list:
+    # Vacía los eventos y deja n_persons personas Bench ACTIVE (ids por nombre)
+    cur.execute("DELETE FROM person_day_drink;")
+    cur.execute("DELETE FROM drink_events;")
+    execute_values(
+        cur,
+        "INSERT INTO persons(name, status) VALUES %s ON CONFLICT (name) DO NOTHING;",
+        [(f"Bench{i:04d}", "ACTIVE") for i in range(n_persons)],
+    )
+    cur.execute("SELECT id FROM persons WHERE name LIKE 'Bench%%' ORDER BY name LIMIT %s;", (n_persons,))
+    person_ids = [r["id"] for r in cur.fetchall()]
+    cur.execute("UPDATE persons SET status='ACTIVE' WHERE id = ANY(%s);", (person_ids,))
+    return person_ids
+
+
+def _finish():
+    db.rebuild_person_day_drink()
+    with db.get_conn() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # VACUUM marca el visibility map: sin él no hay index-only scans
+            for table in ("drink_events", "person_day_drink", "persons", "drink_types"):
+                cur.execute(f"VACUUM ANALYZE {table};")
+        conn.autocommit = False
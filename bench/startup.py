@@ -0,0 +1,85 @@
+"""
+Tiempo de arranque de init_db: esquema vacío (todas las migraciones pendientes),
+esquema al día (ninguna pendiente) y el arranque anterior, que repetía todo el
+DDL y la siembra fila a fila en cada proceso.
+
+    BENCH_DATABASE_URL=... python -m bench.startup
+
+Borra y recrea el esquema public de BENCH_DATABASE_URL.
+"""
+import argparse
+import time
+
+import db
+from bench.seed import use_bench_database
+
+
+def _reset_schema():
+    db.get_pool().open()
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    db.close_pool()
+    db.invalidate_drink_catalog()
+
+
+def legacy_boot():
+    # Arranque anterior: todo el DDL + siembra fila a fila, siempre
+    db.get_pool().open()
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            for _, _, fn in db.MIGRATIONS:
+                fn(cur)
+            conn.commit()
+            for name in db.PERSONS_SEED:
+                cur.execute(
+                    "INSERT INTO persons(name, status) VALUES (%s, 'NEW') ON CONFLICT (name) DO NOTHING;",
+                    (name,)
+                )
+            cur.execute(
+                "UPDATE persons SET role='ADMIN' WHERE name=%s AND role <> 'ADMIN';",
+                (db.ADMIN_SEED_NAME,)
+            )
+            for code, label, cat, vol, price in db.DRINKS_SEED:
+                cur.execute("""
+                    INSERT INTO drink_types(code,label,category,volume_liters,unit_price_eur,is_active)
+                    VALUES (%s,%s,%s,%s,%s,TRUE)
+                    ON CONFLICT (code) DO NOTHING;
+                """, (code, label, cat, vol, price))
+            conn.commit()
+    db.load_drink_catalog()
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        db.close_pool()  # cada arranque abre su pool, como un proceso nuevo
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    use_bench_database()
+    _reset_schema()
+
+    t0 = time.perf_counter()
+    report = db.init_db()
+    t_cold = time.perf_counter() - t0
+
+    t_warm = _best_of(db.init_db, args.repeat)
+    t_legacy = _best_of(legacy_boot, args.repeat)
+
+    print(f"migraciones aplicadas en frío : {report['applied']}")
+    print(f"esquema vacío (todo pendiente): {t_cold * 1000:8.1f} ms")
+    print(f"esquema al día (nada pendiente): {t_warm * 1000:7.1f} ms")
+    print(f"arranque anterior (DDL siempre): {t_legacy * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
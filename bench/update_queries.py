@@ -0,0 +1,114 @@
+"""
+update_queries: consultas a BD por update para cada ruta de callback, con la
+caché de identidad fría (invalidada antes de cada update) y caliente.
+
+Usa el mismo contador que el bot en producción (db.track_queries, que el
+PerUserUpdateProcessor abre para cada update) y una Bot API falsa local que
+acepta cualquier método.
+
+    BENCH_DATABASE_URL=... python -m bench.update_queries
+"""
+import asyncio
+import datetime as dt
+import os
+import types
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+from telegram import Bot, Update  # noqa: E402
+
+import bot  # noqa: E402
+import db  # noqa: E402
+from bench.broadcast import FakeBotAPI, TOKEN  # noqa: E402
+from bench.seed import seed, use_bench_database  # noqa: E402
+
+ADMIN_TG = 900_001
+
+
+class AnyMethodAPI(FakeBotAPI):
+    async def _api(self, method, params):
+        if method in ("getMe", "sendMessage"):
+            return await super()._api(method, params)
+        if method == "editMessageText":
+            return 200, {"ok": True, "result": {
+                "message_id": 1, "date": 0, "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }}
+        return 200, {"ok": True, "result": True}
+
+
+def _prepare() -> dict:
+    person_ids = seed(20, 20_000, dt.date(2024, 1, 1), dt.date.today())
+    pid = person_ids[0]
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE persons SET role='ADMIN' WHERE id=%s;", (pid,))
+            cur.execute("UPDATE person_accounts SET is_active=FALSE, unassigned_at=now() "
+                        "WHERE is_active AND (person_id=%s OR telegram_user_id=%s);", (pid, ADMIN_TG))
+            cur.execute("INSERT INTO person_accounts(person_id, telegram_user_id) VALUES (%s, %s);", (pid, ADMIN_TG))
+    db.invalidate_identity(telegram_user_id=ADMIN_TG)
+    event_id = db.list_last_events(pid, 1)[0]["id"]
+    return {"person_id": pid, "event_id": event_id, "year": db.beer_year_start_for(dt.date.today())}
+
+
+def _taps(p: dict) -> list:
+    return [
+        (bot.CB_MENU_ROOT, "MENU", {}),
+        (bot.CB_MENU_RANK, "MENU", {}),
+        (bot.CB_RANK_USERS, "MENU", {}),
+        (bot.CB_RANK_TYPES, "MENU", {}),
+        (bot.CB_BACK_MENU, "MENU", {}),
+        (bot.CB_MENU_ADD, "MENU", {}),
+        (f"{bot.CB_CAT}BEER", "ADD_CAT", {}),
+        (f"{bot.CB_TYPE}3", "ADD_TYPE", {"cat": "BEER"}),
+        (f"{bot.CB_QTY}1", "ADD_QTY", {"cat": "BEER", "drink_type_id": 3}),
+        (bot.CB_MENU_PANEL, "MENU", {}),
+        (bot.CB_PANEL_DRINKS, "PANEL", {}),
+        (f"{bot.CB_PANEL_OLDER}{p['event_id']}", "PANEL_DRINKS", {}),
+        (bot.CB_MENU_UNDO, "PANEL", {}),
+        (bot.CB_MENU_REPORT, "MENU", {}),
+        (f"{bot.CB_YEAR}{p['year']}", "REPORT_PICK_YEAR", {}),
+        (bot.CB_MENU_ADMIN, "MENU", {}),
+        (f"{bot.CB_ADMIN_PERSON_VIEW}{p['person_id']}", "ADMIN_PERSONS_LIST", {}),
+    ]
+
+
+async def _tap(tgbot, data: str, state: str, sdata: dict) -> dict:
+    update = Update.de_json({"update_id": 1, "callback_query": {
+        "id": "1", "chat_instance": "bench", "data": data,
+        "from": {"id": ADMIN_TG, "is_bot": False, "first_name": "Bench"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": ADMIN_TG, "type": "private"}},
+    }}, tgbot)
+    context = types.SimpleNamespace(user_data={"state": state, "data": dict(sdata)}, bot=tgbot)
+    with db.track_queries() as stats:
+        await bot.handle_callback(update, context)
+    return stats
+
+
+async def run(p: dict):
+    api = AnyMethodAPI(0, 10**6, 0)
+    port = await api.start()
+    tgbot = Bot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot")
+    print(f"{'callback':34s} {'fría':>5s} {'caliente':>9s} {'ms BD':>7s}")
+    totals = [0, 0]
+    async with tgbot:
+        for data, state, sdata in _taps(p):
+            db.invalidate_identity(telegram_user_id=ADMIN_TG)
+            bot.report_cache.clear()
+            cold = await _tap(tgbot, data, state, sdata)
+            warm = await _tap(tgbot, data, state, sdata)
+            totals[0] += cold["queries"]
+            totals[1] += warm["queries"]
+            print(f"{data:34s} {cold['queries']:5d} {warm['queries']:9d} {cold['db_ms']:7.1f}")
+    await api.stop()
+    n = len(_taps(p))
+    print(f"{'media por update':34s} {totals[0] / n:5.2f} {totals[1] / n:9.2f}")
+
+
+def main():
+    use_bench_database()
+    asyncio.run(run(_prepare()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+webhook: latencia mensaje-respuesta en polling frente a webhook, contra una
+Bot API falsa local (la de bench.broadcast con getUpdates/setWebhook).
+
+Cada mensaje de "usuario" se inyecta en la API falsa en un instante aleatorio;
+se mide hasta que llega el sendMessage de respuesta del bot. La latencia de red
+(--latency, un sentido) se aplica a cada respuesta de getUpdates, a cada POST
+del webhook y a cada petición del bot.
+
+    python -m bench.webhook --messages 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+from telegram import Bot, Update
+from telegram.ext import Application, MessageHandler, filters
+from telegram.request import HTTPXRequest
+
+import webserver
+from bench.broadcast import FakeBotAPI, TOKEN
+
+
+class FakeUpdatesAPI(FakeBotAPI):
+    def __init__(self, latency: float):
+        super().__init__(latency, global_limit=10_000, error_rate=0.0)
+        self.updates = []          # updates pendientes de entregar por getUpdates
+        self.new_update = asyncio.Event()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.sent_at = {}          # chat_id -> instante en que llegó la respuesta
+        self.client = httpx.AsyncClient()
+        self.next_update_id = 1
+
+    async def _api(self, method, params):
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self.new_update.clear()
+                try:
+                    await asyncio.wait_for(self.new_update.wait(), float(params.get("timeout") or 0))
+                except asyncio.TimeoutError:
+                    pass
+            batch = [u for u in self.updates if u["update_id"] >= offset]
+            await asyncio.sleep(self.latency)  # respuesta viajando hacia el bot
+            return 200, {"ok": True, "result": batch}
+        if method in ("deleteWebhook", "setWebhook"):
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = params.get("secret_token")
+            return 200, {"ok": True, "result": True}
+        status, payload = await super()._api(method, params)
+        if method == "sendMessage" and payload and payload["ok"]:
+            self.sent_at[int(params["chat_id"])] = time.monotonic()
+        return status, payload
+
+    async def stop(self):
+        # Despierta los long-poll que sigan abiertos para que acaben limpios
+        self.new_update.set()
+        await asyncio.sleep(self.latency + 0.05)
+        await self.client.aclose()
+        await super().stop()
+
+    async def user_message(self, chat_id: int, text: str):
+        update = {
+            "update_id": self.next_update_id,
+            "message": {
+                "message_id": self.next_update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            },
+        }
+        self.next_update_id += 1
+        if self.webhook_url:
+            await asyncio.sleep(self.latency)
+            await self.client.post(self.webhook_url, json=update,
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret})
+        else:
+            self.updates.append(update)
+            self.new_update.set()
+
+
+async def echo(update: Update, context):
+    await update.message.reply_text(update.message.text)
+
+
+def _app(port: int) -> Application:
+    bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot",
+              request=HTTPXRequest(connection_pool_size=16),
+              get_updates_request=HTTPXRequest(read_timeout=30))
+    app = Application.builder().bot(bot).concurrent_updates(True).build()
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    return app
+
+
+async def _measure(api: FakeUpdatesAPI, args) -> list:
+    rnd = random.Random(1)
+    api.sent_at.clear()
+    injected = {}
+    tasks = []
+    for i in range(args.messages):
+        await asyncio.sleep(rnd.expovariate(1 / args.interval))
+        chat_id = 10_000 + i
+        injected[chat_id] = time.monotonic()
+        tasks.append(asyncio.create_task(api.user_message(chat_id, f"hola {i}")))
+    await asyncio.gather(*tasks)
+    deadline = time.monotonic() + 10
+    while len(api.sent_at) < args.messages and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return [(api.sent_at[c] - t0) * 1000 for c, t0 in injected.items() if c in api.sent_at]
+
+
+def _report(name: str, lat: list, total: int):
+    lat = sorted(lat)
+    p95 = lat[int(len(lat) * 0.95) - 1] if lat else float("nan")
+    print(f"{name:8s}: {len(lat)}/{total} respondidos  media {statistics.mean(lat):6.1f} ms  "
+          f"p50 {statistics.median(lat):6.1f} ms  p95 {p95:6.1f} ms  máx {lat[-1]:6.1f} ms")
+
+
+async def run(args):
+    api = FakeUpdatesAPI(args.latency)
+    port = await api.start()
+    print(f"mensajes={args.messages} latencia={args.latency * 1000:.0f} ms (un sentido) "
+          f"intervalo medio={args.interval * 1000:.0f} ms")
+
+    # Polling: getUpdates en long-poll como app.run_polling()
+    app = _app(port)
+    async with app:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        await app.start()
+        lat = await _measure(api, args)
+        await app.updater.stop()
+        await app.stop()
+    _report("polling", lat, args.messages)
+
+    # Webhook: el servidor embebido de webserver.py
+    app = _app(port)
+    server = webserver.build_server(app, webhook=True, port=0)
+    async with app:
+        await server.start()
+        await app.bot.set_webhook(f"http://127.0.0.1:{server.port}{webserver.WEBHOOK_PATH}",
+                                  secret_token=webserver.WEBHOOK_SECRET)
+        await app.start()
+        lat = await _measure(api, args)
+        # Sin el secreto correcto el servidor no despacha nada
+        bad = await api.client.post(api.webhook_url, json={"update_id": 0},
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": "otro"})
+        health = await api.client.get(f"http://127.0.0.1:{server.port}/health")
+        await app.stop()
+        await server.stop()
+    _report("webhook", lat, args.messages)
+    print(f"secreto incorrecto -> HTTP {bad.status_code}; /health -> {health.json()['status']}")
+    await api.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200)
+    ap.add_argument("--latency", type=float, default=0.05, help="s en cada sentido entre Telegram y el bot")
+    ap.add_argument("--interval", type=float, default=0.03, help="s medios entre mensajes de usuarios")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import os
+import asyncio
+import logging
 import datetime as dt
 import random
 import calendar
@@ -7,10 +9,18 @@ from zoneinfo import ZoneInfo
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
+from db_async import run_db, shutdown_executor
+from outbox import OUTBOX_POLL_S, outbox_job
+from report_cache import report_cache
+from request_context import request_context
+from metrics import SWALLOWED_ERRORS, UPDATE_ERRORS, UPDATE_SECONDS, TelegramMetricsRequest, instrument_job, timed
+from update_processor import CONCURRENT_UPDATES, PerUserUpdateProcessor
+from callback_router import CallbackRouter
+from webserver import HTTP_PORT, build_server, run_webhook, webhook_enabled
 from db import (
     init_db,
+    close_pool,
     # Asignación / acceso
-    get_assigned_person,
     upsert_pending_telegram,
     list_pending_telegrams,
 
@@ -18,19 +28,17 @@ from db import (
     list_drink_types, insert_event, list_last_events, list_user_events_page, void_event,
 
     # Informes / rankings
-    list_years_with_data, report_year,
-    get_person_year_totals, is_first_event_of_year,
-    month_summary, monthly_summary_already_sent, mark_monthly_summary_sent,
+    report_year,
+    month_summary, monthly_summary_already_sent,
     monthly_shame_report,
     person_year_breakdown,
     year_drinks_totals,
     year_drink_type_person_totals,
 
     # Envíos automáticos
-    list_active_telegram_user_ids,
+    enqueue_summary,
 
     # Admin
-    is_admin,
     add_person,
     list_persons_by_status,
     list_persons_without_active_telegram,
@@ -40,21 +48,25 @@ from db import (
     admin_suspend_person,
     admin_reactivate_person,
     admin_delete_person,
-    list_calendar_years_with_data,
-    user_stats_range,
     user_year_stats,
+    user_stats_periods,
     group_month_summary,
-    drink_type_person_totals_range,
-    drink_type_totals_range,
+    drink_type_person_totals_periods,
+    drink_type_totals_from_person_rows,
     beer_year_start_for,
+    data_version,
     weekly_summary_already_sent,
-    mark_weekly_summary_sent,
     beer_year_summary_already_sent,
-    mark_beer_year_summary_sent,
     period_activity_summary,
     range_drinks_totals,
+    STRONG_DAY_THRESHOLD_L,
+
+    # Diagnóstico
+    slowest_functions, slow_queries, DB_SLOW_QUERY_MS,
 )
 
+log = logging.getLogger(__name__)
+
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 TZ = ZoneInfo("Europe/Madrid")
 
@@ -128,6 +140,12 @@ CB_ADMIN_PERSON_DELETE_CONFIRM = "admin:person_delete_confirm:"  # ...:<person_i
 CB_ADMIN_PICK_TG = "admin:pick_tg:"                    # admin:pick_tg:<telegram_user_id>
 CB_ADMIN_SEARCH_PERSON = "admin:search_person"
 
+CB_BACK_MENU = "back:menu"
+CB_BACK_PANEL = "back:panel"
+CB_BACK_CAT = "back:cat"
+CB_BACK_TYPE = "back:type"
+CB_BACK_QTY = "back:qty"
+
 def kb(rows):
     return InlineKeyboardMarkup(rows)
 
@@ -152,8 +170,6 @@ def rank_menu_kb():
 def rank_back_kb():
     return kb([[InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)]])
 
-STRONG_DAY_THRESHOLD_L = 3.0
-
 def _legend_strong_day_short() -> str:
     return f"🧨 Día fuerte = día con ≥ {STRONG_DAY_THRESHOLD_L:.1f} L"
 
@@ -255,9 +271,9 @@ def render_users_block(title: str, rows: list, include_month_extras: bool = Fals
 def render_users_ranking_current(today: dt.date):
     ws, we = _week_range(today)
     ms, me = _month_range(today)
-    week_rows = user_stats_range(ws, we)
-    month_rows = user_stats_range(ms, me)
-    year_rows = user_year_stats(today.year)
+    # Semana, mes y año en una sola consulta
+    stats = user_stats_periods({"week": (ws, we), "month": (ms, me), "year": _year_range(today.year)}, year_key="year")
+    week_rows, month_rows, year_rows = stats["week"], stats["month"], stats["year"]
     month_days = (me - ms).days + 1
 
     parts = ["🏆 Ranking por usuarios", ""]
@@ -289,9 +305,10 @@ def render_prev_year_extra(year: int):
     return annual + "\n\n" + monthly
 
 
-def render_types_block(title: str, start_date: dt.date, end_date: dt.date, period_label: str):
-    totals = drink_type_totals_range(start_date, end_date)
-    per_person = drink_type_person_totals_range(start_date, end_date)
+def render_types_block(title: str, rows, period_label: str):
+    # rows: filas de drink_type_person_totals_periods para un periodo (incluye no activos)
+    totals = drink_type_totals_from_person_rows(rows)
+    per_person = [r for r in rows if r["active"]]
 
     key = lambda r: (r["category"], r["label"])
     totals_map = {(t["category"], t["label"]): t for t in totals}
@@ -340,20 +357,37 @@ def render_types_ranking_current(today: dt.date):
     ms, me = _month_range(today)
     ys, ye = _year_range(today.year)
 
+    # Semana, mes y año en una sola consulta
+    rows = drink_type_person_totals_periods({"week": (ws, we), "month": (ms, me), "year": (ys, ye)})
+
     parts = ["🏆 Ranking por tipos de bebida", ""]
-    parts.append(render_types_block(f"📅 Semana ({ws.strftime('%d/%m')}–{we.strftime('%d/%m')})", ws, we, "semana"))
+    parts.append(render_types_block(f"📅 Semana ({ws.strftime('%d/%m')}–{we.strftime('%d/%m')})", rows["week"], "semana"))
     parts.append("")
-    parts.append(render_types_block(f"🗓️ Mes ({_fmt_month_es(today.month)} {today.year})", ms, me, "mes"))
+    parts.append(render_types_block(f"🗓️ Mes ({_fmt_month_es(today.month)} {today.year})", rows["month"], "mes"))
     parts.append("")
-    parts.append(render_types_block(f"📆 Año ({today.year})", ys, ye, "año"))
+    parts.append(render_types_block(f"📆 Año ({today.year})", rows["year"], "año"))
     return "\n".join(parts).strip()
 
 
+async def cached_render(name: str, years, fn, *args):
+    """
+    Renderiza un informe en el executor de BD, reutilizando el texto cacheado
+    mientras no cambie la versión de datos de los años que cubre.
+    """
+    key = (name, *args)
+    # Versión en BD (la suben también otros procesos, p.ej. manage.py rebuild-rollup)
+    version = await run_db(data_version, *sorted(set(years)))
+    txt = report_cache.get(key, version)
+    if txt is None:
+        txt = await run_db(fn, *args)
+        report_cache.put(key, version, txt)
+    return txt
+
 def user_panel_kb():
     rows = [
         [InlineKeyboardButton("🕒 Mis últimas bebidas", callback_data=CB_PANEL_DRINKS)],
         [InlineKeyboardButton("↩️ Deshacer bebidas", callback_data=CB_MENU_UNDO)],
-        [InlineKeyboardButton("⬅️ Volver", callback_data="back:menu")],
+        [InlineKeyboardButton("⬅️ Volver", callback_data=CB_BACK_MENU)],
     ]
     return kb(rows)
 
@@ -381,12 +415,13 @@ def categories_kb():
     return kb([
         [InlineKeyboardButton("🍺 Cerveza", callback_data=f"{CB_CAT}BEER")],
         [InlineKeyboardButton("🥃 Otros", callback_data=f"{CB_CAT}OTHER")],
-        [InlineKeyboardButton("⬅️ Menú", callback_data="back:menu")],
+        [InlineKeyboardButton("⬅️ Menú", callback_data=CB_BACK_MENU)],
     ])
 
-def types_kb(types, back_to="cat"):
+def types_kb(types, back_to: str = CB_BACK_CAT):
+    # back_to: constante CB_BACK_* a la que vuelve "Atrás"
     rows = [[InlineKeyboardButton(t["label"], callback_data=f"{CB_TYPE}{t['id']}")] for t in types]
-    rows.append([InlineKeyboardButton("⬅️ Atrás", callback_data=f"back:{back_to}")])
+    rows.append([InlineKeyboardButton("⬅️ Atrás", callback_data=back_to)])
     return kb(rows)
 
 def qty_kb():
@@ -397,7 +432,7 @@ def qty_kb():
         [InlineKeyboardButton("4", callback_data=f"{CB_QTY}4"),
          InlineKeyboardButton("5", callback_data=f"{CB_QTY}5"),
          InlineKeyboardButton("Más…", callback_data=f"{CB_QTY}more")],
-        [InlineKeyboardButton("⬅️ Atrás", callback_data="back:type")],
+        [InlineKeyboardButton("⬅️ Atrás", callback_data=CB_BACK_TYPE)],
     ])
 
 def date_kb():
@@ -405,7 +440,7 @@ def date_kb():
         [InlineKeyboardButton("Hoy", callback_data=f"{CB_DATE}today")],
         [InlineKeyboardButton("Ayer", callback_data=f"{CB_DATE}yesterday")],
         [InlineKeyboardButton("Otra fecha", callback_data=f"{CB_DATE}other")],
-        [InlineKeyboardButton("⬅️ Atrás", callback_data="back:qty")],
+        [InlineKeyboardButton("⬅️ Atrás", callback_data=CB_BACK_QTY)],
     ])
 
 def undo_list_kb(events):
@@ -414,7 +449,7 @@ def undo_list_kb(events):
         when = _fmt_ts(e.get("created_at") or e.get("consumed_at"))
         label = f"{e['quantity']} × {e['label']} — {when}"
         rows.append([InlineKeyboardButton(label, callback_data=f"{CB_UNDO_PICK}{e['id']}")])
-    rows.append([InlineKeyboardButton("⬅️ Volver al panel", callback_data="back:panel")])
+    rows.append([InlineKeyboardButton("⬅️ Volver al panel", callback_data=CB_BACK_PANEL)])
     return kb(rows)
 
 def undo_confirm_kb(event_id: int):
@@ -425,7 +460,7 @@ def undo_confirm_kb(event_id: int):
 
 def years_kb(years):
     rows = [[InlineKeyboardButton(f"{y}-{y+1}", callback_data=f"{CB_YEAR}{y}")] for y in years]
-    rows.append([InlineKeyboardButton("⬅️ Menú", callback_data="back:menu")])
+    rows.append([InlineKeyboardButton("⬅️ Menú", callback_data=CB_BACK_MENU)])
     return kb(rows)
 
 def admin_main_kb():
@@ -433,7 +468,7 @@ def admin_main_kb():
         [InlineKeyboardButton("👥 Personas (histórico)", callback_data=CB_ADMIN_PERSONS)],
         [InlineKeyboardButton("📨 Solicitudes (pendientes)", callback_data=CB_ADMIN_REQUESTS)],
         [InlineKeyboardButton("➕ Crear persona/plaza", callback_data=CB_ADMIN_CREATE_PERSON)],
-        [InlineKeyboardButton("⬅️ Menú", callback_data="back:menu")],
+        [InlineKeyboardButton("⬅️ Menú", callback_data=CB_BACK_MENU)],
     ])
 
 def admin_persons_menu_kb():
@@ -660,6 +695,15 @@ def _build_public_podium_lines(rows, start_date: dt.date, end_date: dt.date):
 # --------- Resumen mensual automático (día 1) ---------
 
 
+async def enqueue_summary_job(context: ContextTypes.DEFAULT_TYPE, kind: str, period: tuple, msg: str):
+    # Marca el resumen y encola un envío por usuario activo en una transacción; los manda outbox_job
+    n = await run_db(enqueue_summary, kind, period, msg)
+    if n is None:
+        return  # otro proceso lo marcó antes
+    log.info("resumen %s %s: %d destinatarios encolados", kind, period, n)
+    context.job_queue.run_once(outbox_job, 0)
+
+@instrument_job
 async def monthly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     now = dt.datetime.now(TZ)
     if now.day != 1:
@@ -672,14 +716,10 @@ async def monthly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     start_date = dt.date(y, m, 1)
     end_date = prev_month_last_day
 
-    if monthly_summary_already_sent(y, m):
-        return
-
-    # Marca primero (para evitar duplicados si hay reinicios)
-    if not mark_monthly_summary_sent(y, m):
+    if await run_db(monthly_summary_already_sent, y, m):
         return
 
-    rows = period_activity_summary(start_date, end_date)
+    rows = await run_db(period_activity_summary, start_date, end_date)
 
     total_units = sum(int(r.get("units_total") or 0) for r in rows)
     total_liters = sum(float(r.get("liters_total") or 0) for r in rows)
@@ -697,7 +737,7 @@ async def monthly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     ranking_line = " · ".join(ranking_parts)
 
     # Bebida top del mes
-    drink_rows = range_drinks_totals(start_date, end_date)
+    drink_rows = await run_db(range_drinks_totals, start_date, end_date)
     top_drink_line = None
     if drink_rows:
         d0 = drink_rows[0]
@@ -706,8 +746,10 @@ async def monthly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     # Vergüenzas (mensual) — compactas
     shame_lines = []
     try:
-        shame = monthly_shame_report(y, m)
+        shame = await run_db(monthly_shame_report, y, m)
     except Exception:
+        SWALLOWED_ERRORS.labels("monthly_shame_report").inc()
+        log.exception("monthly_shame_report %s-%02d falló; resumen sin vergüenzas", y, m)
         shame = None
 
     active_people = sum(1 for r in rows if float(r.get("liters_total") or 0) > 0)
@@ -749,17 +791,13 @@ async def monthly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     msg = "\n".join(lines)
 
     # Enviar a todos los usuarios activos (por DM)
-    bot = context.bot
-    for chat_id in list_active_telegram_user_ids():
-        try:
-            await bot.send_message(chat_id=chat_id, text=msg)
-        except Exception:
-            pass
+    await enqueue_summary_job(context, "monthly", (y, m), msg)
 
 
 
 # --------- Resumen semanal automático (lunes) ---------
 
+@instrument_job
 async def weekly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     now = dt.datetime.now(TZ)
     # Lunes
@@ -774,12 +812,10 @@ async def weekly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     iso = start_date.isocalendar()
     year, week = int(iso.year), int(iso.week)
 
-    if weekly_summary_already_sent(year, week):
-        return
-    if not mark_weekly_summary_sent(year, week):
+    if await run_db(weekly_summary_already_sent, year, week):
         return
 
-    rows = period_activity_summary(start_date, end_date)
+    rows = await run_db(period_activity_summary, start_date, end_date)
 
     total_units = sum(int(r.get("units_total") or 0) for r in rows)
     total_liters = sum(float(r.get("liters_total") or 0) for r in rows)
@@ -791,7 +827,7 @@ async def weekly_summary_job(context: ContextTypes.DEFAULT_TYPE):
     ranking_parts = [f"{r['name']} {float(r.get('liters_total') or 0):.1f}" for r in rows]
     ranking_line = " · ".join(ranking_parts)
 
-    drink_rows = range_drinks_totals(start_date, end_date)
+    drink_rows = await run_db(range_drinks_totals, start_date, end_date)
     top_drink_line = None
     if drink_rows:
         d0 = drink_rows[0]
@@ -815,15 +851,11 @@ async def weekly_summary_job(context: ContextTypes.DEFAULT_TYPE):
 
     msg = "\n".join(lines)
 
-    bot = context.bot
-    for chat_id in list_active_telegram_user_ids():
-        try:
-            await bot.send_message(chat_id=chat_id, text=msg)
-        except Exception:
-            pass
+    await enqueue_summary_job(context, "weekly", (year, week), msg)
 
 # --------- Cierre del año cervecero (6 enero) ---------
 
+@instrument_job
 async def beer_year_summary_job(context: ContextTypes.DEFAULT_TYPE):
     now = dt.datetime.now(TZ)
     # Lo enviamos el 7 de enero por la mañana
@@ -832,15 +864,13 @@ async def beer_year_summary_job(context: ContextTypes.DEFAULT_TYPE):
 
     # Año cervecero que acaba el 6 de enero del año actual
     year_start = now.year - 1
-    if beer_year_summary_already_sent(year_start):
-        return
-    if not mark_beer_year_summary_sent(year_start):
+    if await run_db(beer_year_summary_already_sent, year_start):
         return
 
     start_date = dt.date(year_start, 1, 7)
     end_date = dt.date(year_start + 1, 1, 6)
 
-    rows = period_activity_summary(start_date, end_date)
+    rows = await run_db(period_activity_summary, start_date, end_date)
 
     total_units = sum(int(r.get("units_total") or 0) for r in rows)
     total_liters = sum(float(r.get("liters_total") or 0) for r in rows)
@@ -854,12 +884,12 @@ async def beer_year_summary_job(context: ContextTypes.DEFAULT_TYPE):
     ranking_line = " · ".join(ranking_parts)
 
     # Bebidas del año (top 3)
-    drink_rows = year_drinks_totals(year_start)
+    drink_rows = await run_db(year_drinks_totals, year_start)
     top3_drinks = drink_rows[:3] if drink_rows else []
     drinks_lines = []
     if top3_drinks:
         for i, d in enumerate(top3_drinks, 1):
-            drinks_lines.append(f"{i}) {d['name']} {float(d.get('liters') or 0):.2f} L")
+            drinks_lines.append(f"{i}) {d['label']} {float(d.get('litros') or 0):.2f} L")
 
     podium_lines = _build_public_podium_lines(rows, start_date, end_date)
 
@@ -879,18 +909,14 @@ async def beer_year_summary_job(context: ContextTypes.DEFAULT_TYPE):
 
     msg = "\n".join(lines)
 
-    bot = context.bot
-    for chat_id in list_active_telegram_user_ids():
-        try:
-            await bot.send_message(chat_id=chat_id, text=msg)
-        except Exception:
-            pass
+    await enqueue_summary_job(context, "beer_year", (year_start,), msg)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tg_id = update.effective_user.id
     user = update.effective_user
+    rc = request_context(update)
 
-    person = get_assigned_person(tg_id)
+    person = await rc.person()
 
     # Registrado
     if person:
@@ -903,7 +929,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(
             f"👋 Hola, {person['name']}.\n\n¿Qué quieres hacer?",
-            reply_markup=menu_kb(is_admin(tg_id)),
+            reply_markup=menu_kb(await rc.is_admin()),
         )
         set_state(context, "MENU", {})
         return
@@ -912,9 +938,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = getattr(user, "username", None)
     full_name = getattr(user, "full_name", None)
     try:
-        upsert_pending_telegram(tg_id, username, full_name)
+        await run_db(upsert_pending_telegram, tg_id, username, full_name)
     except Exception:
-        pass
+        SWALLOWED_ERRORS.labels("pending_request").inc()
+        log.exception("No se pudo registrar la solicitud pendiente de %s", tg_id)
 
     await update.message.reply_text(
         "👋 ¡Recibido!\n\n📨 Tu solicitud está pendiente de aprobación.\n"
@@ -923,756 +950,719 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_state(context, "PENDING", {})
 
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-    tg_id = q.from_user.id
-    data = q.data or ""
-    state, sdata = get_state(context)
-
-    # Guard rails: usuarios no asignados o suspendidos no pueden navegar por menús antiguos
-    assigned = get_assigned_person(tg_id)
-    if assigned and assigned.get("status") == "INACTIVE" and not is_admin(tg_id):
-        await q.edit_message_text("🚫 Estás suspendido. El admin debe reactivarte.")
-        set_state(context, "SUSPENDED", {})
+async def slow_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/slow [N]: funciones de BD más lentas (p95) y últimas consultas lentas. Solo admin."""
+    if not await request_context(update).is_admin():
+        await update.message.reply_text("🚫 No tienes permisos.")
         return
+    try:
+        n = max(1, min(int(context.args[0]), 50)) if context.args else 10
+    except ValueError:
+        n = 10
 
-    # -------- RANKING --------
-    if data == CB_MENU_RANK or data == CB_RANK_MENU:
-        await q.edit_message_text(
-            "🏆 Ranking\nElige qué quieres ver:",
-            reply_markup=rank_menu_kb()
-        )
+    top = slowest_functions(n)
+    if not top:
+        await update.message.reply_text("🐢 Aún no hay llamadas a BD registradas.")
         return
-
-    if data == CB_MENU_ROOT:
-        await q.edit_message_text(
-            "📌 Menú principal:",
-            reply_markup=menu_kb(is_admin(tg_id))
+    lines = [f"🐢 Top {len(top)} funciones de BD (por p95):", ""]
+    for r in top:
+        lines.append(
+            f"• {r['name']}: {r['calls']}× · media {r['avg_ms']:.1f} ms · p95 {r['p95_ms']:.1f} ms · "
+            f"máx {r['max_ms']:.1f} ms · {r['rows']} filas" + (f" · ❗{r['errors']} errores" if r["errors"] else "")
         )
-        return
+    recent = slow_queries(3)
+    if recent:
+        lines += ["", f"⏱️ Últimas consultas lentas (≥ {DB_SLOW_QUERY_MS:g} ms):"]
+        for q in recent:
+            lines.append(f"• {q['at']:%d/%m %H:%M} {q['fn'] or '?'} {q['ms']} ms: {q['sql'][:120]}")
+    await update.message.reply_text("\n".join(lines)[:4000])
 
-    if data == CB_RANK_USERS:
-        today = dt.datetime.now(TZ).date()
-        years = list_calendar_years_with_data()
-        prev_year = (today.year - 1) if (today.year - 1) in years else None
-
-        txt = render_users_ranking_current(today)
-        rows = []
-        if prev_year:
-            rows.append([InlineKeyboardButton(f"📆 Ver {prev_year}", callback_data=CB_RANK_USERS_PREV)])
-        rows.append([InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)])
-        await q.edit_message_text(txt, reply_markup=kb(rows))
-        return
 
-    if data == CB_RANK_USERS_PREV:
-        today = dt.datetime.now(TZ).date()
-        prev_year = today.year - 1
-        years = list_calendar_years_with_data()
-        if prev_year not in years:
-            await q.edit_message_text("No hay datos del año anterior.", reply_markup=rank_back_kb())
-            return
+# --------- Callbacks (router) ---------
+callback_router = CallbackRouter()
 
-        txt = "🏆 Ranking por usuarios\n\n" + render_prev_year_extra(prev_year)
-        rows = [
-            [InlineKeyboardButton(f"📆 Volver a {today.year}", callback_data=CB_RANK_USERS_CURR)],
-            [InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)],
-        ]
-        await q.edit_message_text(txt, reply_markup=kb(rows))
-        return
 
-    if data == CB_RANK_USERS_CURR:
-        today = dt.datetime.now(TZ).date()
-        years = list_calendar_years_with_data()
-        prev_year = (today.year - 1) if (today.year - 1) in years else None
-
-        txt = render_users_ranking_current(today)
-        rows = []
-        if prev_year:
-            rows.append([InlineKeyboardButton(f"📆 Ver {prev_year}", callback_data=CB_RANK_USERS_PREV)])
-        rows.append([InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)])
-        await q.edit_message_text(txt, reply_markup=kb(rows))
+class CallbackRequest:
+    """Query y estado de un callback; persona y admin ya resueltos por el router."""
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+        self.update = update
+        self.context = context
+        self.q = update.callback_query
+        self.tg_id = self.q.from_user.id
+        self.arg = arg  # lo que sigue al prefijo de la ruta ("" en rutas exactas)
+        self.state, self.sdata = get_state(context)
+        self.rc = request_context(update)  # consultas memorizadas del update
+        self.person = None
+        self.is_admin = False
+
+
+def _check_routes():
+    """Cada constante CB_* tiene exactamente una ruta (RuntimeError si no)."""
+    callback_router.check({k: v for k, v in globals().items() if k.startswith("CB_") and isinstance(v, str)})
+
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    route, arg = callback_router.resolve(q.data or "")
+    if route is None:
+        await q.answer()
         return
+    with timed(UPDATE_SECONDS.labels("callback", route.key), UPDATE_ERRORS.labels("callback", route.key)):
+        await q.answer()
+        await _run_route(route, CallbackRequest(update, context, arg))
+
 
-    if data == CB_RANK_TYPES:
-        today = dt.datetime.now(TZ).date()
-        txt = render_types_ranking_current(today)
-        await q.edit_message_text(txt, reply_markup=rank_back_kb())
+async def _run_route(route, req: CallbackRequest):
+    q, context = req.q, req.context
+    req.person = await req.rc.person()
+    req.is_admin = await req.rc.is_admin()
+
+    # Guard rails: usuarios no asignados o suspendidos no pueden navegar por menús antiguos
+    if req.person and req.person.get("status") == "INACTIVE" and not req.is_admin:
+        await q.edit_message_text("🚫 Estás suspendido. El admin debe reactivarte.")
+        set_state(context, "SUSPENDED", {})
         return
 
-    if not assigned and not is_admin(tg_id):
+    if route.assigned and not req.person:
         await q.edit_message_text("📨 Estás pendiente de aprobación. El admin debe asignarte una plaza.")
         set_state(context, "PENDING", {})
         return
 
-    # -------- BACKS --------
-    if data == "back:menu":
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("📨 Estás pendiente de aprobación. El admin debe asignarte una plaza.")
-            set_state(context, "PENDING", {})
-            return
-        if person.get("status") == "INACTIVE":
-            await q.edit_message_text("🚫 Estás suspendido. El admin debe reactivarte.")
-            set_state(context, "SUSPENDED", {})
-            return
-        await q.edit_message_text(
-            f"👋 Hola, {person['name']}.\n\n¿Qué quieres hacer?",
-            reply_markup=menu_kb(is_admin(tg_id)),
-        )
-        set_state(context, "MENU", {})
+    if route.admin and not req.is_admin:
+        await q.edit_message_text("🚫 No tienes permisos.")
         return
 
-    if data == "back:panel":
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("No estás asignado. Espera a que el admin te apruebe.")
-            set_state(context, "PENDING", {})
-            return
-        if person.get("status") == "INACTIVE":
-            await q.edit_message_text("🚫 Estás suspendido. El admin tiene que reactivarte para volver a usar el bot.")
-            set_state(context, "SUSPENDED", {})
-            return
-        await q.edit_message_text("👤 Panel de usuario", reply_markup=user_panel_kb())
-        set_state(context, "PANEL", {})
-        return
+    await route.handler(req)
 
-    if data == "back:cat":
-        await q.edit_message_text("¿Qué vas a añadir?", reply_markup=categories_kb())
-        set_state(context, "ADD_CAT", {})
-        return
 
-    if data == "back:type":
-        cat = sdata.get("cat")
-        if not cat:
-            await q.edit_message_text("¿Qué vas a añadir?", reply_markup=categories_kb())
-            set_state(context, "ADD_CAT", {})
-            return
-        types = list_drink_types(cat)
-        await q.edit_message_text("Elige el tipo:", reply_markup=types_kb(types, back_to="cat"))
-        set_state(context, "ADD_TYPE", {"cat": cat})
-        return
+# -------- RANKING --------
+@callback_router.route(CB_MENU_RANK, CB_RANK_MENU, assigned=False)
+async def cb_rank_menu(req: CallbackRequest):
+    await req.q.edit_message_text(
+        "🏆 Ranking\nElige qué quieres ver:",
+        reply_markup=rank_menu_kb()
+    )
 
-    if data == "back:qty":
-        # Volver desde FECHA -> CANTIDAD
-        await q.edit_message_text("¿Cuántas has tomado?", reply_markup=qty_kb())
 
-        # Copia de seguridad del estado para no tocar el original
-        sdata2 = dict(sdata)
+@callback_router.route(CB_MENU_ROOT, assigned=False)
+async def cb_menu_root(req: CallbackRequest):
+    await req.q.edit_message_text(
+        "📌 Menú principal:",
+        reply_markup=menu_kb(req.is_admin)
+    )
+
 
-        # Si había una cantidad previa, la borramos para forzar a elegir otra
-        sdata2.pop("qty", None)
+@callback_router.route(CB_RANK_USERS, CB_RANK_USERS_CURR, assigned=False)
+async def cb_rank_users(req: CallbackRequest):
+    today = dt.datetime.now(TZ).date()
+    years = await req.rc.calendar_years()
+    prev_year = (today.year - 1) if (today.year - 1) in years else None
 
-        # Volvemos al paso de cantidad
-        set_state(context, "ADD_QTY", sdata2)
+    txt = await cached_render("users_current", (_week_range(today)[0].year, today.year), render_users_ranking_current, today)
+    rows = []
+    if prev_year:
+        rows.append([InlineKeyboardButton(f"📆 Ver {prev_year}", callback_data=CB_RANK_USERS_PREV)])
+    rows.append([InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)])
+    await req.q.edit_message_text(txt, reply_markup=kb(rows))
+
+
+@callback_router.route(CB_RANK_USERS_PREV, assigned=False)
+async def cb_rank_users_prev(req: CallbackRequest):
+    today = dt.datetime.now(TZ).date()
+    prev_year = today.year - 1
+    years = await req.rc.calendar_years()
+    if prev_year not in years:
+        await req.q.edit_message_text("No hay datos del año anterior.", reply_markup=rank_back_kb())
         return
 
+    txt = "🏆 Ranking por usuarios\n\n" + await cached_render("users_prev", (prev_year,), render_prev_year_extra, prev_year)
+    rows = [
+        [InlineKeyboardButton(f"📆 Volver a {today.year}", callback_data=CB_RANK_USERS_CURR)],
+        [InlineKeyboardButton("⬅️ Volver a Ranking", callback_data=CB_RANK_MENU)],
+    ]
+    await req.q.edit_message_text(txt, reply_markup=kb(rows))
+
 
+@callback_router.route(CB_RANK_TYPES, assigned=False)
+async def cb_rank_types(req: CallbackRequest):
+    today = dt.datetime.now(TZ).date()
+    txt = await cached_render("types_current", (_week_range(today)[0].year, today.year), render_types_ranking_current, today)
+    await req.q.edit_message_text(txt, reply_markup=rank_back_kb())
 
-    # -------- MENÚ --------
-    if data == CB_MENU_ADD:
-        await q.edit_message_text("¿Qué vas a añadir?", reply_markup=categories_kb())
-        set_state(context, "ADD_CAT", {})
+
+# -------- BACKS --------
+@callback_router.route(CB_BACK_MENU)
+async def cb_back_menu(req: CallbackRequest):
+    if req.person.get("status") == "INACTIVE":
+        await req.q.edit_message_text("🚫 Estás suspendido. El admin debe reactivarte.")
+        set_state(req.context, "SUSPENDED", {})
         return
+    await req.q.edit_message_text(
+        f"👋 Hola, {req.person['name']}.\n\n¿Qué quieres hacer?",
+        reply_markup=menu_kb(req.is_admin),
+    )
+    set_state(req.context, "MENU", {})
 
-    if data == CB_MENU_UNDO:
-        person = get_assigned_person(tg_id)
-        if not person and not is_admin(tg_id):
-            await q.edit_message_text(
-                "⚠️ Aún no estás asignado a ningún usuario. Pide al admin que te asigne.",
-                reply_markup=menu_kb(is_admin(tg_id))
-            )
-            set_state(context, "MENU", {})
-            return
 
-        # Muestra las últimas 5 entradas del usuario asignado (más recientes primero)
-        events = list_last_events(person["id"], 5) if person else []
-        if not events:
-            await q.edit_message_text(
-                "No tienes entradas recientes para deshacer.",
-                reply_markup=user_panel_kb()
-            )
-            set_state(context, "PANEL", {})
-            return
+@callback_router.route(CB_MENU_ADD, CB_BACK_CAT)
+async def cb_add(req: CallbackRequest):
+    await req.q.edit_message_text("¿Qué vas a añadir?", reply_markup=categories_kb())
+    set_state(req.context, "ADD_CAT", {})
 
-        await q.edit_message_text("Elige cuál quieres eliminar:", reply_markup=undo_list_kb(events))
-        set_state(context, "UNDO_PICK", {})
-        return
-        await q.edit_message_text("Elige cuál quieres eliminar:", reply_markup=undo_list_kb(events))
-        set_state(context, "UNDO_PICK", {})
-        return
 
-    if data == CB_MENU_REPORT:
-        years = list_years_with_data()
-        if not years:
-            await q.edit_message_text("Aún no hay datos para informes 🙂", reply_markup=menu_kb(is_admin(tg_id)))
-            set_state(context, "MENU", {})
-            return
-        await q.edit_message_text("¿Qué año cervecero quieres ver?", reply_markup=years_kb(years))
-        set_state(context, "REPORT_PICK_YEAR", {})
+@callback_router.route(CB_BACK_TYPE)
+async def cb_back_type(req: CallbackRequest):
+    cat = req.sdata.get("cat")
+    if not cat:
+        await cb_add(req)
         return
+    types = await run_db(list_drink_types, cat)
+    await req.q.edit_message_text("Elige el tipo:", reply_markup=types_kb(types, back_to=CB_BACK_CAT))
+    set_state(req.context, "ADD_TYPE", {"cat": cat})
 
 
-# -------- PANEL USUARIO --------
-    if data == CB_MENU_PANEL or data == CB_PANEL_MENU:
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("No estás asignado. Espera a que el admin te apruebe.")
-            set_state(context, "PENDING", {})
-            return
-        if person.get("status") == "INACTIVE":
-            await q.edit_message_text("🚫 Estás suspendido. El admin tiene que reactivarte para volver a usar el bot.")
-            set_state(context, "SUSPENDED", {})
-            return
+@callback_router.route(CB_BACK_QTY)
+async def cb_back_qty(req: CallbackRequest):
+    # Volver desde FECHA -> CANTIDAD
+    await req.q.edit_message_text("¿Cuántas has tomado?", reply_markup=qty_kb())
 
-        await q.edit_message_text("👤 Panel de usuario", reply_markup=user_panel_kb())
-        set_state(context, "PANEL", {})
-        return
+    # Copia de seguridad del estado para no tocar el original
+    sdata2 = dict(req.sdata)
 
-    if data == CB_PANEL_DRINKS:
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("No estás asignado. Espera a que el admin te apruebe.")
-            set_state(context, "PENDING", {})
-            return
+    # Si había una cantidad previa, la borramos para forzar a elegir otra
+    sdata2.pop("qty", None)
 
-        events = list_user_events_page(person["id"], limit=15)
-        if not events:
-            await q.edit_message_text(
-                "Aún no has añadido bebidas 🙂",
-                reply_markup=panel_history_kb(False, False, None, None),
-            )
-            set_state(context, "PANEL_DRINKS", {"oldest": None, "newest": None})
-            return
+    # Volvemos al paso de cantidad
+    set_state(req.context, "ADD_QTY", sdata2)
 
-        newest_id = max(e["id"] for e in events)
-        oldest_id = min(e["id"] for e in events)
-        has_older = bool(list_user_events_page(person["id"], limit=1, before_id=oldest_id))
-        has_newer = bool(list_user_events_page(person["id"], limit=1, after_id=newest_id))
 
-        lines = "\n".join(format_event_line(e) for e in events)
-        await q.edit_message_text(
-            "🕒 *Mis últimas bebidas* (15 más recientes)\n\n" + lines,
-            reply_markup=panel_history_kb(has_older, has_newer, oldest_id, newest_id),
-            parse_mode="Markdown",
+# -------- MENÚ --------
+@callback_router.route(CB_MENU_UNDO)
+async def cb_menu_undo(req: CallbackRequest):
+    # Muestra las últimas 5 entradas del usuario asignado (más recientes primero)
+    events = await run_db(list_last_events, req.person["id"], 5)
+    if not events:
+        await req.q.edit_message_text(
+            "No tienes entradas recientes para deshacer.",
+            reply_markup=user_panel_kb()
         )
-        set_state(context, "PANEL_DRINKS", {"oldest": oldest_id, "newest": newest_id})
+        set_state(req.context, "PANEL", {})
         return
 
-    if data.startswith(CB_PANEL_OLDER):
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("No estás asignado. Espera a que el admin te apruebe.")
-            set_state(context, "PENDING", {})
-            return
+    await req.q.edit_message_text("Elige cuál quieres eliminar:", reply_markup=undo_list_kb(events))
+    set_state(req.context, "UNDO_PICK", {})
 
-        try:
-            cursor_id = int(data.split(":", 2)[-1])
-        except Exception:
-            await q.edit_message_text("⚠️ Cursor inválido.", reply_markup=user_panel_kb())
-            set_state(context, "PANEL", {})
-            return
 
-        events = list_user_events_page(person["id"], limit=15, before_id=cursor_id)
-        if not events:
-            await q.edit_message_text(
-                "No hay más antiguas.",
-                reply_markup=panel_history_kb(False, True, None, cursor_id),
-            )
-            return
+@callback_router.route(CB_MENU_REPORT)
+async def cb_menu_report(req: CallbackRequest):
+    years = await req.rc.beer_years()
+    if not years:
+        await req.q.edit_message_text("Aún no hay datos para informes 🙂", reply_markup=menu_kb(req.is_admin))
+        set_state(req.context, "MENU", {})
+        return
+    await req.q.edit_message_text("¿Qué año cervecero quieres ver?", reply_markup=years_kb(years))
+    set_state(req.context, "REPORT_PICK_YEAR", {})
 
-        newest_id = max(e["id"] for e in events)
-        oldest_id = min(e["id"] for e in events)
-        has_older = bool(list_user_events_page(person["id"], limit=1, before_id=oldest_id))
-        has_newer = bool(list_user_events_page(person["id"], limit=1, after_id=newest_id))
 
-        lines = "\n".join(format_event_line(e) for e in events)
-        await q.edit_message_text(
-            "🕒 *Historial de bebidas*\n\n" + lines,
-            reply_markup=panel_history_kb(has_older, has_newer, oldest_id, newest_id),
-            parse_mode="Markdown",
-        )
-        set_state(context, "PANEL_DRINKS", {"oldest": oldest_id, "newest": newest_id})
+# -------- PANEL USUARIO --------
+@callback_router.route(CB_MENU_PANEL, CB_PANEL_MENU, CB_BACK_PANEL)
+async def cb_panel(req: CallbackRequest):
+    if req.person.get("status") == "INACTIVE":
+        await req.q.edit_message_text("🚫 Estás suspendido. El admin tiene que reactivarte para volver a usar el bot.")
+        set_state(req.context, "SUSPENDED", {})
         return
 
-    if data.startswith(CB_PANEL_NEWER):
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("No estás asignado. Espera a que el admin te apruebe.")
-            set_state(context, "PENDING", {})
-            return
+    await req.q.edit_message_text("👤 Panel de usuario", reply_markup=user_panel_kb())
+    set_state(req.context, "PANEL", {})
 
-        try:
-            cursor_id = int(data.split(":", 2)[-1])
-        except Exception:
-            await q.edit_message_text("⚠️ Cursor inválido.", reply_markup=user_panel_kb())
-            set_state(context, "PANEL", {})
-            return
 
-        # DB devuelve asc, invertimos para mostrar desc
-        events_asc = list_user_events_page(person["id"], limit=15, after_id=cursor_id)
-        events = list(reversed(events_asc))
-        if not events:
-            await q.edit_message_text(
-                "Ya estás en las más recientes.",
-                reply_markup=panel_history_kb(True, False, cursor_id, None),
-            )
-            return
+async def _show_history_page(req: CallbackRequest, title: str, events, has_older: bool, has_newer: bool):
+    newest_id = max(e["id"] for e in events)
+    oldest_id = min(e["id"] for e in events)
+
+    lines = "\n".join(format_event_line(e) for e in events)
+    await req.q.edit_message_text(
+        title + "\n\n" + lines,
+        reply_markup=panel_history_kb(has_older, has_newer, oldest_id, newest_id),
+        parse_mode="Markdown",
+    )
+    set_state(req.context, "PANEL_DRINKS", {"oldest": oldest_id, "newest": newest_id})
+
+
+async def _history_cursor(req: CallbackRequest):
+    try:
+        return int(req.arg)
+    except ValueError:
+        await req.q.edit_message_text("⚠️ Cursor inválido.", reply_markup=user_panel_kb())
+        set_state(req.context, "PANEL", {})
+        return None
 
-        newest_id = max(e["id"] for e in events)
-        oldest_id = min(e["id"] for e in events)
-        has_older = bool(list_user_events_page(person["id"], limit=1, before_id=oldest_id))
-        has_newer = bool(list_user_events_page(person["id"], limit=1, after_id=newest_id))
 
-        lines = "\n".join(format_event_line(e) for e in events)
-        await q.edit_message_text(
-            "🕒 *Historial de bebidas*\n\n" + lines,
-            reply_markup=panel_history_kb(has_older, has_newer, oldest_id, newest_id),
-            parse_mode="Markdown",
+@callback_router.route(CB_PANEL_DRINKS)
+async def cb_panel_drinks(req: CallbackRequest):
+    events, has_older, has_newer = await run_db(list_user_events_page, req.person["id"], limit=15)
+    if not events:
+        await req.q.edit_message_text(
+            "Aún no has añadido bebidas 🙂",
+            reply_markup=panel_history_kb(False, False, None, None),
         )
-        set_state(context, "PANEL_DRINKS", {"oldest": oldest_id, "newest": newest_id})
+        set_state(req.context, "PANEL_DRINKS", {"oldest": None, "newest": None})
         return
+    await _show_history_page(req, "🕒 *Mis últimas bebidas* (15 más recientes)", events, has_older, has_newer)
 
-    # -------- ADMIN --------
-    if data == CB_MENU_ADMIN:
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.", reply_markup=menu_kb(False))
-            return
-        await q.edit_message_text("⚙️ Administración", reply_markup=admin_main_kb())
-        set_state(context, "ADMIN", {})
+
+@callback_router.route(CB_PANEL_OLDER)
+async def cb_panel_older(req: CallbackRequest):
+    cursor_id = await _history_cursor(req)
+    if cursor_id is None:
         return
 
-    if data == CB_ADMIN_PERSONS:
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        await q.edit_message_text("👥 Personas (histórico)", reply_markup=admin_persons_menu_kb())
-        set_state(context, "ADMIN_PERSONS_MENU", {})
+    events, has_older, has_newer = await run_db(list_user_events_page, req.person["id"], limit=15, before_id=cursor_id)
+    if not events:
+        await req.q.edit_message_text(
+            "No hay más antiguas.",
+            reply_markup=panel_history_kb(False, True, None, cursor_id),
+        )
         return
+    await _show_history_page(req, "🕒 *Historial de bebidas*", events, has_older, has_newer)
 
-    if data.startswith(CB_ADMIN_PERSONS_FILTER):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        filt = data.split(":", 2)[2]
-        if filt == "ACTIVE":
-            persons = list_persons_by_status("ACTIVE")
-            title = "✅ Personas ACTIVAS"
-        elif filt == "INACTIVE":
-            persons = list_persons_by_status("INACTIVE")
-            title = "⛔ Personas INACTIVAS"
-        else:
-            persons = list_persons_without_active_telegram()
-            title = "🆓 Personas SIN TELEGRAM"
-        if not persons:
-            await q.edit_message_text(f"{title}\n\n(ninguna)", reply_markup=admin_persons_menu_kb())
-            set_state(context, "ADMIN_PERSONS_MENU", {})
-            return
-        await q.edit_message_text(title, reply_markup=admin_person_list_kb(persons))
-        set_state(context, "ADMIN_PERSONS_LIST", {"filter": filt})
+
+@callback_router.route(CB_PANEL_NEWER)
+async def cb_panel_newer(req: CallbackRequest):
+    cursor_id = await _history_cursor(req)
+    if cursor_id is None:
         return
 
-    if data == CB_ADMIN_SEARCH_PERSON:
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        await q.edit_message_text("🔎 Escribe el nombre (o parte) para buscar:")
-        set_state(context, "ADMIN_PERSON_SEARCH", {})
+    events, has_older, has_newer = await run_db(list_user_events_page, req.person["id"], limit=15, after_id=cursor_id)
+    if not events:
+        await req.q.edit_message_text(
+            "Ya estás en las más recientes.",
+            reply_markup=panel_history_kb(True, False, cursor_id, None),
+        )
         return
+    await _show_history_page(req, "🕒 *Historial de bebidas*", events, has_older, has_newer)
 
-    if data.startswith(CB_ADMIN_PERSON_VIEW):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.split(":", 2)[2])
-        prof = get_person_profile(person_id)
-        if not prof:
-            await q.edit_message_text("⚠️ No encontrada.", reply_markup=admin_persons_menu_kb())
-            set_state(context, "ADMIN_PERSONS_MENU", {})
-            return
 
-        p = prof["person"]
-        active = prof["active_account"]
-        prev = prof["previous_accounts"]
-        stats = prof["stats"]
+# -------- ADMIN --------
+@callback_router.route(CB_MENU_ADMIN, admin=True)
+async def cb_menu_admin(req: CallbackRequest):
+    await req.q.edit_message_text("⚙️ Administración", reply_markup=admin_main_kb())
+    set_state(req.context, "ADMIN", {})
 
-        lines = [f"👤 Ficha: {p['name']}", f"Estado: {p['status']}"]
 
-        if active:
-            lines.append(f"Telegram activo: {active['telegram_user_id']}")
-        else:
-            lines.append("Telegram activo: —")
+@callback_router.route(CB_ADMIN_PERSONS, admin=True)
+async def cb_admin_persons(req: CallbackRequest):
+    await req.q.edit_message_text("👥 Personas (histórico)", reply_markup=admin_persons_menu_kb())
+    set_state(req.context, "ADMIN_PERSONS_MENU", {})
 
-        if prev:
-            lines.append("")
-            lines.append("Telegrams anteriores:")
-            for r in prev[:5]:
-                ua = r.get("unassigned_at")
-                ua_txt = ua.strftime("%Y-%m-%d") if ua else "?"
-                lines.append(f"• {r['telegram_user_id']} (hasta {ua_txt})")
 
-        lines.append("")
-        last = stats.get("last_activity_at")
-        last_txt = last.strftime("%Y-%m-%d") if last else "—"
-        lines.append(f"Eventos: {int(stats.get('events_count') or 0)}")
-        lines.append(f"Última actividad: {last_txt}")
-
-        await q.edit_message_text(
-            "\n".join(lines),
-            reply_markup=admin_person_profile_kb(p["id"], p["status"], bool(active)),
-        )
-        set_state(context, "ADMIN_PERSON_PROFILE", {"person_id": p["id"]})
+@callback_router.route(CB_ADMIN_PERSONS_FILTER, admin=True)
+async def cb_admin_persons_filter(req: CallbackRequest):
+    filt = req.arg
+    if filt == "ACTIVE":
+        persons = await run_db(list_persons_by_status, "ACTIVE")
+        title = "✅ Personas ACTIVAS"
+    elif filt == "INACTIVE":
+        persons = await run_db(list_persons_by_status, "INACTIVE")
+        title = "⛔ Personas INACTIVAS"
+    else:
+        persons = await run_db(list_persons_without_active_telegram)
+        title = "🆓 Personas SIN TELEGRAM"
+    if not persons:
+        await req.q.edit_message_text(f"{title}\n\n(ninguna)", reply_markup=admin_persons_menu_kb())
+        set_state(req.context, "ADMIN_PERSONS_MENU", {})
         return
+    await req.q.edit_message_text(title, reply_markup=admin_person_list_kb(persons))
+    set_state(req.context, "ADMIN_PERSONS_LIST", {"filter": filt})
 
-    if data.startswith(CB_ADMIN_PERSON_ASSIGN):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.split(":", 2)[2])
-        reqs = list_pending_telegrams(20)
-        if not reqs:
-            await q.edit_message_text(
-                "📨 No hay solicitudes pendientes ahora mismo.",
-                reply_markup=admin_person_profile_kb(person_id, get_person_profile(person_id)["person"]["status"], False),
-            )
-            set_state(context, "ADMIN_PERSON_PROFILE", {"person_id": person_id})
-            return
-        await q.edit_message_text("📨 Elige un Telegram pendiente para asignar:", reply_markup=admin_requests_kb(reqs))
-        set_state(context, "ADMIN_ASSIGN_PICK_TG", {"person_id": person_id})
+
+@callback_router.route(CB_ADMIN_SEARCH_PERSON, admin=True)
+async def cb_admin_search_person(req: CallbackRequest):
+    await req.q.edit_message_text("🔎 Escribe el nombre (o parte) para buscar:")
+    set_state(req.context, "ADMIN_PERSON_SEARCH", {})
+
+
+@callback_router.route(CB_ADMIN_PERSON_VIEW, admin=True)
+async def cb_admin_person_view(req: CallbackRequest):
+    person_id = int(req.arg)
+    prof = await run_db(get_person_profile, person_id)
+    if not prof:
+        await req.q.edit_message_text("⚠️ No encontrada.", reply_markup=admin_persons_menu_kb())
+        set_state(req.context, "ADMIN_PERSONS_MENU", {})
         return
 
-    if data.startswith(CB_ADMIN_PICK_TG):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        picked_tg = int(data.split(":", 2)[2])
-
-        # Si venimos de "asignar a persona"
-        if state == "ADMIN_ASSIGN_PICK_TG" and sdata.get("person_id"):
-            person_id = int(sdata["person_id"])
-            st, _ = admin_assign_telegram_to_person(person_id, picked_tg)
-            if st == "TG_TAKEN":
-                await q.edit_message_text("⚠️ Ese Telegram ya está asignado a otra persona.")
-                return
-            if st == "NOT_FOUND":
-                await q.edit_message_text("⚠️ Persona no encontrada.")
-                return
-
-            prof = get_person_profile(person_id)
-            name = prof["person"]["name"] if prof else "la persona"
-            await q.edit_message_text(f"✅ Asignado {picked_tg} a {name}.")
-            # Volver a ficha
-            prof = get_person_profile(person_id)
-            if prof:
-                p = prof["person"]
-                await q.message.reply_text(
-                    f"👤 {p['name']} actualizado.",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Abrir ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]),
-                )
-            set_state(context, "ADMIN", {})
-            return
+    p = prof["person"]
+    active = prof["active_account"]
+    prev = prof["previous_accounts"]
+    stats = prof["stats"]
 
-        # Vista simple de solicitud (desde menú solicitudes)
-        await q.edit_message_text(
-            f"📨 Solicitud pendiente\n\nTelegram: {picked_tg}\n\nPara asignarlo: abre una persona y pulsa “Asignar Telegram”.",
-            reply_markup=admin_main_kb(),
+    lines = [f"👤 Ficha: {p['name']}", f"Estado: {p['status']}"]
+
+    if active:
+        lines.append(f"Telegram activo: {active['telegram_user_id']}")
+    else:
+        lines.append("Telegram activo: —")
+
+    if prev:
+        lines.append("")
+        lines.append("Telegrams anteriores:")
+        for r in prev[:5]:
+            ua = r.get("unassigned_at")
+            ua_txt = ua.strftime("%Y-%m-%d") if ua else "?"
+            lines.append(f"• {r['telegram_user_id']} (hasta {ua_txt})")
+
+    lines.append("")
+    last = stats.get("last_activity_at")
+    last_txt = last.strftime("%Y-%m-%d") if last else "—"
+    lines.append(f"Eventos: {int(stats.get('events_count') or 0)}")
+    lines.append(f"Última actividad: {last_txt}")
+
+    await req.q.edit_message_text(
+        "\n".join(lines),
+        reply_markup=admin_person_profile_kb(p["id"], p["status"], bool(active)),
+    )
+    set_state(req.context, "ADMIN_PERSON_PROFILE", {"person_id": p["id"]})
+
+
+@callback_router.route(CB_ADMIN_PERSON_ASSIGN, admin=True)
+async def cb_admin_person_assign(req: CallbackRequest):
+    person_id = int(req.arg)
+    reqs = await run_db(list_pending_telegrams, 20)
+    if not reqs:
+        await req.q.edit_message_text(
+            "📨 No hay solicitudes pendientes ahora mismo.",
+            reply_markup=admin_person_profile_kb(person_id, (await run_db(get_person_profile, person_id))["person"]["status"], False),
         )
-        set_state(context, "ADMIN", {})
+        set_state(req.context, "ADMIN_PERSON_PROFILE", {"person_id": person_id})
         return
+    await req.q.edit_message_text("📨 Elige un Telegram pendiente para asignar:", reply_markup=admin_requests_kb(reqs))
+    set_state(req.context, "ADMIN_ASSIGN_PICK_TG", {"person_id": person_id})
+
+
+@callback_router.route(CB_ADMIN_PICK_TG, admin=True)
+async def cb_admin_pick_tg(req: CallbackRequest):
+    q = req.q
+    picked_tg = int(req.arg)
 
-    if data == CB_ADMIN_REQUESTS:
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
+    # Si venimos de "asignar a persona"
+    if req.state == "ADMIN_ASSIGN_PICK_TG" and req.sdata.get("person_id"):
+        person_id = int(req.sdata["person_id"])
+        st, _ = await run_db(admin_assign_telegram_to_person, person_id, picked_tg)
+        if st == "TG_TAKEN":
+            await q.edit_message_text("⚠️ Ese Telegram ya está asignado a otra persona.")
             return
-        reqs = list_pending_telegrams(20)
-        if not reqs:
-            await q.edit_message_text("📨 No hay solicitudes pendientes.", reply_markup=admin_main_kb())
-            set_state(context, "ADMIN", {})
+        if st == "NOT_FOUND":
+            await q.edit_message_text("⚠️ Persona no encontrada.")
             return
-        await q.edit_message_text("📨 Solicitudes pendientes:", reply_markup=admin_requests_kb(reqs))
-        set_state(context, "ADMIN_REQUESTS", {})
-        return
 
-    if data == CB_ADMIN_CREATE_PERSON:
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        await q.edit_message_text("➕ Escribe el nombre de la nueva persona/plaza:")
-        set_state(context, "ADMIN_CREATE_PERSON", {})
+        prof = await run_db(get_person_profile, person_id)
+        name = prof["person"]["name"] if prof else "la persona"
+        await q.edit_message_text(f"✅ Asignado {picked_tg} a {name}.")
+        # Volver a ficha
+        if prof:
+            p = prof["person"]
+            await q.message.reply_text(
+                f"👤 {p['name']} actualizado.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Abrir ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]),
+            )
+        set_state(req.context, "ADMIN", {})
         return
 
-    if data.startswith(CB_ADMIN_PERSON_SUSPEND):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.split(":", 2)[2])
-        admin_suspend_person(person_id)
-        await q.edit_message_text("✅ Persona suspendida.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Volver a ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]))
-        set_state(context, "ADMIN", {})
-        return
+    # Vista simple de solicitud (desde menú solicitudes)
+    await q.edit_message_text(
+        f"📨 Solicitud pendiente\n\nTelegram: {picked_tg}\n\nPara asignarlo: abre una persona y pulsa “Asignar Telegram”.",
+        reply_markup=admin_main_kb(),
+    )
+    set_state(req.context, "ADMIN", {})
 
-    if data.startswith(CB_ADMIN_PERSON_REACTIVATE):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.split(":", 2)[2])
-        admin_reactivate_person(person_id)
-        await q.edit_message_text("✅ Persona reactivada.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Volver a ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]))
-        set_state(context, "ADMIN", {})
-        return
 
-    if data.startswith(CB_ADMIN_PERSON_DELETE):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.split(":", 2)[2])
-        prof = get_person_profile(person_id)
-        if not prof:
-            await q.edit_message_text("⚠️ No encontrada.", reply_markup=admin_persons_menu_kb())
-            return
-        name = prof["person"]["name"]
-        warn = (
-            f"💀 Vas a ELIMINAR a {name}.\n\n"
-            "Esto borra TODO: persona/plaza, eventos e historial de Telegram.\n"
-            "Si esa persona tenía Telegram asignado, tendrá que volver a solicitar acceso y aprobarlo el admin."
-        )
-        await q.edit_message_text(warn, reply_markup=admin_delete_confirm_kb(person_id))
-        set_state(context, "ADMIN_DELETE_CONFIRM_1", {"person_id": person_id, "name": name})
+@callback_router.route(CB_ADMIN_REQUESTS, admin=True)
+async def cb_admin_requests(req: CallbackRequest):
+    reqs = await run_db(list_pending_telegrams, 20)
+    if not reqs:
+        await req.q.edit_message_text("📨 No hay solicitudes pendientes.", reply_markup=admin_main_kb())
+        set_state(req.context, "ADMIN", {})
         return
+    await req.q.edit_message_text("📨 Solicitudes pendientes:", reply_markup=admin_requests_kb(reqs))
+    set_state(req.context, "ADMIN_REQUESTS", {})
 
-    if data.startswith(CB_ADMIN_PERSON_DELETE_CONFIRM):
-        if not is_admin(tg_id):
-            await q.edit_message_text("🚫 No tienes permisos.")
-            return
-        person_id = int(data.rsplit(':', 1)[1])
-        prof = get_person_profile(person_id)
-        name = (prof["person"]["name"] if prof else sdata.get("name") or "persona")
-        await q.edit_message_text(f"✍️ Escribe EXACTAMENTE:\n\nELIMINAR {name}")
-        set_state(context, "ADMIN_DELETE_CONFIRM_TEXT", {"person_id": person_id, "name": name})
-        return
 
-    # -------- INFORME POR AÑO + RANKINGS --------
-    if data.startswith(CB_YEAR):
-        y = int(data.split(":", 1)[1])
+@callback_router.route(CB_ADMIN_CREATE_PERSON, admin=True)
+async def cb_admin_create_person(req: CallbackRequest):
+    await req.q.edit_message_text("➕ Escribe el nombre de la nueva persona/plaza:")
+    set_state(req.context, "ADMIN_CREATE_PERSON", {})
 
-        person = get_assigned_person(tg_id)
-        if not person:
-            await q.edit_message_text("🚫 No estás registrado. Usa /start.")
-            return
 
-        # -------- Helpers de formato --------
-        def fmt_units(n): 
-            return f"{int(n)} uds"
-
-        def fmt_liters(x): 
-            return f"{float(x):.2f} L"
-
-        def fmt_eur(x): 
-            return f"{float(x):.2f} €"
-
-        # -------- Datos --------
-        personal_rows = person_year_breakdown(person["id"], y)
-        year_rows = report_year(y)
-        drinks_year = year_drinks_totals(y)
-        per_type_people = year_drink_type_person_totals(y)
-
-        # -------- Construcción mensaje --------
-        lines = [f"📊 Informe {y}-{y+1}", "", "👤 Tu informe personal (solo tú)", person["name"], ""]
-
-        beers = [r for r in personal_rows if r["category"] == "BEER"]
-        others = [r for r in personal_rows if r["category"] == "OTHER"]
-
-        def sum_block(rows):
-            total_u = sum(int(r["unidades"]) for r in rows)
-            total_l = sum(float(r["litros"]) for r in rows)
-            total_e = sum(float(r["euros"]) for r in rows)
-            return total_u, total_l, total_e
-
-        if beers:
-            lines.append("🍺 Cervezas")
-            for r in beers:
-                lines.append(f"• {r['label']} — {fmt_units(r['unidades'])} · {fmt_liters(r['litros'])} · {fmt_eur(r['euros'])}")
-            bu, bl, be = sum_block(beers)
-            lines.append(f"Total cerveza: {fmt_units(bu)} · {fmt_liters(bl)} · {fmt_eur(be)}")
-            lines.append("")
-
-        if others:
-            lines.append("🥃 Otros")
-            for r in others:
-                # si NO quieres euros aquí, quita "· {fmt_eur...}"
-                lines.append(f"• {r['label']} — {fmt_units(r['unidades'])} · {fmt_eur(r['euros'])}")
-            ou = sum(int(r["unidades"]) for r in others)
-            oe = sum(float(r["euros"]) for r in others)
-            lines.append(f"Total otros: {fmt_units(ou)} · {fmt_eur(oe)}")
-            lines.append("")
-
-        tu = sum(int(r["unidades"]) for r in personal_rows)
-        te = sum(float(r["euros"]) for r in personal_rows)
-        lines.append(f"💸 Total general: {tu} consumiciones · {fmt_eur(te)}")
-        lines.append("")
-        lines.append("🏆 Rankings públicos")
+@callback_router.route(CB_ADMIN_PERSON_SUSPEND, admin=True)
+async def cb_admin_person_suspend(req: CallbackRequest):
+    person_id = int(req.arg)
+    await run_db(admin_suspend_person, person_id)
+    await req.q.edit_message_text("✅ Persona suspendida.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Volver a ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]))
+    set_state(req.context, "ADMIN", {})
+
+
+@callback_router.route(CB_ADMIN_PERSON_REACTIVATE, admin=True)
+async def cb_admin_person_reactivate(req: CallbackRequest):
+    person_id = int(req.arg)
+    await run_db(admin_reactivate_person, person_id)
+    await req.q.edit_message_text("✅ Persona reactivada.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Volver a ficha", callback_data=f"{CB_ADMIN_PERSON_VIEW}{person_id}")]]))
+    set_state(req.context, "ADMIN", {})
+
+
+@callback_router.route(CB_ADMIN_PERSON_DELETE, admin=True)
+async def cb_admin_person_delete(req: CallbackRequest):
+    person_id = int(req.arg)
+    prof = await run_db(get_person_profile, person_id)
+    if not prof:
+        await req.q.edit_message_text("⚠️ No encontrada.", reply_markup=admin_persons_menu_kb())
+        return
+    name = prof["person"]["name"]
+    warn = (
+        f"💀 Vas a ELIMINAR a {name}.\n\n"
+        "Esto borra TODO: persona/plaza, eventos e historial de Telegram.\n"
+        "Si esa persona tenía Telegram asignado, tendrá que volver a solicitar acceso y aprobarlo el admin."
+    )
+    await req.q.edit_message_text(warn, reply_markup=admin_delete_confirm_kb(person_id))
+    set_state(req.context, "ADMIN_DELETE_CONFIRM_1", {"person_id": person_id, "name": name})
+
+
+@callback_router.route(CB_ADMIN_PERSON_DELETE_CONFIRM, admin=True)
+async def cb_admin_person_delete_confirm(req: CallbackRequest):
+    person_id = int(req.arg)
+    prof = await run_db(get_person_profile, person_id)
+    name = (prof["person"]["name"] if prof else req.sdata.get("name") or "persona")
+    await req.q.edit_message_text(f"✍️ Escribe EXACTAMENTE:\n\nELIMINAR {name}")
+    set_state(req.context, "ADMIN_DELETE_CONFIRM_TEXT", {"person_id": person_id, "name": name})
+
+
+# -------- INFORME POR AÑO + RANKINGS --------
+@callback_router.route(CB_YEAR)
+async def cb_year(req: CallbackRequest):
+    y = int(req.arg)
+    person = req.person
+
+    # -------- Helpers de formato --------
+    def fmt_units(n):
+        return f"{int(n)} uds"
+
+    def fmt_liters(x):
+        return f"{float(x):.2f} L"
+
+    def fmt_eur(x):
+        return f"{float(x):.2f} €"
+
+    # -------- Datos --------
+    personal_rows = await run_db(person_year_breakdown, person["id"], y)
+    year_rows = await run_db(report_year, y)
+    drinks_year = await run_db(year_drinks_totals, y)
+    per_type_people = await run_db(year_drink_type_person_totals, y)
+
+    # -------- Construcción mensaje --------
+    lines = [f"📊 Informe {y}-{y+1}", "", "👤 Tu informe personal (solo tú)", person["name"], ""]
+
+    beers = [r for r in personal_rows if r["category"] == "BEER"]
+    others = [r for r in personal_rows if r["category"] == "OTHER"]
+
+    def sum_block(rows):
+        total_u = sum(int(r["unidades"]) for r in rows)
+        total_l = sum(float(r["litros"]) for r in rows)
+        total_e = sum(float(r["euros"]) for r in rows)
+        return total_u, total_l, total_e
+
+    if beers:
+        lines.append("🍺 Cervezas")
+        for r in beers:
+            lines.append(f"• {r['label']} — {fmt_units(r['unidades'])} · {fmt_liters(r['litros'])} · {fmt_eur(r['euros'])}")
+        bu, bl, be = sum_block(beers)
+        lines.append(f"Total cerveza: {fmt_units(bu)} · {fmt_liters(bl)} · {fmt_eur(be)}")
         lines.append("")
 
-        ranked_liters = sorted(
-            [r for r in year_rows if float(r["litros"]) > 0],
-            key=lambda r: float(r["litros"]),
-            reverse=True
-        )
-        lines.append("🍺 Ranking total por litros")
-        if not ranked_liters:
-            lines.append("Nadie ha apuntado litros aún 😇")
-        else:
-            for i, r in enumerate(ranked_liters, 1):
-                lines.append(f"{i}. {r['name']} — {fmt_liters(r['litros'])}")
+    if others:
+        lines.append("🥃 Otros")
+        for r in others:
+            # si NO quieres euros aquí, quita "· {fmt_eur...}"
+            lines.append(f"• {r['label']} — {fmt_units(r['unidades'])} · {fmt_eur(r['euros'])}")
+        ou = sum(int(r["unidades"]) for r in others)
+        oe = sum(float(r["euros"]) for r in others)
+        lines.append(f"Total otros: {fmt_units(ou)} · {fmt_eur(oe)}")
         lines.append("")
 
-        lines.append("🔥 Bebidas del año")
-        if not drinks_year:
-            lines.append("Nada registrado todavía.")
+    tu = sum(int(r["unidades"]) for r in personal_rows)
+    te = sum(float(r["euros"]) for r in personal_rows)
+    lines.append(f"💸 Total general: {tu} consumiciones · {fmt_eur(te)}")
+    lines.append("")
+    lines.append("🏆 Rankings públicos")
+    lines.append("")
+
+    ranked_liters = sorted(
+        [r for r in year_rows if float(r["litros"]) > 0],
+        key=lambda r: float(r["litros"]),
+        reverse=True
+    )
+    lines.append("🍺 Ranking total por litros")
+    if not ranked_liters:
+        lines.append("Nadie ha apuntado litros aún 😇")
+    else:
+        for i, r in enumerate(ranked_liters, 1):
+            lines.append(f"{i}. {r['name']} — {fmt_liters(r['litros'])}")
+    lines.append("")
+
+    lines.append("🔥 Bebidas del año")
+    if not drinks_year:
+        lines.append("Nada registrado todavía.")
+    else:
+        for i, r in enumerate(drinks_year, 1):
+            has_liters = bool(r["has_liters"])
+            u = int(r["unidades"])
+            l = float(r["litros"])
+            if has_liters and l > 0:
+                lines.append(f"{i}. {r['label']} — {fmt_liters(l)} ({fmt_units(u)})")
+            else:
+                lines.append(f"{i}. {r['label']} — {fmt_units(u)}")
+    lines.append("")
+    lines.append("🍺 Ranking por tipo de bebida")
+    lines.append("")
+
+    grouped = {}
+    for r in per_type_people:
+        key = (r["category"], r["label"], bool(r["has_liters"]))
+        grouped.setdefault(key, []).append(r)
+
+    keys_sorted = sorted(grouped.keys(), key=lambda k: (0 if k[0] == "BEER" else 1, k[1].lower()))
+
+    for (cat, label, has_liters) in keys_sorted:
+        rows = grouped[(cat, label, has_liters)]
+        emoji = "🍺" if cat == "BEER" else "🥃"
+        lines.append(f"{emoji} {label}")
+
+        if has_liters:
+            rows = sorted(rows, key=lambda x: (float(x["litros"]), int(x["unidades"]), x["person_name"]), reverse=True)
+            for i, rr in enumerate(rows, 1):
+                lines.append(f"{i}. {rr['person_name']} — {fmt_liters(rr['litros'])} ({fmt_units(rr['unidades'])})")
         else:
-            for i, r in enumerate(drinks_year, 1):
-                has_liters = bool(r["has_liters"])
-                u = int(r["unidades"])
-                l = float(r["litros"])
-                if has_liters and l > 0:
-                    lines.append(f"{i}. {r['label']} — {fmt_liters(l)} ({fmt_units(u)})")
-                else:
-                    lines.append(f"{i}. {r['label']} — {fmt_units(u)}")
-        lines.append("")
-        lines.append("🍺 Ranking por tipo de bebida")
+            rows = sorted(rows, key=lambda x: (int(x["unidades"]), x["person_name"]), reverse=True)
+            for i, rr in enumerate(rows, 1):
+                lines.append(f"{i}. {rr['person_name']} — {fmt_units(rr['unidades'])}")
+
         lines.append("")
 
-        grouped = {}
-        for r in per_type_people:
-            key = (r["category"], r["label"], bool(r["has_liters"]))
-            grouped.setdefault(key, []).append(r)
+    await req.q.edit_message_text("\n".join(lines).rstrip(), reply_markup=menu_kb(req.is_admin))
+    set_state(req.context, "MENU", {})
 
-        keys_sorted = sorted(grouped.keys(), key=lambda k: (0 if k[0] == "BEER" else 1, k[1].lower()))
 
-        for (cat, label, has_liters) in keys_sorted:
-            rows = grouped[(cat, label, has_liters)]
-            emoji = "🍺" if cat == "BEER" else "🥃"
-            lines.append(f"{emoji} {label}")
+# -------- AÑADIR: CATEGORÍA --------
+@callback_router.route(CB_CAT)
+async def cb_cat(req: CallbackRequest):
+    cat = req.arg
+    types = await run_db(list_drink_types, cat)
+    title = "🍺 Elige el tipo de cerveza:" if cat == "BEER" else "🥃 Elige el tipo:"
+    await req.q.edit_message_text(title, reply_markup=types_kb(types, back_to=CB_BACK_CAT))
+    set_state(req.context, "ADD_TYPE", {"cat": cat})
 
-            if has_liters:
-                rows = sorted(rows, key=lambda x: (float(x["litros"]), int(x["unidades"]), x["person_name"]), reverse=True)
-                for i, rr in enumerate(rows, 1):
-                    lines.append(f"{i}. {rr['person_name']} — {fmt_liters(rr['litros'])} ({fmt_units(rr['unidades'])})")
-            else:
-                rows = sorted(rows, key=lambda x: (int(x["unidades"]), x["person_name"]), reverse=True)
-                for i, rr in enumerate(rows, 1):
-                    lines.append(f"{i}. {rr['person_name']} — {fmt_units(rr['unidades'])}")
 
-            lines.append("")
+# -------- AÑADIR: TIPO --------
+@callback_router.route(CB_TYPE)
+async def cb_type(req: CallbackRequest):
+    drink_type_id = int(req.arg)
+    await req.q.edit_message_text("¿Cuántas has tomado?", reply_markup=qty_kb())
+    set_state(req.context, "ADD_QTY", {**req.sdata, "drink_type_id": drink_type_id})
 
-        await q.edit_message_text("\n".join(lines).rstrip(), reply_markup=menu_kb(is_admin(tg_id)))
-        set_state(context, "MENU", {})
-        return
 
-    # -------- AÑADIR: CATEGORÍA --------
-    if data.startswith(CB_CAT):
-        cat = data.split(":", 1)[1]
-        types = list_drink_types(cat)
-        title = "🍺 Elige el tipo de cerveza:" if cat == "BEER" else "🥃 Elige el tipo:"
-        await q.edit_message_text(title, reply_markup=types_kb(types, back_to="cat"))
-        set_state(context, "ADD_TYPE", {"cat": cat})
+# -------- AÑADIR: CANTIDAD --------
+@callback_router.route(CB_QTY)
+async def cb_qty(req: CallbackRequest):
+    if req.arg == "more":
+        await req.q.edit_message_text("Vale 🙂 Escribe el número (ej: 7):")
+        set_state(req.context, "ADD_QTY_MANUAL", req.sdata)
         return
 
-    # -------- AÑADIR: TIPO --------
-    if data.startswith(CB_TYPE):
-        drink_type_id = int(data.split(":", 1)[1])
-        await q.edit_message_text("¿Cuántas has tomado?", reply_markup=qty_kb())
-        set_state(context, "ADD_QTY", {**sdata, "drink_type_id": drink_type_id})
-        return
+    qty = int(req.arg)
+    await req.q.edit_message_text("¿Cuándo se bebió?", reply_markup=date_kb())
+    set_state(req.context, "ADD_DATE", {**req.sdata, "qty": qty})
 
-    # -------- AÑADIR: CANTIDAD --------
-    if data.startswith(CB_QTY):
-        v = data.split(":", 1)[1]
-        if v == "more":
-            await q.edit_message_text("Vale 🙂 Escribe el número (ej: 7):")
-            set_state(context, "ADD_QTY_MANUAL", sdata)
-            return
 
-        qty = int(v)
-        await q.edit_message_text("¿Cuándo se bebió?", reply_markup=date_kb())
-        set_state(context, "ADD_DATE", {**sdata, "qty": qty})
+# -------- AÑADIR: FECHA --------
+@callback_router.route(CB_DATE)
+async def cb_date(req: CallbackRequest):
+    which = req.arg
+    if which == "other":
+        await req.q.edit_message_text("Escribe la fecha en formato YYYY-MM-DD (ej: 2026-01-25):")
+        set_state(req.context, "ADD_DATE_MANUAL", req.sdata)
         return
 
-    # -------- AÑADIR: FECHA --------
-    if data.startswith(CB_DATE):
-        which = data.split(":", 1)[1]
-        if which == "other":
-            await q.edit_message_text("Escribe la fecha en formato YYYY-MM-DD (ej: 2026-01-25):")
-            set_state(context, "ADD_DATE_MANUAL", sdata)
-            return
+    consumed_at = dt.date.today() if which == "today" else (dt.date.today() - dt.timedelta(days=1))
+    person = req.person
+    qty = int(req.sdata["qty"])
+
+    added = await run_db(
+        insert_event,
+        person_id=person["id"],
+        telegram_user_id=req.tg_id,
+        drink_type_id=req.sdata["drink_type_id"],
+        quantity=qty,
+        consumed_at=consumed_at,
+    )
 
-        consumed_at = dt.date.today() if which == "today" else (dt.date.today() - dt.timedelta(days=1))
-        person = get_assigned_person(tg_id)
-        qty = int(sdata["qty"])
+    # Mensaje principal (bonito)
+    when = consumed_at.strftime("%d/%m/%Y")
+    base_msg = random.choice(FUN_PHRASES) + f"\n\n✅ Apuntado ({when})."
+    await req.q.edit_message_text(base_msg, reply_markup=menu_kb(req.is_admin))
+    set_state(req.context, "MENU", {})
 
-        insert_event(
-            person_id=person["id"],
-            telegram_user_id=tg_id,
-            drink_type_id=sdata["drink_type_id"],
-            quantity=qty,
-            consumed_at=consumed_at,
-        )
+    # Logros (si toca): contadores devueltos por el propio insert
+    ach_msgs = build_achievement_messages(person["name"], added["year_start"], qty, added["year_units"], added["is_first"])
 
-        # Mensaje principal (bonito)
-        when = consumed_at.strftime("%d/%m/%Y")
-        base_msg = random.choice(FUN_PHRASES) + f"\n\n✅ Apuntado ({when})."
-        await q.edit_message_text(base_msg, reply_markup=menu_kb(is_admin(tg_id)))
-        set_state(context, "MENU", {})
+    for msg in ach_msgs:
+        try:
+            await req.context.bot.send_message(chat_id=req.tg_id, text=msg)
+        except Exception:
+            SWALLOWED_ERRORS.labels("achievement_message").inc()
+            log.warning("No se pudo enviar un logro a %s", req.tg_id, exc_info=True)
 
-        # Logros (si toca)
-        year_start = (dt.date(consumed_at.year, 1, 7) <= consumed_at) and consumed_at.year or (consumed_at.year - 1)
-        totals = get_person_year_totals(person["id"], int(year_start))
-        after_units = int(totals["unidades"])
-        first = is_first_event_of_year(person["id"], int(year_start))
-        ach_msgs = build_achievement_messages(person["name"], int(year_start), qty, after_units, first)
 
-        for msg in ach_msgs:
-            try:
-                await context.bot.send_message(chat_id=tg_id, text=msg)
-            except Exception:
-                pass
+# -------- DESHACER --------
+@callback_router.route(CB_UNDO_PICK)
+async def cb_undo_pick(req: CallbackRequest):
+    event_id = int(req.arg)
+    await req.q.edit_message_text("¿Seguro que quieres eliminar esta entrada?", reply_markup=undo_confirm_kb(event_id))
+    set_state(req.context, "UNDO_CONFIRM", {"event_id": event_id})
 
-        return
 
-    # -------- DESHACER --------
-    if data.startswith(CB_UNDO_PICK):
-        event_id = int(data.split(":", 1)[1])
-        await q.edit_message_text("¿Seguro que quieres eliminar esta entrada?", reply_markup=undo_confirm_kb(event_id))
-        set_state(context, "UNDO_CONFIRM", {"event_id": event_id})
-        return
+@callback_router.route(CB_UNDO_CONFIRM)
+async def cb_undo_confirm(req: CallbackRequest):
+    event_id = int(req.arg)
+    ok = await run_db(void_event, req.person["id"], req.tg_id, event_id)
+    await req.q.edit_message_text(
+        ("✅ Entrada eliminada." if ok else "⚠️ No se pudo eliminar.") + "\n\n👤 Panel de usuario",
+        reply_markup=user_panel_kb(),
+    )
+    set_state(req.context, "PANEL", {})
 
-    if data.startswith(CB_UNDO_CONFIRM):
-        event_id = int(data.split(":", 1)[1])
-        person = get_assigned_person(tg_id)
-        ok = void_event(person["id"], tg_id, event_id)
-        await q.edit_message_text(
-            ("✅ Entrada eliminada." if ok else "⚠️ No se pudo eliminar.") + "\n\n👤 Panel de usuario",
-            reply_markup=user_panel_kb(),
-        )
-        set_state(context, "PANEL", {})
-        return
 
-    if data == CB_UNDO_CANCEL:
-        person = get_assigned_person(tg_id)
-        await q.edit_message_text(
-            "Vale, no toco nada 🙂\n\n👤 Panel de usuario",
-            reply_markup=user_panel_kb(),
-        )
-        set_state(context, "PANEL", {})
-        return
+@callback_router.route(CB_UNDO_CANCEL)
+async def cb_undo_cancel(req: CallbackRequest):
+    await req.q.edit_message_text(
+        "Vale, no toco nada 🙂\n\n👤 Panel de usuario",
+        reply_markup=user_panel_kb(),
+    )
+    set_state(req.context, "PANEL", {})
+
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state, _ = get_state(context)
+    with timed(UPDATE_SECONDS.labels("text", state), UPDATE_ERRORS.labels("text", state)):
+        await _handle_text(update, context)
+
+
+async def _handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
 
     text = (update.message.text or "").strip()
     state, sdata = get_state(context)
     tg_id = update.effective_user.id
+    rc = request_context(update)
 
     if state == "ADD_QTY_MANUAL":
         try:
@@ -1694,10 +1684,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Formato inválido. Usa YYYY-MM-DD (ej: 2026-01-25).")
             return
 
-        person = get_assigned_person(tg_id)
+        person = await rc.person()
         qty = int(sdata["qty"])
 
-        insert_event(
+        added = await run_db(
+            insert_event,
             person_id=person["id"],
             telegram_user_id=tg_id,
             drink_type_id=sdata["drink_type_id"],
@@ -1706,31 +1697,28 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         when = consumed_at.strftime("%d/%m/%Y")
-        await update.message.reply_text(random.choice(FUN_PHRASES) + f"\n\n✅ Apuntado ({when}).", reply_markup=menu_kb(is_admin(tg_id)))
+        await update.message.reply_text(random.choice(FUN_PHRASES) + f"\n\n✅ Apuntado ({when}).", reply_markup=menu_kb(await rc.is_admin()))
         set_state(context, "MENU", {})
 
         # Logros
-        year_start = (dt.date(consumed_at.year, 1, 7) <= consumed_at) and consumed_at.year or (consumed_at.year - 1)
-        totals = get_person_year_totals(person["id"], int(year_start))
-        after_units = int(totals["unidades"])
-        first = is_first_event_of_year(person["id"], int(year_start))
-        ach_msgs = build_achievement_messages(person["name"], int(year_start), qty, after_units, first)
+        ach_msgs = build_achievement_messages(person["name"], added["year_start"], qty, added["year_units"], added["is_first"])
         for msg in ach_msgs:
             try:
                 await context.bot.send_message(chat_id=tg_id, text=msg)
             except Exception:
-                pass
+                SWALLOWED_ERRORS.labels("achievement_message").inc()
+                log.warning("No se pudo enviar un logro a %s", tg_id, exc_info=True)
 
         return
 
     # ADMIN: crear persona/plaza por texto
     if state == "ADMIN_CREATE_PERSON":
-        if not is_admin(tg_id):
+        if not await rc.is_admin():
             await update.message.reply_text("🚫 No tienes permisos.")
             set_state(context, "MENU", {})
             return
 
-        ok = add_person(text)
+        ok = await run_db(add_person, text)
         if ok:
             await update.message.reply_text(f"✅ '{text}' creada como nueva persona/plaza.", reply_markup=menu_kb(True))
         else:
@@ -1740,11 +1728,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ADMIN: buscar persona
     if state == "ADMIN_PERSON_SEARCH":
-        if not is_admin(tg_id):
+        if not await rc.is_admin():
             await update.message.reply_text("🚫 No tienes permisos.")
             set_state(context, "MENU", {})
             return
-        persons = search_persons_by_name(text, limit=20)
+        persons = await run_db(search_persons_by_name, text, limit=20)
         if not persons:
             await update.message.reply_text("No encontré coincidencias.", reply_markup=admin_persons_menu_kb())
             set_state(context, "ADMIN_PERSONS_MENU", {})
@@ -1755,7 +1743,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ADMIN: confirmación fuerte de borrado
     if state == "ADMIN_DELETE_CONFIRM_TEXT":
-        if not is_admin(tg_id):
+        if not await rc.is_admin():
             await update.message.reply_text("🚫 No tienes permisos.")
             set_state(context, "MENU", {})
             return
@@ -1768,7 +1756,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         person_id = int(sdata["person_id"])
-        ok = admin_delete_person(person_id)
+        ok = await run_db(admin_delete_person, person_id)
         if ok:
             await update.message.reply_text("💀 Eliminado. Esa plaza ya no existe.", reply_markup=admin_main_kb())
         else:
@@ -1776,7 +1764,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_state(context, "ADMIN", {})
         return
 
-        ok = add_person(text)
+        ok = await run_db(add_person, text)
         if ok:
             await update.message.reply_text(f"✅ '{text}' añadido como nueva persona.", reply_markup=menu_kb(True))
         else:
@@ -1794,10 +1782,49 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("Escribe /start para ver el menú.")
 
+
+# --------- Servidor HTTP en modo polling (solo /health) ---------
+async def start_health_server(app: Application):
+    if HTTP_PORT:
+        server = build_server(app, webhook=False)
+        await server.start()
+        app.bot_data["health_server"] = server
+
+
+async def stop_health_server(app: Application):
+    server = app.bot_data.pop("health_server", None)
+    if server is not None:
+        await server.stop()
+
+
+async def on_shutdown(app: Application):
+    await stop_health_server(app)
+    # La Application ya está parada: se espera a los run_db en curso y luego se cierra el pool
+    shutdown_executor(wait=True)
+    close_pool()
+
+
 def main():
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        level=os.environ.get("LOG_LEVEL", "INFO"),
+    )
+    # httpx registra cada petición a la API de Telegram en INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _check_routes()
     init_db()
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Mismo pool que el HTTPXRequest por defecto del builder, con latencia/errores por método
+        .request(TelegramMetricsRequest(connection_pool_size=256))
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(start_health_server)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # JobQueue: comprobar cada día y si es día 1 envía resumen del mes anterior
     app.job_queue.run_daily(
@@ -1820,9 +1847,21 @@ def main():
         name="beer_year_summary_daily_check",
     )
 
+    # JobQueue: worker de la outbox de resúmenes (reintentos y envíos pendientes tras reinicios)
+    app.job_queue.run_repeating(outbox_job, interval=OUTBOX_POLL_S, first=5, name="summary_outbox")
+
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("slow", slow_cmd))
     app.add_handler(CallbackQueryHandler(handle_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    if webhook_enabled():
+        if asyncio.run(run_webhook(app)):
+            return
+        log.warning("No se pudo registrar el webhook; se sigue en modo polling")
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    # Polling borra el webhook que pudiera quedar registrado
     app.run_polling()
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+Motor de envío masivo de mensajes. Lo usa el worker de la outbox de resúmenes
+(outbox.py) con su instancia outbox.outbox_broadcaster.
+
+Los envíos van en paralelo pero respetando los límites de Telegram: un cubo de
+tokens global (~30 mensajes/s por bot) y otro por chat (~1 mensaje/s). Si
+Telegram responde RetryAfter (429) se pausa todo el envío el tiempo indicado;
+los errores de red se reintentan con backoff exponencial. Forbidden (el usuario
+bloqueó el bot) y BadRequest no se reintentan.
+
+    engine = Broadcaster(concurrency=10)
+    result = await engine.deliver(bot, [(chat_id, text), ...], deadline=deadline)
+    result["sent"], result["failed"], result["elapsed_s"], result["results"]
+"""
+import os
+import time
+import random
+import asyncio
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+BROADCAST_GLOBAL_RATE = float(os.environ.get("BROADCAST_GLOBAL_RATE", "25"))      # mensajes/s (todo el bot)
+BROADCAST_PER_CHAT_RATE = float(os.environ.get("BROADCAST_PER_CHAT_RATE", "1"))   # mensajes/s por chat
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "10"))        # peticiones en vuelo
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", "5"))
+BROADCAST_BACKOFF_BASE = float(os.environ.get("BROADCAST_BACKOFF_BASE", "0.5"))   # s, se dobla por intento
+BROADCAST_BACKOFF_MAX = float(os.environ.get("BROADCAST_BACKOFF_MAX", "30"))
+CHAT_BUCKETS_PRUNE_AT = 1024  # cubos por chat a partir de los que se descartan los llenos
+
+
+class TokenBucket:
+    """Cubo de tokens para asyncio (un solo event loop: no necesita lock)."""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now: float) -> bool:
+        """Lleno: equivale a un cubo nuevo (se puede descartar sin cambiar el límite)."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Motor de envío compartido: los límites valen para todos los envíos que pasen
+    por la misma instancia (p.ej. los lotes sucesivos de la outbox).
+    """
+
+    def __init__(
+        self,
+        global_rate: float = BROADCAST_GLOBAL_RATE,
+        per_chat_rate: float = BROADCAST_PER_CHAT_RATE,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+        backoff_base: float = BROADCAST_BACKOFF_BASE,
+        backoff_max: float = BROADCAST_BACKOFF_MAX,
+    ):
+        # Sin ráfaga inicial: Telegram cuenta por ventana de 1 s
+        self.global_bucket = TokenBucket(global_rate, burst=1)
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._chat_buckets = {}
+        self._prune_at = CHAT_BUCKETS_PRUNE_AT
+        self._paused_until = 0.0  # RetryAfter: nadie envía hasta entonces
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._prune_at:
+                self._prune_chat_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _prune_chat_buckets(self):
+        # outbox.outbox_broadcaster vive todo el proceso: sin esto guardaría un cubo
+        # por cada chat al que se ha escrito. Los llenos no limitan nada y los que esperan no están llenos.
+        now = time.monotonic()
+        self._chat_buckets = {c: b for c, b in self._chat_buckets.items() if not b.is_full(now)}
+        # Umbral al doble de lo que sigue vivo: limpiar cuesta O(1) amortizado por cubo nuevo
+        self._prune_at = max(CHAT_BUCKETS_PRUNE_AT, 2 * len(self._chat_buckets))
+
+    async def _wait_turn(self, chat_id: int, deadline: float | None = None) -> bool:
+        """Espera turno de envío. False si antes se pasa deadline (time.monotonic())."""
+        await self._chat_bucket(chat_id).acquire()
+        while True:
+            now = time.monotonic()
+            pause = self._paused_until - now
+            if pause <= 0:
+                break
+            if deadline is not None and self._paused_until >= deadline:
+                return False
+            await asyncio.sleep(pause)
+        await self.global_bucket.acquire()
+        return deadline is None or time.monotonic() < deadline
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * (0.5 + random.random() / 2)
+
+    async def _send_one(self, bot, chat_id: int, text: str, kwargs: dict, deadline: float | None = None) -> dict:
+        # retryable: el fallo es transitorio (red, flood control) y merece otro intento más tarde
+        # expired: no se envió porque se pasaba deadline (sin gastar el intento)
+        result = {"chat_id": chat_id, "ok": False, "attempts": 0, "message_id": None, "error": None,
+                  "retryable": True, "expired": False}
+        while result["attempts"] < self.max_attempts:
+            if not await self._wait_turn(chat_id, deadline):
+                result["expired"] = True
+                result["error"] = result["error"] or "plazo agotado antes de enviar"
+                return result
+            result["attempts"] += 1
+            try:
+                msg = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                result["ok"] = True
+                result["message_id"] = msg.message_id
+                result["error"] = None
+                return result
+            except RetryAfter as e:
+                # Flood control: afecta a todo el bot, no solo a este chat
+                wait = float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+                result["error"] = f"RetryAfter({wait:g}s)"
+            except (Forbidden, BadRequest) as e:
+                # Bloqueado, chat inexistente, texto inválido...: reintentar no sirve
+                result["error"] = f"{type(e).__name__}: {e.message}"
+                result["retryable"] = False
+                return result
+            except NetworkError as e:
+                # Incluye TimedOut
+                result["error"] = f"{type(e).__name__}: {e.message}"
+                await asyncio.sleep(self._backoff(result["attempts"]))
+            except TelegramError as e:
+                result["error"] = f"{type(e).__name__}: {e.message}"
+                result["retryable"] = False
+                return result
+        return result
+
+    async def deliver(self, bot, messages, deadline: float | None = None, **kwargs) -> dict:
+        """
+        Envía cada (chat_id, text) de messages en paralelo bajo los límites.
+        kwargs se pasan a send_message (parse_mode, reply_markup...).
+        deadline (time.monotonic()): a partir de ahí no se empieza ningún envío;
+        los que quedan salen con expired=True.
+        Devuelve {sent, failed, elapsed_s, results: [{chat_id, ok, attempts, message_id, error, retryable, expired}]}
+        en el mismo orden que messages.
+        """
+        t0 = time.monotonic()
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def run(chat_id, text):
+            async with sem:
+                return await self._send_one(bot, chat_id, text, kwargs, deadline)
+
+        results = await asyncio.gather(*(run(chat_id, text) for chat_id, text in messages))
+        sent = sum(1 for r in results if r["ok"])
+        return {
+            "sent": sent,
+            "failed": len(results) - sent,
+            "elapsed_s": time.monotonic() - t0,
+            "results": list(results),
+        }
+
+    async def broadcast(self, bot, chat_ids, text: str, **kwargs) -> dict:
+        """El mismo texto a todos los chat_ids (sin duplicados)."""
+        return await self.deliver(bot, [(chat_id, text) for chat_id in dict.fromkeys(chat_ids)], **kwargs)
+
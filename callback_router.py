@@ -0,0 +1,83 @@
+"""
+Router de callback_data para handle_callback.
+
+Cada ruta es una clave exacta ("rank:users") o un prefijo terminado en ':'
+("panel:older:" para "panel:older:<cursor_id>") con su handler y lo que
+necesita antes de ejecutarse:
+
+    assigned -> plaza asignada; el handler recibe la persona (por defecto;
+                assigned=False para rankings y menú raíz)
+    admin    -> solo administradores
+
+    @callback_router.route(CB_PANEL_OLDER)
+    async def cb_panel_older(req): ...
+
+resolve() busca primero la clave exacta y si no el prefijo más largo cortando
+en cada ':' desde la derecha, así que el coste no depende del número de rutas.
+"""
+from typing import NamedTuple
+
+
+class Route(NamedTuple):
+    key: str
+    handler: object
+    assigned: bool
+    admin: bool
+
+
+class CallbackRouter:
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+
+    def add(self, key: str, handler, assigned: bool = True, admin: bool = False) -> Route:
+        table = self.prefixes if key.endswith(":") else self.exact
+        if key in table:
+            raise RuntimeError(f"Callback '{key}' ya tiene ruta ({table[key].handler.__name__}).")
+        route = table[key] = Route(key, handler, assigned, admin)
+        return route
+
+    def route(self, *keys: str, assigned: bool = True, admin: bool = False):
+        """Decorador: registra el handler para una o varias claves."""
+        def deco(fn):
+            for key in keys:
+                self.add(key, fn, assigned=assigned, admin=admin)
+            return fn
+        return deco
+
+    def resolve(self, data: str):
+        """(Route, resto de data tras el prefijo) o (None, None) si no hay ruta."""
+        route = self.exact.get(data)
+        if route is not None:
+            return route, ""
+        i = len(data)
+        while True:
+            i = data.rfind(":", 0, i)
+            if i < 0:
+                return None, None
+            route = self.prefixes.get(data[:i + 1])
+            if route is not None:
+                return route, data[i + 1:]
+
+    def keys(self) -> set:
+        return set(self.exact) | set(self.prefixes)
+
+    def check(self, constants: dict):
+        """
+        Cada constante CB_* (nombre -> valor) tiene exactamente una ruta y no
+        hay rutas sin constante. Lanza RuntimeError con lo que falte o sobre.
+        """
+        by_value = {}
+        for name, value in constants.items():
+            by_value.setdefault(value, []).append(name)
+
+        problems = []
+        for value, names in sorted(by_value.items()):
+            if len(names) > 1:
+                problems.append(f"{', '.join(sorted(names))} comparten el valor '{value}'")
+        for value in sorted(set(by_value) - self.keys()):
+            problems.append(f"{by_value[value][0]} ('{value}') no tiene ruta")
+        for key in sorted(self.keys() - set(by_value)):
+            problems.append(f"la ruta '{key}' no corresponde a ninguna constante CB_*")
+        if problems:
+            raise RuntimeError("Rutas de callbacks incoherentes:\n  " + "\n  ".join(problems))
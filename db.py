@@ -1,12 +1,44 @@
 import os
+import re
+import time
+import bisect
+import inspect
+import logging
+import threading
+import functools
+import contextvars
 import datetime as dt
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+from types import MappingProxyType
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor, execute_values
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+log = logging.getLogger(__name__)
+
+# Pool de conexiones (configurable por variables de entorno)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))          # s esperando conexión libre
+DB_POOL_IDLE_CHECK = float(os.environ.get("DB_POOL_IDLE_CHECK", "30"))    # s ociosa antes de comprobarla
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600"))  # s antes de reciclarla
+
 PERSONS_SEED = ["Pablo", "Javi", "Jesus", "Fer", "Cuco", "Oli", "Emilio"]
 
+# Persona con rol ADMIN en la siembra inicial
+ADMIN_SEED_NAME = "Pablo"
+
+# Litros/día (por persona o grupo) a partir de los cuales un día cuenta como "fuerte"
+STRONG_DAY_THRESHOLD_L = 3.0
+
+# Caché de identidad (telegram_user_id -> persona asignada), en segundos
+IDENTITY_CACHE_TTL = float(os.environ.get("IDENTITY_CACHE_TTL", "300"))
+
 DRINKS_SEED = [
     ("CORTAITA","Cortaita","BEER",0.25,1.65),
     ("CANA","Caña","BEER",0.25,1.50),
@@ -23,176 +55,837 @@ DRINKS_SEED = [
     ("CHUPITO","Chupito","OTHER",None,2.00),
 ]
 
-def get_conn():
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL no está configurada en Railway (Variables).")
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+# -------------------------
+# Contador de consultas
+# -------------------------
+# Los cursores anotan cada execute en el contador activo (ContextVar). run_db
+# copia el contexto al hilo del executor, así que todo lo que se ejecuta para
+# un mismo update suma en su contador:
+#
+#     with track_queries() as stats:
+#         ...
+#     stats["queries"], stats["db_ms"]
+#
+# Además cada sentencia suma sus filas a la función de db.py que la lanza (ver
+# "Instrumentación por función") y las que pasan de DB_SLOW_QUERY_MS se anotan
+# como consultas lentas.
+
+_query_stats = contextvars.ContextVar("db_query_stats", default=None)
+
+
+class _CountingMixin:
+    def _track(self, method, query, vars, explainable: bool):
+        stats = _query_stats.get()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result = method(query, vars)
+            ok = True
+            return result
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            if stats is not None:
+                stats["queries"] += 1
+                stats["db_ms"] += ms
+            call = _fn_call.get()
+            if call is not None and self.rowcount > 0:
+                call["rows"] += self.rowcount
+            if ms >= DB_SLOW_QUERY_MS:
+                _slow_query(self.connection, call, query, vars, ms, explainable and ok)
+
+    def execute(self, query, vars=None):
+        return self._track(super().execute, query, vars, True)
+
+    def executemany(self, query, vars_list):
+        return self._track(super().executemany, query, vars_list, False)
+
+
+class CountingCursor(_CountingMixin, RealDictCursor):
+    pass
+
+
+class CountingTupleCursor(_CountingMixin, extensions.cursor):
+    pass
+
+
+@contextmanager
+def track_queries(stats: dict | None = None):
+    """Cuenta las consultas (y su tiempo) ejecutadas dentro del bloque."""
+    if stats is None:
+        stats = {"queries": 0, "db_ms": 0.0}
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
 
-def beer_year_start_for(d: dt.date) -> int:
-    # Año cervecero: 7 enero -> 6 enero
-    jan7 = dt.date(d.year, 1, 7)
-    return d.year if d >= jan7 else (d.year - 1)
+# -------------------------
+# Instrumentación por función y consultas lentas
+# -------------------------
+# Todas las funciones públicas de db.py que consultan la BD quedan envueltas
+# (ver _instrument_module al final), más las privadas de _INSTRUMENTED_PRIVATE:
+# llamadas, errores, filas (rowcount de sus sentencias) e histograma de latencia
+# por nombre de función.
+
+DB_SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+# EXPLAIN (ANALYZE, BUFFERS) vuelve a ejecutar la consulta: solo SELECT y solo si se pide
+DB_SLOW_QUERY_EXPLAIN = os.environ.get("DB_SLOW_QUERY_EXPLAIN", "0") == "1"
+DB_SLOW_QUERY_KEEP = int(os.environ.get("DB_SLOW_QUERY_KEEP", "50"))
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_fn_call = contextvars.ContextVar("db_fn_call", default=None)  # {"fn": nombre, "rows": n} de la llamada en curso
+_fn_lock = threading.Lock()
+_fn_stats = {}
+_slow_queries = deque(maxlen=DB_SLOW_QUERY_KEEP)
+_READ_ONLY_SQL = re.compile(r"^\s*(SELECT|WITH)\b", re.I)
+_WRITE_SQL = re.compile(r"\b(INSERT|UPDATE|DELETE|FOR\s+UPDATE)\b", re.I)
+
+
+def _record_call(name: str, ms: float, rows: int, ok: bool):
+    with _fn_lock:
+        st = _fn_stats.get(name)
+        if st is None:
+            st = _fn_stats[name] = {
+                "calls": 0, "errors": 0, "rows": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        st["calls"] += 1
+        st["errors"] += 0 if ok else 1
+        st["rows"] += rows
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        st["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+
+def _instrumented(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        call = {"fn": name, "rows": 0}
+        token = _fn_call.set(call)
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            _fn_call.reset(token)
+            _record_call(name, (time.perf_counter() - t0) * 1000, call["rows"], ok)
 
-def init_db():
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            # PERSONAS
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS persons (
-              id SERIAL PRIMARY KEY,
-              name TEXT NOT NULL UNIQUE,
-              status TEXT NOT NULL CHECK (status IN ('NEW','ACTIVE','INACTIVE')),
-              created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
-            """)
+    return wrapper
 
-            # ASIGNACIÓN persona <-> telegram
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS person_accounts (
-              id SERIAL PRIMARY KEY,
-              person_id INT NOT NULL REFERENCES persons(id),
-              telegram_user_id BIGINT NOT NULL,
-              assigned_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-              unassigned_at TIMESTAMPTZ,
-              is_active BOOLEAN NOT NULL DEFAULT TRUE
-            );
-            """)
-            cur.execute("""
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_person_accounts_person_active
-              ON person_accounts(person_id) WHERE is_active = TRUE;
-            """)
-            cur.execute("""
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_person_accounts_tg_active
-              ON person_accounts(telegram_user_id) WHERE is_active = TRUE;
-            """)
 
-            # TIPOS DE BEBIDA
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS drink_types (
-              id SERIAL PRIMARY KEY,
-              code TEXT NOT NULL UNIQUE,
-              label TEXT NOT NULL,
-              category TEXT NOT NULL CHECK (category IN ('BEER','OTHER')),
-              volume_liters NUMERIC(6,3),
-              unit_price_eur NUMERIC(10,2) NOT NULL CHECK (unit_price_eur >= 0),
-              is_active BOOLEAN NOT NULL DEFAULT TRUE
-            );
-            """)
-
-            # SOLICITUDES PENDIENTES (telegram sin asignar)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS pending_telegrams (
-              telegram_user_id BIGINT PRIMARY KEY,
-              username TEXT,
-              full_name TEXT,
-              first_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-              last_seen_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
-            """)
+def _explain_analyze(conn, query, vars) -> str:
+    # Cursor sin contar; en un savepoint para no romper la transacción si falla
+    prefix = b"EXPLAIN (ANALYZE, BUFFERS) " if isinstance(query, bytes) else "EXPLAIN (ANALYZE, BUFFERS) "
+    with conn.cursor(cursor_factory=extensions.cursor) as cur:
+        savepoint = not conn.autocommit
+        try:
+            if savepoint:
+                cur.execute("SAVEPOINT slow_query_explain;")
+            cur.execute(prefix + query, vars)
+            plan = "\n".join(r[0] for r in cur.fetchall())
+            if savepoint:
+                cur.execute("RELEASE SAVEPOINT slow_query_explain;")
+            return plan
+        except psycopg2.Error as e:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+            return f"(EXPLAIN falló: {e.pgerror or e})"
+
+
+def _slow_query(conn, call, query, vars, ms: float, explainable: bool):
+    sql = query.decode() if isinstance(query, bytes) else query
+    entry = {
+        "at": dt.datetime.now(dt.timezone.utc),
+        "fn": call["fn"] if call else None,
+        "ms": round(ms, 1),
+        "sql": " ".join(sql.split())[:1000],
+        "params": repr(vars)[:500],
+        "plan": None,
+    }
+    if DB_SLOW_QUERY_EXPLAIN and explainable and _READ_ONLY_SQL.match(sql) and not _WRITE_SQL.search(sql):
+        entry["plan"] = _explain_analyze(conn, query, vars)
+    with _fn_lock:
+        _slow_queries.append(entry)
+    log.warning(
+        "Consulta lenta (%.1f ms) en %s: %s | params=%s%s",
+        ms, entry["fn"] or "?", entry["sql"][:300], entry["params"],
+        f"\n{entry['plan']}" if entry["plan"] else "",
+    )
+
+
+def _percentile(buckets: list, calls: int, max_ms: float, q: float) -> float:
+    # Límite superior del cubo donde cae el percentil (el máximo real en el último)
+    target = q * calls
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= target:
+            return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else max_ms
+    return max_ms
+
+
+def db_function_stats() -> dict:
+    """nombre -> {calls, errors, rows, total_ms, avg_ms, p50_ms, p95_ms, max_ms, buckets}."""
+    with _fn_lock:
+        snapshot = {name: {**st, "buckets": list(st["buckets"])} for name, st in _fn_stats.items()}
+    for st in snapshot.values():
+        st["avg_ms"] = st["total_ms"] / st["calls"]
+        st["p50_ms"] = min(st["max_ms"], _percentile(st["buckets"], st["calls"], st["max_ms"], 0.50))
+        st["p95_ms"] = min(st["max_ms"], _percentile(st["buckets"], st["calls"], st["max_ms"], 0.95))
+    return snapshot
+
+
+def slowest_functions(n: int = 10, key: str = "p95_ms") -> list:
+    """Las n funciones con mayor key (p95_ms, avg_ms, max_ms o total_ms), con su nombre en "name"."""
+    rows = [{"name": name, **st} for name, st in db_function_stats().items()]
+    rows.sort(key=lambda r: (r[key], r["total_ms"]), reverse=True)
+    return rows[:n]
+
+
+def slow_queries(n: int = 10) -> list:
+    """Últimas n consultas lentas (la más reciente primero)."""
+    with _fn_lock:
+        return list(_slow_queries)[::-1][:n]
+
+
+def reset_db_stats():
+    with _fn_lock:
+        _fn_stats.clear()
+        _slow_queries.clear()
 
-            # EVENTOS (mínimo)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS drink_events (
-              id SERIAL PRIMARY KEY,
-              person_id INT NOT NULL REFERENCES persons(id),
-              drink_type_id INT NOT NULL REFERENCES drink_types(id),
-              quantity INT NOT NULL CHECK (quantity > 0),
-              consumed_at DATE NOT NULL,
-              created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-            );
-            """)
+# -------------------------
+# Pool de conexiones
+# -------------------------
 
-            # MIGRACIONES SUAVES (por si existía de antes)
-            cur.execute("""
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS telegram_user_id BIGINT;
+class ConnectionPool:
+    """
+    Pool de conexiones psycopg2 thread-safe.
+    - Crea conexiones bajo demanda hasta maxconn; si no hay libres, espera hasta timeout.
+    - Al prestar una conexión ociosa comprueba que sigue viva (SELECT 1) y la recicla si no.
+    - Recicla conexiones rotas o que superan max_lifetime.
+    """
 
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS year_start INT;
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS volume_liters_total NUMERIC(10,3);
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS price_eur_total NUMERIC(10,2);
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, idle_check: float, max_lifetime: float):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Tamaño de pool inválido.")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._idle = []       # [(conn, last_used)]
+        self._born = {}       # id(conn) -> created_at
+        self._size = 0        # conexiones abiertas (ociosas + prestadas)
+        self._closed = False
+        self._stats = {"checked_out": 0, "waiting": 0, "created": 0, "recycled": 0}
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=CountingCursor)
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._stats["recycled"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - self._born.get(id(conn), now) > self.max_lifetime:
+            return False
+        if now - last_used < self.idle_check:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def open(self):
+        """Precalienta el pool hasta minconn conexiones."""
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("El pool de conexiones está cerrado.")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("Pool de conexiones agotado (timeout esperando conexión libre).")
+                self._stats["waiting"] += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._stats["waiting"] -= 1
+            self._stats["checked_out"] += 1
 
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS is_void BOOLEAN NOT NULL DEFAULT FALSE;
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS voided_at TIMESTAMPTZ;
-            ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS voided_by_telegram_user_id BIGINT;
-            """)
+        try:
+            if conn is not None and not self._healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._stats["checked_out"] -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, broken: bool = False):
+        if not broken and not conn.closed:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        broken = broken or bool(conn.closed)
+
+        with self._cond:
+            self._stats["checked_out"] -= 1
+            if broken or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken or self._closed:
+            self._close(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "size": self._size,
+                "idle": len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+            }
 
-            # ÍNDICES
-            cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_events_person_recent
-              ON drink_events(person_id, is_void, created_at DESC);
-            """)
-            cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_events_year
-              ON drink_events(year_start, is_void);
-            """)
 
-            # CONTROL DE ENVÍO DE RESUMEN MENSUAL (para no duplicar)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS monthly_summaries_sent (
-              id SERIAL PRIMARY KEY,
-              year INT NOT NULL,
-              month INT NOT NULL,
-              sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-              UNIQUE(year, month)
-            );
-            """)
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL no está configurada en Railway (Variables).")
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    idle_check=DB_POOL_IDLE_CHECK,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                )
+    return _pool
 
+def pool_stats() -> dict:
+    """Estadísticas del pool para monitorización (vacío si aún no se ha creado)."""
+    return _pool.stats() if _pool is not None else {}
 
-            # CONTROL DE ENVÍO DE RESUMEN SEMANAL (para no duplicar)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS weekly_summaries_sent (
-  id SERIAL PRIMARY KEY,
-  year INT NOT NULL,
-  week INT NOT NULL,
-  sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  UNIQUE(year, week)
-);
-""")
-
-            # CONTROL DE ENVÍO DE CIERRE DE AÑO CERVECERO (para no duplicar)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS beer_year_summaries_sent (
-  id SERIAL PRIMARY KEY,
-  year_start INT NOT NULL UNIQUE,
-  sent_at TIMESTAMPTZ NOT NULL DEFAULT now()
-);
-""")
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
 
+@contextmanager
+def get_conn():
+    """
+    Presta una conexión del pool. Al salir hace commit (o rollback si hubo excepción)
+    y la devuelve al pool; las conexiones rotas se descartan y se reemplazan.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+        if not conn.closed:
             conn.commit()
+    except BaseException as e:
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) or bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+def beer_year_start_for(d: dt.date) -> int:
+    # Año cervecero: 7 enero -> 6 enero
+    jan7 = dt.date(d.year, 1, 7)
+    return d.year if d >= jan7 else (d.year - 1)
+
+def beer_year_range(year_start: int):
+    # Fechas (inclusive) del año cervecero que empieza el 7 de enero de year_start
+    return dt.date(year_start, 1, 7), dt.date(year_start + 1, 1, 6)
+
+# -------------------------
+# Migraciones de esquema
+# -------------------------
+# Cada migración se aplica una sola vez y queda anotada en schema_version.
+# Son idempotentes (IF NOT EXISTS) porque las BDs anteriores a schema_version
+# ya tienen parte del esquema y las aplican todas en su primer arranque.
+
+# Clave de pg_advisory_xact_lock: serializa arranques concurrentes
+MIGRATIONS_LOCK_KEY = 727_011_016
+
+def _m001_base_schema(cur):
+    # PERSONAS
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS persons (
+      id SERIAL PRIMARY KEY,
+      name TEXT NOT NULL UNIQUE,
+      status TEXT NOT NULL CHECK (status IN ('NEW','ACTIVE','INACTIVE')),
+      created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+    # ASIGNACIÓN persona <-> telegram
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS person_accounts (
+      id SERIAL PRIMARY KEY,
+      person_id INT NOT NULL REFERENCES persons(id),
+      telegram_user_id BIGINT NOT NULL,
+      assigned_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      unassigned_at TIMESTAMPTZ,
+      is_active BOOLEAN NOT NULL DEFAULT TRUE
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_person_accounts_person_active
+      ON person_accounts(person_id) WHERE is_active = TRUE;
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_person_accounts_tg_active
+      ON person_accounts(telegram_user_id) WHERE is_active = TRUE;
+    """)
+
+    # TIPOS DE BEBIDA
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS drink_types (
+      id SERIAL PRIMARY KEY,
+      code TEXT NOT NULL UNIQUE,
+      label TEXT NOT NULL,
+      category TEXT NOT NULL CHECK (category IN ('BEER','OTHER')),
+      volume_liters NUMERIC(6,3),
+      unit_price_eur NUMERIC(10,2) NOT NULL CHECK (unit_price_eur >= 0),
+      is_active BOOLEAN NOT NULL DEFAULT TRUE
+    );
+    """)
+
+    # SOLICITUDES PENDIENTES (telegram sin asignar)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS pending_telegrams (
+      telegram_user_id BIGINT PRIMARY KEY,
+      username TEXT,
+      full_name TEXT,
+      first_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      last_seen_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+    # EVENTOS
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS drink_events (
+      id SERIAL PRIMARY KEY,
+      person_id INT NOT NULL REFERENCES persons(id),
+      drink_type_id INT NOT NULL REFERENCES drink_types(id),
+      quantity INT NOT NULL CHECK (quantity > 0),
+      consumed_at DATE NOT NULL,
+      created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- columnas añadidas después (por si existía de antes)
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS telegram_user_id BIGINT;
+
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS year_start INT;
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS volume_liters_total NUMERIC(10,3);
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS price_eur_total NUMERIC(10,2);
+
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS is_void BOOLEAN NOT NULL DEFAULT FALSE;
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS voided_at TIMESTAMPTZ;
+    ALTER TABLE drink_events ADD COLUMN IF NOT EXISTS voided_by_telegram_user_id BIGINT;
+
+    CREATE INDEX IF NOT EXISTS idx_events_person_recent
+      ON drink_events(person_id, is_void, created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_events_year
+      ON drink_events(year_start, is_void);
+    """)
+
+    # CONTROL DE ENVÍO DE RESÚMENES (para no duplicar)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS monthly_summaries_sent (
+      id SERIAL PRIMARY KEY,
+      year INT NOT NULL,
+      month INT NOT NULL,
+      sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      UNIQUE(year, month)
+    );
+    CREATE TABLE IF NOT EXISTS weekly_summaries_sent (
+      id SERIAL PRIMARY KEY,
+      year INT NOT NULL,
+      week INT NOT NULL,
+      sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      UNIQUE(year, week)
+    );
+    CREATE TABLE IF NOT EXISTS beer_year_summaries_sent (
+      id SERIAL PRIMARY KEY,
+      year_start INT NOT NULL UNIQUE,
+      sent_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+def _m002_person_role(cur):
+    cur.execute("""
+    ALTER TABLE persons ADD COLUMN IF NOT EXISTS role TEXT NOT NULL DEFAULT 'USER'
+      CHECK (role IN ('USER','ADMIN'));
+    """)
+
+def _m003_person_day_drink(cur):
+    # ROLLUP persona x bebida x día (derivado de drink_events no anulados)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS person_day_drink (
+      person_id INT NOT NULL REFERENCES persons(id),
+      drink_type_id INT NOT NULL REFERENCES drink_types(id),
+      day DATE NOT NULL,
+      units INT NOT NULL,
+      liters NUMERIC(12,3) NOT NULL DEFAULT 0,
+      euros NUMERIC(12,2) NOT NULL DEFAULT 0,
+      PRIMARY KEY (person_id, drink_type_id, day)
+    );
+    CREATE INDEX IF NOT EXISTS idx_pdd_day
+      ON person_day_drink(day);
+    """)
+    # Se rellena desde los eventos existentes (si no lo estaba ya)
+    cur.execute("""
+    SELECT NOT EXISTS (SELECT 1 FROM person_day_drink)
+       AND EXISTS (SELECT 1 FROM drink_events WHERE is_void=FALSE) AS needs_backfill;
+    """)
+    if cur.fetchone()["needs_backfill"]:
+        _rebuild_person_day_drink(cur)
+
+def _m004_history_pagination_index(cur):
+    # Paginación del historial: index-only scan por (person_id, id) sobre no anulados
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_events_person_id_live
+      ON drink_events(person_id, id) INCLUDE (drink_type_id, quantity, created_at)
+      WHERE is_void=FALSE;
+    """)
+
+def _m005_report_indexes(cur):
+    # Casi todas las lecturas son de eventos no anulados: índices parciales
+    cur.execute("""
+    DROP INDEX IF EXISTS idx_events_person_recent;
+    DROP INDEX IF EXISTS idx_events_year;
+
+    -- últimos consumos de una persona (list_last_events)
+    CREATE INDEX IF NOT EXISTS idx_events_person_created_live
+      ON drink_events(person_id, created_at DESC) WHERE is_void=FALSE;
+    -- rangos por fecha de consumo y MIN/MAX (años con datos)
+    CREATE INDEX IF NOT EXISTS idx_events_consumed_live
+      ON drink_events(consumed_at) WHERE is_void=FALSE;
+    -- perfil de persona: nº de eventos y última actividad
+    CREATE INDEX IF NOT EXISTS idx_events_person_consumed_live
+      ON drink_events(person_id, consumed_at) WHERE is_void=FALSE;
+    -- contadores de logros del año cervecero (insert_event) y años cerveceros con datos
+    CREATE INDEX IF NOT EXISTS idx_events_year_person_live
+      ON drink_events(year_start, person_id) INCLUDE (quantity) WHERE is_void=FALSE;
+    -- tabla de solo inserción: BRIN para barridos por rango de fechas (incluye anulados)
+    CREATE INDEX IF NOT EXISTS idx_events_created_brin
+      ON drink_events USING BRIN (created_at);
+    CREATE INDEX IF NOT EXISTS idx_events_consumed_brin
+      ON drink_events USING BRIN (consumed_at);
+
+    -- informes por rango de días: index-only scan sin tocar la tabla
+    DROP INDEX IF EXISTS idx_pdd_day;
+    CREATE INDEX IF NOT EXISTS idx_pdd_day_cover
+      ON person_day_drink(day) INCLUDE (person_id, drink_type_id, units, liters, euros);
+    """)
+
+def _m006_summary_outbox(cur):
+    # Un mensaje por (resumen, destinatario); lo vacía el worker de la outbox
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS summary_outbox (
+      id BIGSERIAL PRIMARY KEY,
+      summary_key TEXT NOT NULL,
+      chat_id BIGINT NOT NULL,
+      text TEXT NOT NULL,
+      status TEXT NOT NULL DEFAULT 'PENDING' CHECK (status IN ('PENDING','SENT','FAILED')),
+      attempts INT NOT NULL DEFAULT 0,
+      next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      last_error TEXT,
+      message_id BIGINT,
+      created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      sent_at TIMESTAMPTZ,
+      UNIQUE (summary_key, chat_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_due
+      ON summary_outbox(next_attempt_at, id) WHERE status='PENDING';
+    """)
+
+def _m007_data_versions(cur):
+    # Versiones de datos compartidas entre procesos (ver data_version)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS data_versions (
+      scope INT PRIMARY KEY,
+      version BIGINT NOT NULL
+    );
+    """)
+
+MIGRATIONS = [
+    (1, "base_schema", _m001_base_schema),
+    (2, "person_role", _m002_person_role),
+    (3, "person_day_drink", _m003_person_day_drink),
+    (4, "history_pagination_index", _m004_history_pagination_index),
+    (5, "report_indexes", _m005_report_indexes),
+    (6, "summary_outbox", _m006_summary_outbox),
+    (7, "data_versions", _m007_data_versions),
+]
+
+def _schema_version(cur) -> int:
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present;")
+    if not cur.fetchone()["present"]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_version;")
+    return cur.fetchone()["v"]
 
-        # Seed personas
+def migrate() -> list:
+    """
+    Aplica las migraciones pendientes en una sola transacción.
+    Devuelve las versiones aplicadas (lista vacía si el esquema ya estaba al día).
+    """
+    latest = MIGRATIONS[-1][0]
+    with get_conn() as conn:
         with conn.cursor() as cur:
-            for name in PERSONS_SEED:
-                cur.execute(
-                    "INSERT INTO persons(name, status) VALUES (%s, 'NEW') ON CONFLICT (name) DO NOTHING;",
-                    (name,)
-                )
+            # Camino rápido: sin locks si no hay nada pendiente
+            if _schema_version(cur) >= latest:
+                return []
+
+            # Otro proceso puede estar migrando: se espera y se vuelve a mirar
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_KEY,))
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INT PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+            current = _schema_version(cur)
+
+            applied = []
+            for version, name, fn in MIGRATIONS:
+                if version <= current:
+                    continue
+                fn(cur)
+                cur.execute("INSERT INTO schema_version(version, name) VALUES (%s, %s);", (version, name))
+                applied.append(version)
             conn.commit()
+            return applied
+
+def _seed(cur):
+    # Personas y bebidas de serie en una sola sentencia (ON CONFLICT: no pisa lo existente)
+    cur.execute("""
+    WITH new_persons AS (
+      INSERT INTO persons(name, status, role)
+      SELECT name, 'NEW', CASE WHEN name = %(admin)s THEN 'ADMIN' ELSE 'USER' END
+      FROM unnest(%(names)s::TEXT[]) AS name
+      ON CONFLICT (name) DO NOTHING
+    ),
+    admin AS (
+      UPDATE persons SET role='ADMIN' WHERE name=%(admin)s AND role <> 'ADMIN'
+    )
+    INSERT INTO drink_types(code, label, category, volume_liters, unit_price_eur, is_active)
+    SELECT code, label, category, volume_liters, unit_price_eur, TRUE
+    FROM unnest(%(codes)s::TEXT[], %(labels)s::TEXT[], %(categories)s::TEXT[],
+                %(volumes)s::NUMERIC[], %(prices)s::NUMERIC[])
+      AS s(code, label, category, volume_liters, unit_price_eur)
+    ON CONFLICT (code) DO NOTHING;
+    """, {
+        "names": PERSONS_SEED,
+        "admin": ADMIN_SEED_NAME,
+        "codes": [d[0] for d in DRINKS_SEED],
+        "labels": [d[1] for d in DRINKS_SEED],
+        "categories": [d[2] for d in DRINKS_SEED],
+        "volumes": [d[3] for d in DRINKS_SEED],
+        "prices": [d[4] for d in DRINKS_SEED],
+    })
+
+def init_db() -> dict:
+    """
+    Arranque de la BD: abre el pool, aplica migraciones pendientes, siembra y carga
+    el catálogo de bebidas. Devuelve tiempos en ms y versiones aplicadas.
+    """
+    t0 = time.perf_counter()
+    get_pool().open()
+    t_pool = time.perf_counter()
+
+    applied = migrate()
+    t_migrate = time.perf_counter()
 
-        # Seed bebidas
+    with get_conn() as conn:
         with conn.cursor() as cur:
-            for code, label, cat, vol, price in DRINKS_SEED:
-                cur.execute("""
-                    INSERT INTO drink_types(code,label,category,volume_liters,unit_price_eur,is_active)
-                    VALUES (%s,%s,%s,%s,%s,TRUE)
-                    ON CONFLICT (code) DO NOTHING;
-                """, (code, label, cat, vol, price))
+            _seed(cur)
             conn.commit()
+    load_drink_catalog()
+    t_end = time.perf_counter()
+
+    report = {
+        "applied": applied,
+        "schema_version": MIGRATIONS[-1][0],
+        "pool_ms": (t_pool - t0) * 1000,
+        "migrate_ms": (t_migrate - t_pool) * 1000,
+        "seed_ms": (t_end - t_migrate) * 1000,
+        "total_ms": (t_end - t0) * 1000,
+    }
+    log.info(
+        "init_db: esquema v%s (%s) en %.1f ms [pool %.1f · migraciones %.1f · semillas %.1f]",
+        report["schema_version"],
+        f"aplicadas {applied}" if applied else "sin migraciones pendientes",
+        report["total_ms"], report["pool_ms"], report["migrate_ms"], report["seed_ms"],
+    )
+    return report
 
 # -------------------------
 # Usuarios / asignaciones
 # -------------------------
 
-def get_assigned_person(telegram_user_id: int):
+_identity_lock = threading.Lock()
+_identity_cache = {}   # telegram_user_id -> (expires_at, persona | None)
+_identity_gen = 0      # se incrementa en cada invalidación (evita guardar lecturas obsoletas)
+_identity_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def _load_assigned_person(telegram_user_id: int):
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-            SELECT p.id, p.name, p.status
+            SELECT p.id, p.name, p.status, p.role
             FROM person_accounts pa
             JOIN persons p ON p.id = pa.person_id
             WHERE pa.telegram_user_id = %s AND pa.is_active = TRUE
             LIMIT 1;
             """, (telegram_user_id,))
-            return cur.fetchone()
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+def get_assigned_person(telegram_user_id: int):
+    """Persona asignada a un Telegram (id, name, status, role), cacheada IDENTITY_CACHE_TTL segundos."""
+    now = time.monotonic()
+    with _identity_lock:
+        entry = _identity_cache.get(telegram_user_id)
+        if entry and entry[0] > now:
+            _identity_stats["hits"] += 1
+            return dict(entry[1]) if entry[1] else None
+        _identity_stats["misses"] += 1
+        gen = _identity_gen
+
+    person = _load_assigned_person(telegram_user_id)
+
+    with _identity_lock:
+        if gen == _identity_gen:
+            _identity_cache[telegram_user_id] = (now + IDENTITY_CACHE_TTL, person)
+    return dict(person) if person else None
+
+def invalidate_identity(telegram_user_id: int | None = None, person_id: int | None = None):
+    """Olvida la identidad cacheada de un Telegram y/o de todos los Telegram de una persona."""
+    global _identity_gen
+    with _identity_lock:
+        _identity_gen += 1
+        _identity_stats["invalidations"] += 1
+        if telegram_user_id is not None:
+            _identity_cache.pop(telegram_user_id, None)
+        if person_id is not None:
+            for tg, (_, p) in list(_identity_cache.items()):
+                if p and int(p["id"]) == int(person_id):
+                    del _identity_cache[tg]
+
+def identity_cache_stats() -> dict:
+    with _identity_lock:
+        total = _identity_stats["hits"] + _identity_stats["misses"]
+        return {
+            **_identity_stats,
+            "size": len(_identity_cache),
+            "hit_rate": (_identity_stats["hits"] / total) if total else 0.0,
+        }
+
+# -------------------------
+# Versiones de datos (para cachés de informes)
+# -------------------------
+# Contador global (cambios de personas, rebuild) + uno por año natural de consumed_at,
+# en la tabla data_versions (scope 0 = global, si no el año): los ve cualquier proceso,
+# así que p.ej. manage.py rebuild-rollup invalida las cachés del bot en marcha.
+# Solo suben, y dentro de la misma transacción que la escritura: quien lea la versión
+# ANTES de consultar nunca guarda datos viejos bajo una versión nueva.
+
+_GLOBAL_DATA_SCOPE = 0
+
+def _bump_data_version(cur, year: int | None = None):
+    """Sube (en la transacción de cur) la versión del año natural indicado, o la global si year es None."""
+    cur.execute("""
+    INSERT INTO data_versions(scope, version) VALUES (%s, 1)
+    ON CONFLICT (scope) DO UPDATE SET version = data_versions.version + 1;
+    """, (_GLOBAL_DATA_SCOPE if year is None else year,))
+
+def data_version(*years: int) -> tuple:
+    """Versión de los datos que afectan a los años dados: (global, v_año1, v_año2, ...). Una consulta por PK."""
+    scopes = [_GLOBAL_DATA_SCOPE, *years]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT scope, version FROM data_versions WHERE scope = ANY(%s);", (scopes,))
+            found = {r["scope"]: r["version"] for r in cur.fetchall()}
+    return tuple(found.get(s, 0) for s in scopes)
 
 def list_available_persons():
     with get_conn() as conn:
@@ -224,10 +917,13 @@ def assign_person(telegram_user_id: int, person_id: int):
                     INSERT INTO person_accounts(person_id, telegram_user_id, is_active)
                     VALUES (%s,%s,TRUE);
                 """, (person_id, telegram_user_id))
+                _bump_data_version(cur)
                 conn.commit()
+                invalidate_identity(telegram_user_id=telegram_user_id, person_id=person_id)
                 return ("OK", {"id": row["id"], "name": row["name"]})
         except psycopg2.Error:
             conn.rollback()
+            invalidate_identity(telegram_user_id=telegram_user_id)
             existing2 = get_assigned_person(telegram_user_id)
             if existing2:
                 return ("ALREADY", existing2)
@@ -287,50 +983,117 @@ def list_active_telegram_user_ids():
 # Bebidas / eventos
 # -------------------------
 
-def list_drink_types(category: str):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-            SELECT id, label
-            FROM drink_types
-            WHERE is_active=TRUE AND category=%s
-            ORDER BY label;
-            """, (category,))
-            return cur.fetchall()
+# Catálogo de bebidas: tabla pequeña y casi estática, se carga una vez en memoria.
+# Si se modifica drink_types, llamar a load_drink_catalog() o invalidate_drink_catalog().
+_catalog = None
+_catalog_lock = threading.Lock()
 
-def get_drink_type(drink_type_id: int):
+def load_drink_catalog():
+    """(Re)carga drink_types en un índice inmutable por id, code y categoría."""
+    global _catalog
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-            SELECT id, label, volume_liters, unit_price_eur
+            SELECT id, code, label, category, volume_liters, unit_price_eur, is_active
             FROM drink_types
-            WHERE id=%s;
-            """, (drink_type_id,))
-            return cur.fetchone()
+            ORDER BY category, label;
+            """)
+            rows = [MappingProxyType(dict(r)) for r in cur.fetchall()]
 
-def insert_event(person_id: int, telegram_user_id: int, drink_type_id: int, quantity: int, consumed_at: dt.date):
-    t = get_drink_type(drink_type_id)
-    if not t:
-        raise RuntimeError("Tipo de bebida no encontrado.")
+    by_category = {}
+    for r in rows:
+        if r["is_active"]:
+            by_category.setdefault(r["category"], []).append(r)
+
+    catalog = MappingProxyType({
+        "by_id": MappingProxyType({r["id"]: r for r in rows}),
+        "by_code": MappingProxyType({r["code"]: r for r in rows}),
+        # Activas, ya ordenadas por label (listas para types_kb)
+        "by_category": MappingProxyType({c: tuple(v) for c, v in by_category.items()}),
+    })
+    with _catalog_lock:
+        _catalog = catalog
+    return catalog
+
+def invalidate_drink_catalog():
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+def drink_catalog():
+    catalog = _catalog
+    return catalog if catalog is not None else load_drink_catalog()
+
+def list_drink_types(category: str):
+    return list(drink_catalog()["by_category"].get(category, ()))
 
-    vol = t["volume_liters"]
-    unit_price = float(t["unit_price_eur"])
+def get_drink_type(drink_type_id: int):
+    return drink_catalog()["by_id"].get(int(drink_type_id))
 
-    volume_total = None if vol is None else float(vol) * quantity
-    price_total = unit_price * quantity
+def insert_event(person_id: int, telegram_user_id: int, drink_type_id: int, quantity: int, consumed_at: dt.date):
+    """
+    Inserta un consumo (litros y precio calculados desde drink_types), actualiza el rollup
+    person_day_drink y, en la misma query, devuelve los contadores de logros del año
+    cervecero tras el insert:
+    {id, year_start, year_units, is_first}
+    """
     year_start = beer_year_start_for(consumed_at)
 
     with get_conn() as conn:
         with conn.cursor() as cur:
+            # Las subconsultas ven el snapshot previo al INSERT: prev no incluye el nuevo evento
             cur.execute("""
-            INSERT INTO drink_events(
-              person_id, telegram_user_id, drink_type_id, quantity, consumed_at,
-              year_start, volume_liters_total, price_eur_total, is_void
+            WITH ins AS (
+              INSERT INTO drink_events(
+                person_id, telegram_user_id, drink_type_id, quantity, consumed_at,
+                year_start, volume_liters_total, price_eur_total, is_void
+              )
+              SELECT %(person_id)s, %(telegram_user_id)s, t.id, %(quantity)s, %(consumed_at)s,
+                     %(year_start)s, t.volume_liters * %(quantity)s, t.unit_price_eur * %(quantity)s, FALSE
+              FROM drink_types t
+              WHERE t.id = %(drink_type_id)s
+              RETURNING id, drink_type_id, quantity, volume_liters_total, price_eur_total
+            ),
+            roll AS (
+              INSERT INTO person_day_drink(person_id, drink_type_id, day, units, liters, euros)
+              SELECT %(person_id)s, ins.drink_type_id, %(consumed_at)s, ins.quantity,
+                     COALESCE(ins.volume_liters_total, 0), COALESCE(ins.price_eur_total, 0)
+              FROM ins
+              ON CONFLICT (person_id, drink_type_id, day) DO UPDATE SET
+                units = person_day_drink.units + EXCLUDED.units,
+                liters = person_day_drink.liters + EXCLUDED.liters,
+                euros = person_day_drink.euros + EXCLUDED.euros
+            ),
+            prev AS (
+              SELECT COALESCE(SUM(quantity),0) AS unidades, COUNT(*) AS eventos
+              FROM drink_events
+              WHERE person_id=%(person_id)s AND year_start=%(year_start)s AND is_void=FALSE
             )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,FALSE);
-            """, (person_id, telegram_user_id, drink_type_id, quantity, consumed_at, year_start, volume_total, price_total))
+            SELECT ins.id,
+                   prev.unidades + ins.quantity AS year_units,
+                   prev.eventos = 0 AS is_first
+            FROM ins CROSS JOIN prev;
+            """, {
+                "person_id": person_id,
+                "telegram_user_id": telegram_user_id,
+                "drink_type_id": drink_type_id,
+                "quantity": quantity,
+                "consumed_at": consumed_at,
+                "year_start": year_start,
+            })
+            row = cur.fetchone()
+            if not row:
+                raise RuntimeError("Tipo de bebida no encontrado.")
+            _bump_data_version(cur, consumed_at.year)
             conn.commit()
 
+    return {
+        "id": row["id"],
+        "year_start": year_start,
+        "year_units": int(row["year_units"]),
+        "is_first": bool(row["is_first"]),
+    }
+
 def list_last_events(person_id: int, limit: int = 5):
     with get_conn() as conn:
         with conn.cursor() as cur:
@@ -348,49 +1111,62 @@ def list_last_events(person_id: int, limit: int = 5):
 
 def list_user_events_page(person_id: int, limit: int = 15, before_id: int | None = None, after_id: int | None = None):
     """
-    Devuelve eventos (bebidas) del usuario con cantidad y hora (created_at), para paginación.
-    - Página inicial: before_id=None y after_id=None -> más recientes DESC.
-    - Más antiguas: before_id=<id_mas_antiguo_en_pagina> -> siguientes más antiguas DESC.
-    - Más recientes: after_id=<id_mas_reciente_en_pagina> -> siguientes más recientes (ASC en DB, luego se invierte).
-    Retorna lista de dicts: {id, quantity, label, created_at}
+    Devuelve una página de eventos (bebidas) del usuario con cantidad y hora (created_at)
+    y si hay más en cada sentido, todo en una query: (rows, has_older, has_newer).
+    - Página inicial: before_id=None y after_id=None -> más recientes.
+    - Más antiguas: before_id=<id_mas_antiguo_en_pagina> -> siguientes más antiguas.
+    - Más recientes: after_id=<id_mas_reciente_en_pagina> -> siguientes más recientes.
+    rows siempre en orden DESC (más reciente primero): [{id, quantity, label, created_at}]
+    Se lee limit+1 en el sentido del recorrido (¿hay más?) y se sondea el sentido
+    contrario con un EXISTS acotado por el cursor.
     """
+    if before_id is not None and after_id is not None:
+        raise ValueError("Usa solo before_id o after_id, no ambos.")
+
+    if after_id is not None:
+        scan = "e.id > %(cursor)s ORDER BY e.id ASC"
+        probe = "x.id <= %(cursor)s"
+    elif before_id is not None:
+        scan = "e.id < %(cursor)s ORDER BY e.id DESC"
+        probe = "x.id >= %(cursor)s"
+    else:
+        scan = "TRUE ORDER BY e.id DESC"
+        probe = "FALSE"
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            if before_id is not None and after_id is not None:
-                raise ValueError("Usa solo before_id o after_id, no ambos.")
+            # probe LEFT JOIN page: siempre al menos una fila, aunque la página esté vacía
+            cur.execute(f"""
+            WITH page AS (
+              SELECT e.id, e.drink_type_id, e.quantity, e.created_at
+              FROM drink_events e
+              WHERE e.person_id=%(person_id)s AND e.is_void=FALSE AND {scan}
+              LIMIT %(limit)s + 1
+            ),
+            probe AS (
+              SELECT EXISTS (
+                SELECT 1 FROM drink_events x
+                WHERE x.person_id=%(person_id)s AND x.is_void=FALSE AND {probe}
+              ) AS more_behind
+            )
+            SELECT page.id, page.quantity, dt.label, page.created_at, probe.more_behind
+            FROM probe
+            LEFT JOIN page ON TRUE
+            LEFT JOIN drink_types dt ON dt.id = page.drink_type_id
+            ORDER BY page.id DESC;
+            """, {"person_id": person_id, "limit": limit, "cursor": after_id if after_id is not None else before_id})
+            rows = cur.fetchall()
 
-            if before_id is not None:
-                cur.execute("""
-                SELECT e.id, e.quantity, dt.label, e.created_at
-                FROM drink_events e
-                JOIN drink_types dt ON dt.id = e.drink_type_id
-                WHERE e.person_id=%s AND e.is_void=FALSE AND e.id < %s
-                ORDER BY e.id DESC
-                LIMIT %s;
-                """, (person_id, before_id, limit))
-                return cur.fetchall()
-
-            if after_id is not None:
-                # Más recientes que after_id (asc) -> el bot las invertirá para mostrar DESC
-                cur.execute("""
-                SELECT e.id, e.quantity, dt.label, e.created_at
-                FROM drink_events e
-                JOIN drink_types dt ON dt.id = e.drink_type_id
-                WHERE e.person_id=%s AND e.is_void=FALSE AND e.id > %s
-                ORDER BY e.id ASC
-                LIMIT %s;
-                """, (person_id, after_id, limit))
-                return cur.fetchall()
-
-            cur.execute("""
-            SELECT e.id, e.quantity, dt.label, e.created_at
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            WHERE e.person_id=%s AND e.is_void=FALSE
-            ORDER BY e.id DESC
-            LIMIT %s;
-            """, (person_id, limit))
-            return cur.fetchall()
+    more_behind = bool(rows[0]["more_behind"])
+    page = [{"id": r["id"], "quantity": r["quantity"], "label": r["label"], "created_at": r["created_at"]}
+            for r in rows if r["id"] is not None]
+    more_ahead = len(page) > limit
+    if after_id is not None:
+        # Recorrido ASC: la fila extra es la más reciente
+        page = page[1:] if more_ahead else page
+        return page, more_behind, more_ahead
+    page = page[:limit]
+    return page, more_ahead, more_behind
 
 
 def void_event(person_id: int, telegram_user_id: int, event_id: int):
@@ -400,12 +1176,91 @@ def void_event(person_id: int, telegram_user_id: int, event_id: int):
             UPDATE drink_events
             SET is_void=TRUE, voided_at=now(), voided_by_telegram_user_id=%s
             WHERE id=%s AND person_id=%s AND is_void=FALSE
-            RETURNING id;
+            RETURNING id, drink_type_id, consumed_at, quantity, volume_liters_total, price_eur_total;
             """, (telegram_user_id, event_id, person_id))
             row = cur.fetchone()
+            if row is not None:
+                # Descuenta del rollup en la misma transacción
+                key = (person_id, row["drink_type_id"], row["consumed_at"])
+                cur.execute("""
+                UPDATE person_day_drink
+                SET units = units - %s,
+                    liters = liters - COALESCE(%s, 0),
+                    euros = euros - COALESCE(%s, 0)
+                WHERE person_id=%s AND drink_type_id=%s AND day=%s;
+                """, (row["quantity"], row["volume_liters_total"], row["price_eur_total"], *key))
+                cur.execute("""
+                DELETE FROM person_day_drink
+                WHERE person_id=%s AND drink_type_id=%s AND day=%s AND units <= 0;
+                """, key)
+                _bump_data_version(cur, row["consumed_at"].year)
             conn.commit()
             return row is not None
 
+# -------------------------
+# Rollup persona x bebida x día
+# -------------------------
+
+def _rebuild_person_day_drink(cur) -> int:
+    # SHARE bloquea inserts/anulaciones concurrentes hasta el commit
+    cur.execute("LOCK TABLE drink_events IN SHARE MODE;")
+    cur.execute("DELETE FROM person_day_drink;")
+    cur.execute("""
+    INSERT INTO person_day_drink(person_id, drink_type_id, day, units, liters, euros)
+    SELECT person_id, drink_type_id, consumed_at,
+           SUM(quantity),
+           COALESCE(SUM(volume_liters_total), 0),
+           COALESCE(SUM(price_eur_total), 0)
+    FROM drink_events
+    WHERE is_void=FALSE
+    GROUP BY person_id, drink_type_id, consumed_at;
+    """)
+    return cur.rowcount
+
+def rebuild_person_day_drink() -> int:
+    """Reconstruye person_day_drink desde drink_events. Devuelve filas generadas."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            n = _rebuild_person_day_drink(cur)
+            _bump_data_version(cur)
+            conn.commit()
+            return n
+
+def check_person_day_drink(limit: int = 50):
+    """
+    Compara person_day_drink con la agregación de drink_events.
+    Devuelve las filas (persona, bebida, día) que no cuadran; lista vacía = consistente.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            WITH raw AS (
+              SELECT person_id, drink_type_id, consumed_at AS day,
+                     SUM(quantity) AS units,
+                     COALESCE(SUM(volume_liters_total), 0) AS liters,
+                     COALESCE(SUM(price_eur_total), 0) AS euros
+              FROM drink_events
+              WHERE is_void=FALSE
+              GROUP BY person_id, drink_type_id, consumed_at
+            )
+            SELECT
+              COALESCE(raw.person_id, r.person_id) AS person_id,
+              COALESCE(raw.drink_type_id, r.drink_type_id) AS drink_type_id,
+              COALESCE(raw.day, r.day) AS day,
+              raw.units AS raw_units, r.units AS rollup_units,
+              raw.liters AS raw_liters, r.liters AS rollup_liters,
+              raw.euros AS raw_euros, r.euros AS rollup_euros
+            FROM raw
+            FULL OUTER JOIN person_day_drink r
+              ON r.person_id = raw.person_id AND r.drink_type_id = raw.drink_type_id AND r.day = raw.day
+            WHERE raw.units IS DISTINCT FROM r.units
+               OR raw.liters IS DISTINCT FROM r.liters
+               OR raw.euros IS DISTINCT FROM r.euros
+            ORDER BY 3, 1, 2
+            LIMIT %s;
+            """, (limit,))
+            return cur.fetchall()
+
 # -------------------------
 # Informes / rankings
 # -------------------------
@@ -414,28 +1269,37 @@ def list_years_with_data():
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-            SELECT DISTINCT year_start
-            FROM drink_events
-            WHERE is_void=FALSE AND year_start IS NOT NULL
-            ORDER BY year_start DESC;
+            WITH bounds AS (
+              SELECT MIN(year_start) AS lo, MAX(year_start) AS hi
+              FROM drink_events
+              WHERE is_void=FALSE
+            )
+            SELECT y AS year_start
+            FROM bounds, generate_series(lo, hi) AS y
+            WHERE EXISTS (
+              SELECT 1 FROM drink_events e
+              WHERE e.is_void=FALSE AND e.year_start = y
+            )
+            ORDER BY y DESC;
             """)
             return [r["year_start"] for r in cur.fetchall()]
 
 def report_year(year_start: int):
+    start, end = beer_year_range(year_start)
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
             SELECT p.name,
-                   COALESCE(SUM(e.quantity),0) AS unidades,
-                   COALESCE(SUM(e.volume_liters_total),0) AS litros,
-                   COALESCE(SUM(e.price_eur_total),0) AS euros
+                   COALESCE(SUM(r.units),0) AS unidades,
+                   COALESCE(SUM(r.liters),0) AS litros,
+                   COALESCE(SUM(r.euros),0) AS euros
             FROM persons p
-            LEFT JOIN drink_events e
-              ON e.person_id=p.id AND e.year_start=%s AND e.is_void=FALSE
+            LEFT JOIN person_day_drink r
+              ON r.person_id=p.id AND r.day BETWEEN %s AND %s
             WHERE p.status='ACTIVE'
             GROUP BY p.name
             ORDER BY euros DESC, litros DESC, unidades DESC;
-            """, (year_start,))
+            """, (start, end))
             return cur.fetchall()
 
 def get_person_year_totals(person_id: int, year_start: int):
@@ -466,27 +1330,30 @@ def is_first_event_of_year(person_id: int, year_start: int) -> bool:
 # Resumen mensual
 # -------------------------
 
-def month_summary(year: int, month: int):
-    # Totales del mes por persona (por fecha real consumed_at)
+def _month_range(year: int, month: int):
     start = dt.date(year, month, 1)
     if month == 12:
         end = dt.date(year + 1, 1, 1)
     else:
         end = dt.date(year, month + 1, 1)
+    return start, end
+
+def month_summary(year: int, month: int):
+    # Totales del mes por persona (por fecha real consumed_at)
+    start, end = _month_range(year, month)
 
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
             SELECT p.name,
-                   COALESCE(SUM(e.quantity),0) AS unidades,
-                   COALESCE(SUM(e.volume_liters_total),0) AS litros,
-                   COALESCE(SUM(e.price_eur_total),0) AS euros
+                   COALESCE(SUM(r.units),0) AS unidades,
+                   COALESCE(SUM(r.liters),0) AS litros,
+                   COALESCE(SUM(r.euros),0) AS euros
             FROM persons p
-            LEFT JOIN drink_events e
-              ON e.person_id=p.id
-             AND e.is_void=FALSE
-             AND e.consumed_at >= %s
-             AND e.consumed_at < %s
+            LEFT JOIN person_day_drink r
+              ON r.person_id=p.id
+             AND r.day >= %s
+             AND r.day < %s
             WHERE p.status='ACTIVE'
             GROUP BY p.name
             ORDER BY euros DESC, litros DESC, unidades DESC;
@@ -508,13 +1375,9 @@ def mark_monthly_summary_sent(year: int, month: int) -> bool:
     # devuelve True si lo marcó ahora, False si ya existía
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-            INSERT INTO monthly_summaries_sent(year, month)
-            VALUES (%s,%s)
-            ON CONFLICT (year, month) DO NOTHING;
-            """, (year, month))
+            marked = _mark_summary_sent(cur, "monthly", (year, month))
             conn.commit()
-            return cur.rowcount > 0
+            return marked
 
 
 
@@ -530,13 +1393,9 @@ def weekly_summary_already_sent(year: int, week: int) -> bool:
 def mark_weekly_summary_sent(year: int, week: int) -> bool:
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-            INSERT INTO weekly_summaries_sent(year, week)
-            VALUES (%s,%s)
-            ON CONFLICT (year, week) DO NOTHING;
-            """, (year, week))
+            marked = _mark_summary_sent(cur, "weekly", (year, week))
             conn.commit()
-            return cur.rowcount > 0
+            return marked
 
 def beer_year_summary_already_sent(year_start: int) -> bool:
     with get_conn() as conn:
@@ -550,26 +1409,117 @@ def beer_year_summary_already_sent(year_start: int) -> bool:
 def mark_beer_year_summary_sent(year_start: int) -> bool:
     with get_conn() as conn:
         with conn.cursor() as cur:
+            marked = _mark_summary_sent(cur, "beer_year", (year_start,))
+            conn.commit()
+            return marked
+
+_SUMMARY_MARK_SQL = {
+    "monthly": "INSERT INTO monthly_summaries_sent(year, month) VALUES (%s,%s) ON CONFLICT (year, month) DO NOTHING;",
+    "weekly": "INSERT INTO weekly_summaries_sent(year, week) VALUES (%s,%s) ON CONFLICT (year, week) DO NOTHING;",
+    "beer_year": "INSERT INTO beer_year_summaries_sent(year_start) VALUES (%s) ON CONFLICT (year_start) DO NOTHING;",
+}
+
+def _mark_summary_sent(cur, kind: str, period: tuple) -> bool:
+    cur.execute(_SUMMARY_MARK_SQL[kind], period)
+    return cur.rowcount > 0
+
+# -------------------------
+# Outbox de resúmenes (un envío por destinatario, duradero)
+# -------------------------
+
+def enqueue_summary(kind: str, period: tuple, text: str) -> int | None:
+    """
+    Marca el resumen (kind: monthly/weekly/beer_year) como enviado y encola un mensaje
+    por cada Telegram activo, todo en la misma transacción.
+    Devuelve cuántos destinatarios se encolaron, o None si ya estaba marcado.
+    """
+    summary_key = f"{kind}:" + "-".join(str(p) for p in period)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if not _mark_summary_sent(cur, kind, period):
+                conn.rollback()
+                return None
             cur.execute("""
-            INSERT INTO beer_year_summaries_sent(year_start)
-            VALUES (%s)
-            ON CONFLICT (year_start) DO NOTHING;
-            """, (year_start,))
+            INSERT INTO summary_outbox(summary_key, chat_id, text)
+            SELECT DISTINCT %s, pa.telegram_user_id, %s
+            FROM person_accounts pa
+            JOIN persons p ON p.id = pa.person_id
+            WHERE pa.is_active=TRUE AND p.status='ACTIVE'
+            ON CONFLICT (summary_key, chat_id) DO NOTHING;
+            """, (summary_key, text))
+            n = cur.rowcount
             conn.commit()
-            return cur.rowcount > 0
+            return n
+
+def claim_outbox_batch(limit: int, lease_seconds: float):
+    """
+    Reserva hasta limit envíos pendientes y vencidos: suma un intento y aplaza
+    next_attempt_at lease_seconds (si el proceso muere, vuelven a estar pendientes).
+    SKIP LOCKED: varios workers no se pisan.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            UPDATE summary_outbox o
+            SET attempts = o.attempts + 1,
+                next_attempt_at = now() + make_interval(secs => %s)
+            WHERE o.id IN (
+              SELECT id FROM summary_outbox
+              WHERE status='PENDING' AND next_attempt_at <= now()
+              ORDER BY next_attempt_at, id
+              LIMIT %s
+              FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.summary_key, o.chat_id, o.text, o.attempts;
+            """, (lease_seconds, limit))
+            rows = cur.fetchall()
+            conn.commit()
+            return sorted(rows, key=lambda r: r["id"])
+
+def complete_outbox_batch(results) -> int:
+    """
+    Cierra envíos reservados. results: [(id, attempts, status, message_id, error, retry_in_s)]
+    con attempts tal cual lo devolvió claim_outbox_batch y status SENT / FAILED /
+    PENDING (reintento dentro de retry_in_s segundos).
+    Solo se cierran las filas cuya reserva sigue siendo de quien llama (mismo
+    attempts y aún PENDING): si el lease venció y otro worker las reservó, se
+    dejan como estén. Devuelve cuántas se cerraron.
+    """
+    if not results:
+        return 0
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+            UPDATE summary_outbox o
+            SET status = v.status,
+                message_id = COALESCE(v.message_id, o.message_id),
+                last_error = v.error,
+                sent_at = CASE WHEN v.status='SENT' THEN now() ELSE o.sent_at END,
+                next_attempt_at = now() + make_interval(secs => v.retry_in_s)
+            FROM (VALUES %s) AS v(id, attempts, status, message_id, error, retry_in_s)
+            WHERE o.id = v.id AND o.attempts = v.attempts AND o.status = 'PENDING';
+            """, results, template="(%s::BIGINT, %s::INT, %s, %s::BIGINT, %s, %s::FLOAT8)", page_size=len(results))
+            n = cur.rowcount
+            conn.commit()
+            return n
+
+def outbox_stats() -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT
+              COUNT(*) FILTER (WHERE status='PENDING') AS pending,
+              COUNT(*) FILTER (WHERE status='PENDING' AND next_attempt_at <= now()) AS due,
+              COUNT(*) FILTER (WHERE status='SENT') AS sent,
+              COUNT(*) FILTER (WHERE status='FAILED') AS failed
+            FROM summary_outbox;
+            """)
+            return dict(cur.fetchone())
 
 # -------------------------
 # Estadísticas vergonzosas (mensuales)
 # -------------------------
 
-def _month_range(year: int, month: int):
-    start = dt.date(year, month, 1)
-    if month == 12:
-        end = dt.date(year + 1, 1, 1)
-    else:
-        end = dt.date(year, month + 1, 1)
-    return start, end
-
 def monthly_shame_report(year: int, month: int, close_liters: float = 0.5):
     """
     Devuelve un dict con estadísticas "vergonzosas" del mes (públicas),
@@ -582,177 +1532,127 @@ def monthly_shame_report(year: int, month: int, close_liters: float = 0.5):
     start, end = _month_range(year, month)
 
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            # Personas activas del mes (han registrado algo)
+        # Cursor de tuplas: solo viajan los días con consumo (disperso), sin dicts por fila
+        with conn.cursor(cursor_factory=CountingTupleCursor) as cur:
             cur.execute("""
-            SELECT DISTINCT p.id AS person_id, p.name AS name
-            FROM drink_events e
-            JOIN persons p ON p.id = e.person_id
-            WHERE e.is_void=FALSE
-              AND e.consumed_at >= %s
-              AND e.consumed_at < %s
+            SELECT r.person_id, p.name, r.day, SUM(r.liters)::numeric AS liters
+            FROM person_day_drink r
+            JOIN persons p ON p.id = r.person_id
+            WHERE r.day >= %s
+              AND r.day < %s
               AND p.status='ACTIVE'
-            ORDER BY p.name;
+            GROUP BY r.person_id, p.name, r.day
+            ORDER BY p.name, r.person_id, r.day;
             """, (start, end))
-            persons = cur.fetchall()
+            rows = cur.fetchall()
 
-            # Mínimo 2 personas activas para no humillar a alguien solo
-            if len(persons) < 2:
-                return None
+    # Personas activas del mes (han registrado algo), por nombre; días con litros de cada una
+    names = []
+    sparse = []
+    last_pid = None
+    for pid, name, day, liters in rows:
+        if pid != last_pid:
+            last_pid = pid
+            names.append(name)
+            sparse.append({})
+        sparse[-1][day] = liters
+
+    # Mínimo 2 personas activas para no humillar a alguien solo
+    if len(names) < 2:
+        return None
+
+    # Grid denso reconstruido en cliente; acumulado en Decimal (igual que el SUM OVER de antes)
+    days = [start + dt.timedelta(days=d) for d in range((end - start).days)]
+    zero = Decimal(0)
+    liters = []
+    cum = []
+    for person_days in sparse:
+        l_row = []
+        c_row = []
+        acc = zero
+        for day in days:
+            v = person_days.get(day, zero)
+            acc += v
+            l_row.append(float(v))
+            c_row.append(float(acc))
+        liters.append(l_row)
+        cum.append(c_row)
 
-            person_ids = [r["person_id"] for r in persons]
+    stats = _shame_stats(days, names, liters, cum, close_liters)
+    return {"year": year, "month": month, **stats}
 
-            # Grid día x persona con litros diarios y acumulados
-            cur.execute("""
-            WITH calendar AS (
-              SELECT generate_series(%s::date, (%s::date - interval '1 day'), interval '1 day')::date AS day
-            ),
-            daily AS (
-              SELECT
-                e.person_id,
-                e.consumed_at AS day,
-                SUM(COALESCE(e.volume_liters_total, 0))::numeric AS liters
-              FROM drink_events e
-              WHERE e.is_void=FALSE
-                AND e.consumed_at >= %s
-                AND e.consumed_at < %s
-                AND e.person_id = ANY(%s)
-              GROUP BY e.person_id, e.consumed_at
-            ),
-            grid AS (
-              SELECT
-                c.day,
-                p.id AS person_id,
-                p.name AS name,
-                COALESCE(d.liters, 0)::numeric AS liters
-              FROM calendar c
-              CROSS JOIN (SELECT id, name FROM persons WHERE id = ANY(%s)) p
-              LEFT JOIN daily d
-                ON d.person_id = p.id AND d.day = c.day
-            )
-            SELECT
-              day,
-              person_id,
-              name,
-              liters,
-              SUM(liters) OVER (PARTITION BY person_id ORDER BY day) AS cum_liters
-            FROM grid
-            ORDER BY day ASC, name ASC;
-            """, (start, end, start, end, person_ids, person_ids))
-            rows = cur.fetchall()
-
-    # Post-proceso en Python (pocos datos: personas x días)
-    days = []
-    by_day = {}  # day -> list of dicts (name, liters, cum_liters)
-    for r in rows:
-        day = r["day"]
-        if day not in by_day:
-            by_day[day] = []
-            days.append(day)
-        by_day[day].append({
-            "person_id": r["person_id"],
-            "name": r["name"],
-            "liters": float(r["liters"] or 0),
-            "cum_liters": float(r["cum_liters"] or 0),
-        })
+def _shame_stats(days, names, liters, cum, close_liters: float):
+    """
+    Motor de monthly_shame_report sobre arrays por persona (índice = día):
+    names[i] ordenados por nombre, liters[i][d] y cum[i][d] de la persona i el día days[d].
+    Un solo ranking por día, O(días x personas x log personas).
+    """
+    people = range(len(names))
+
+    first_lead_day = {}   # i -> primer día como líder (cum > 0)
+    best_rank = {}        # i -> mejor rank con cum > 0, en orden de primera aparición
+    almost_counts = {}    # i -> días a <= close_liters del líder sin serlo
+    day_totals = []
+    order = []
+
+    for d, day in enumerate(days):
+        day_totals.append(sum(liters[i][d] for i in people))
+
+        # Ranking por litros acumulados (desc). Desempate por nombre (también desc).
+        order = sorted(people, key=lambda i: (cum[i][d], names[i]), reverse=True)
+        leader_c = cum[order[0]][d]
+        if leader_c > 0:
+            first_lead_day.setdefault(order[0], day)
+
+        for rank, i in enumerate(order, 1):
+            c = cum[i][d]
+            if c <= 0:
+                continue
+            if i not in best_rank or rank < best_rank[i]:
+                best_rank[i] = rank
+            if rank > 1 and leader_c > 0 and leader_c - c <= close_liters:
+                almost_counts[i] = almost_counts.get(i, 0) + 1
 
-    def rank_day(entries):
-        # ranking por litros acumulados (desc). Desempate por nombre.
-        sorted_entries = sorted(entries, key=lambda x: (x["cum_liters"], x["name"]), reverse=True)
-        for i, e in enumerate(sorted_entries, 1):
-            e["_rank"] = i
-        leader = sorted_entries[0] if sorted_entries else None
-        return sorted_entries, leader
-
-    leaders = set()
-    first_lead_day = {}
-    ranks_by_person = {}   # name -> list of ranks over days (solo días con cum>0)
-    final_cum = {}         # name -> cum en el último día
-    daily_liters_by_day = {}
-
-    for day in days:
-        entries = by_day[day]
-        daily_liters_by_day[day] = sum(e["liters"] for e in entries)
-
-        ranked, leader = rank_day(entries)
-        if leader and leader["cum_liters"] > 0:
-            leaders.add(leader["name"])
-            first_lead_day.setdefault(leader["name"], day)
-
-        for e in ranked:
-            if e["cum_liters"] > 0:
-                ranks_by_person.setdefault(e["name"], []).append(e["_rank"])
-
-    last_day = days[-1]
-    final_entries, final_leader = rank_day(by_day[last_day])
-    final_ranking = [(e["name"], e["cum_liters"]) for e in final_entries]
-    for e in final_entries:
-        final_cum[e["name"]] = e["cum_liters"]
+    # Ranking final = ranking del último día
+    final_rank = {i: rank for rank, i in enumerate(order, 1)}
+    final_ranking = [(names[i], cum[i][-1]) for i in order]
+    final_leader = order[0] if order else None
 
     # 1) Falso líder: fue líder algún día pero NO termina líder
     false_leader = None
-    if final_leader:
-        for name in sorted(leaders, key=lambda n: first_lead_day.get(n)):
-            if name != final_leader["name"]:
-                final_rank = next((i for i, (n, _) in enumerate(final_ranking, 1) if n == name), None)
-                false_leader = {"name": name, "first_day": first_lead_day.get(name), "final_rank": final_rank}
+    if final_leader is not None:
+        for i in sorted(first_lead_day, key=first_lead_day.get):
+            if i != final_leader:
+                false_leader = {"name": names[i], "first_day": first_lead_day[i], "final_rank": final_rank[i]}
                 break
 
     # 2) Mayor caída: mejor rank (mínimo) vs rank final
     biggest_drop = None
     max_drop = 0
-    for name, ranks in ranks_by_person.items():
-        if not ranks:
-            continue
-        best_rank = min(ranks)
-        final_rank = next((i for i, (n, _) in enumerate(final_ranking, 1) if n == name), None)
-        if final_rank is None:
-            continue
-        drop = final_rank - best_rank
+    for i, best in best_rank.items():
+        drop = final_rank[i] - best
         if drop > max_drop:
             max_drop = drop
-            biggest_drop = {"name": name, "best_rank": best_rank, "final_rank": final_rank, "drop": drop}
-
-    # 3) Casi campeón: días a <= close_liters del líder sin ser líder
-    almost_counts = {}
-    for day in days:
-        ranked, leader = rank_day(by_day[day])
-        if not leader or leader["cum_liters"] <= 0:
-            continue
-        leader_name = leader["name"]
-        leader_c = leader["cum_liters"]
-        for e in ranked[1:]:
-            if e["cum_liters"] <= 0 or e["name"] == leader_name:
-                continue
-            if leader_c - e["cum_liters"] <= close_liters:
-                almost_counts[e["name"]] = almost_counts.get(e["name"], 0) + 1
+            biggest_drop = {"name": names[i], "best_rank": best, "final_rank": final_rank[i], "drop": drop}
 
+    # 3) Casi campeón
     almost_champion = None
     if almost_counts:
-        name = max(almost_counts.keys(), key=lambda n: (almost_counts[n], float(final_cum.get(n, 0)), n))
-        almost_champion = {"name": name, "times": almost_counts[name]}
+        i = max(almost_counts, key=lambda i: (almost_counts[i], cum[i][-1], names[i]))
+        almost_champion = {"name": names[i], "times": almost_counts[i]}
 
     # 4) Fantasma: más días en blanco (solo entre los que han bebido alguna vez ese mes)
-    days_in_month = len(days)
-    blank_counts = {}
-    for name in final_cum.keys():
-        blank = 0
-        for day in days:
-            entry = next((e for e in by_day[day] if e["name"] == name), None)
-            if entry and entry["liters"] == 0:
-                blank += 1
-        blank_counts[name] = blank
-
     ghost = None
-    if blank_counts:
-        gname = max(blank_counts.keys(), key=lambda n: (blank_counts[n], n))
-        ghost = {"name": gname, "blank_days": blank_counts[gname], "days": days_in_month}
+    if names:
+        blank = [sum(1 for v in liters[i] if v == 0) for i in people]
+        i = max(people, key=lambda i: (blank[i], names[i]))
+        ghost = {"name": names[i], "blank_days": blank[i], "days": len(days)}
 
     # 5) Semana más triste (lunes-domingo) dentro del rango del mes
     week_totals = {}
-    for day, total in daily_liters_by_day.items():
+    for day, total in zip(days, day_totals):
         week_start = day - dt.timedelta(days=day.weekday())  # lunes
-        week_totals[week_start] = week_totals.get(week_start, 0.0) + float(total)
+        week_totals[week_start] = week_totals.get(week_start, 0.0) + total
 
     saddest_week = None
     if week_totals:
@@ -760,9 +1660,7 @@ def monthly_shame_report(year: int, month: int, close_liters: float = 0.5):
         saddest_week = {"week_start": w, "liters": float(week_totals[w])}
 
     return {
-        "year": year,
-        "month": month,
-        "final_leader": final_leader["name"] if final_leader else None,
+        "final_leader": names[final_leader] if final_leader is not None else None,
         "final_ranking": final_ranking,  # list[(name, liters)]
         "false_leader": false_leader,
         "biggest_drop": biggest_drop,
@@ -776,25 +1674,25 @@ def person_year_breakdown(person_id: int, year_start: int):
     Desglose por tipo de bebida para 1 persona en un año cervecero.
     Devuelve filas: category, label, unidades, litros, euros, has_liters
     """
+    start, end = beer_year_range(year_start)
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
             SELECT
               dt.category AS category,
               dt.label AS label,
-              COALESCE(SUM(e.quantity), 0) AS unidades,
-              COALESCE(SUM(COALESCE(e.volume_liters_total, 0)), 0) AS litros,
-              COALESCE(SUM(e.price_eur_total), 0) AS euros,
+              COALESCE(SUM(r.units), 0) AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
+              COALESCE(SUM(r.euros), 0) AS euros,
               (dt.volume_liters IS NOT NULL) AS has_liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            WHERE e.person_id = %s
-              AND e.year_start = %s
-              AND e.is_void = FALSE
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            WHERE r.person_id = %s
+              AND r.day BETWEEN %s AND %s
             GROUP BY dt.category, dt.label, dt.volume_liters
-            HAVING COALESCE(SUM(e.quantity), 0) > 0
+            HAVING COALESCE(SUM(r.units), 0) > 0
             ORDER BY dt.category ASC, litros DESC, euros DESC, unidades DESC, dt.label ASC;
-            """, (person_id, year_start))
+            """, (person_id, start, end))
             return cur.fetchall()
 
 
@@ -803,24 +1701,24 @@ def year_drinks_totals(year_start: int):
     Totales del año por bebida (global, todos).
     Devuelve: category, label, unidades, litros, euros, has_liters
     """
+    start, end = beer_year_range(year_start)
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
             SELECT
               dt.category AS category,
               dt.label AS label,
-              COALESCE(SUM(e.quantity), 0) AS unidades,
-              COALESCE(SUM(COALESCE(e.volume_liters_total, 0)), 0) AS litros,
-              COALESCE(SUM(e.price_eur_total), 0) AS euros,
+              COALESCE(SUM(r.units), 0) AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
+              COALESCE(SUM(r.euros), 0) AS euros,
               (dt.volume_liters IS NOT NULL) AS has_liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            WHERE e.year_start = %s
-              AND e.is_void = FALSE
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            WHERE r.day BETWEEN %s AND %s
             GROUP BY dt.category, dt.label, dt.volume_liters
-            HAVING COALESCE(SUM(e.quantity), 0) > 0
+            HAVING COALESCE(SUM(r.units), 0) > 0
             ORDER BY litros DESC, unidades DESC, dt.label ASC;
-            """, (year_start,))
+            """, (start, end))
             return cur.fetchall()
 
 
@@ -829,6 +1727,7 @@ def year_drink_type_person_totals(year_start: int):
     Totales por (bebida x persona) en el año.
     Devuelve: category, label, person_name, unidades, litros, has_liters
     """
+    start, end = beer_year_range(year_start)
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -836,19 +1735,18 @@ def year_drink_type_person_totals(year_start: int):
               dt.category AS category,
               dt.label AS label,
               p.name AS person_name,
-              COALESCE(SUM(e.quantity), 0) AS unidades,
-              COALESCE(SUM(COALESCE(e.volume_liters_total, 0)), 0) AS litros,
+              COALESCE(SUM(r.units), 0) AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
               (dt.volume_liters IS NOT NULL) AS has_liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            JOIN persons p ON p.id = e.person_id
-            WHERE e.year_start = %s
-              AND e.is_void = FALSE
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            JOIN persons p ON p.id = r.person_id
+            WHERE r.day BETWEEN %s AND %s
               AND p.status='ACTIVE'
             GROUP BY dt.category, dt.label, p.name, dt.volume_liters
-            HAVING COALESCE(SUM(e.quantity), 0) > 0
+            HAVING COALESCE(SUM(r.units), 0) > 0
             ORDER BY dt.category ASC, dt.label ASC, litros DESC, unidades DESC, p.name ASC;
-            """, (year_start,))
+            """, (start, end))
             return cur.fetchall()
 
 
@@ -858,7 +1756,7 @@ def year_drink_type_person_totals(year_start: int):
 
 def is_admin(telegram_user_id: int) -> bool:
     p = get_assigned_person(telegram_user_id)
-    return bool(p and p["name"] == "Pablo")
+    return bool(p and p.get("role") == "ADMIN")
 
 def add_person(name: str) -> bool:
     name = name.strip()
@@ -888,7 +1786,9 @@ def deactivate_person(person_id: int):
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("UPDATE persons SET status='INACTIVE' WHERE id=%s;", (person_id,))
+            _bump_data_version(cur)
             conn.commit()
+            invalidate_identity(person_id=person_id)
 
 
 # -------------------------
@@ -1028,33 +1928,45 @@ def admin_assign_telegram_to_person(person_id: int, telegram_user_id: int):
             # Borra solicitud pendiente (si existía)
             cur.execute("DELETE FROM pending_telegrams WHERE telegram_user_id=%s;", (telegram_user_id,))
 
+            _bump_data_version(cur)
             conn.commit()
+            invalidate_identity(telegram_user_id=telegram_user_id, person_id=person_id)
             return ("OK", None)
 
 def admin_suspend_person(person_id: int) -> bool:
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("UPDATE persons SET status='INACTIVE' WHERE id=%s;", (person_id,))
+            changed = cur.rowcount > 0
+            _bump_data_version(cur)
             conn.commit()
-            return cur.rowcount > 0
+            invalidate_identity(person_id=person_id)
+            return changed
 
 def admin_reactivate_person(person_id: int) -> bool:
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("UPDATE persons SET status='ACTIVE' WHERE id=%s;", (person_id,))
+            changed = cur.rowcount > 0
+            _bump_data_version(cur)
             conn.commit()
-            return cur.rowcount > 0
+            invalidate_identity(person_id=person_id)
+            return changed
 
 def admin_delete_person(person_id: int) -> bool:
     """Elimina persona/plaza y TODO lo asociado."""
     with get_conn() as conn:
         with conn.cursor() as cur:
             # Borra dependencias primero
+            cur.execute("DELETE FROM person_day_drink WHERE person_id=%s;", (person_id,))
             cur.execute("DELETE FROM drink_events WHERE person_id=%s;", (person_id,))
             cur.execute("DELETE FROM person_accounts WHERE person_id=%s;", (person_id,))
             cur.execute("DELETE FROM persons WHERE id=%s;", (person_id,))
+            changed = cur.rowcount > 0
+            _bump_data_version(cur)
             conn.commit()
-            return cur.rowcount > 0
+            invalidate_identity(person_id=person_id)
+            return changed
 
 
 # ---------------- CALENDAR PERIOD RANKING (used by Ranking UI) ----------------
@@ -1064,100 +1976,99 @@ def list_calendar_years_with_data():
     """Calendar years based on consumed_at."""
     with get_conn() as conn:
         with conn.cursor() as cur:
+            # MIN/MAX + una sonda EXISTS por año: solo lecturas puntuales del índice
             cur.execute("""
-            SELECT DISTINCT EXTRACT(YEAR FROM consumed_at)::INT AS y
-            FROM drink_events
-            WHERE is_void=FALSE
+            WITH bounds AS (
+              SELECT MIN(consumed_at) AS lo, MAX(consumed_at) AS hi
+              FROM drink_events
+              WHERE is_void=FALSE
+            )
+            SELECT y
+            FROM bounds,
+                 generate_series(EXTRACT(YEAR FROM lo)::INT, EXTRACT(YEAR FROM hi)::INT) AS y
+            WHERE EXISTS (
+              SELECT 1 FROM drink_events e
+              WHERE e.is_void=FALSE
+                AND e.consumed_at >= make_date(y, 1, 1)
+                AND e.consumed_at < make_date(y + 1, 1, 1)
+            )
             ORDER BY y DESC;
             """)
             return [r["y"] for r in cur.fetchall()]
 
-def user_stats_range(start_date: dt.date, end_date: dt.date):
+_MONTHS_ARRAY_SQL = "ARRAY[" + ", ".join(
+    f"COALESCE(SUM(liters_day) FILTER (WHERE EXTRACT(MONTH FROM d) = {m}), 0)" for m in range(1, 13)
+) + "] AS months"
+
+def _user_stats_rows(periods: dict, with_months: bool = False):
     """
-    Stats per ACTIVE person for a calendar date range.
-    - liters_total: sum(volume_liters_total) (only BEER contributes)
-    - active_days: count of distinct consumed_at days with any event
-    - strong_days: count of days where liters_day >= 3.0 (per person)
-    - peak_day / peak_liters: day with max liters_day (per person)
-    Returns list sorted by liters_total desc.
+    Una sola pasada sobre el rollup para varios periodos a la vez.
+    periods: {clave: (start_date, end_date)} (inclusive).
+    Calcula litros por persona y día (daily) una vez sobre la unión de rangos y de ahí,
+    por periodo: totales, días activos, días fuertes, pico y (opcional) litros por mes.
+    Solo personas ACTIVE con actividad. Devuelve {clave: [filas]}.
     """
+    params = {"strong": STRONG_DAY_THRESHOLD_L}
+    values = []
+    for i, (key, (start, end)) in enumerate(periods.items()):
+        params[f"k{i}"], params[f"s{i}"], params[f"e{i}"] = key, start, end
+        values.append(f"(%(k{i})s, %(s{i})s::date, %(e{i})s::date)")
+    params["min"] = min(start for start, _ in periods.values())
+    params["max"] = max(end for _, end in periods.values())
+
+    months_sql = (",\n                     " + _MONTHS_ARRAY_SQL) if with_months else ""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-            WITH active_days AS (
-              SELECT e.person_id, e.consumed_at::date AS d
-              FROM drink_events e
-              WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-              GROUP BY e.person_id, d
-            ),
-            liters_by_day AS (
-              SELECT e.person_id, e.consumed_at::date AS d,
-                     COALESCE(SUM(e.volume_liters_total), 0) AS liters_day
-              FROM drink_events e
-              WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-              GROUP BY e.person_id, d
-            ),
-            strong_days AS (
-              SELECT person_id, COUNT(*)::INT AS strong_days
-              FROM liters_by_day
-              WHERE liters_day >= 3.0
-              GROUP BY person_id
-            ),
-            peak AS (
-              SELECT DISTINCT ON (person_id)
-                     person_id,
-                     d AS peak_day,
-                     liters_day AS peak_liters
-              FROM liters_by_day
-              ORDER BY person_id, liters_day DESC, d DESC
+            cur.execute(f"""
+            WITH periods(k, s, e) AS (
+              VALUES {", ".join(values)}
             ),
-            totals AS (
-              SELECT p.id AS person_id,
-                     p.name AS person,
-                     COALESCE(SUM(e.volume_liters_total), 0) AS liters_total
-              FROM persons p
-              JOIN drink_events e ON e.person_id=p.id
-              WHERE p.status='ACTIVE' AND e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-              GROUP BY p.id, p.name
+            daily AS (
+              SELECT r.person_id, r.day AS d,
+                     SUM(r.liters) AS liters_day
+              FROM person_day_drink r
+              WHERE r.day BETWEEN %(min)s AND %(max)s
+              GROUP BY r.person_id, r.day
             ),
-            act AS (
-              SELECT person_id, COUNT(*)::INT AS active_days
-              FROM active_days
-              GROUP BY person_id
+            per_person AS (
+              SELECT pr.k AS period,
+                     dl.person_id,
+                     SUM(liters_day) AS liters_total,
+                     COUNT(*)::INT AS active_days,
+                     COUNT(*) FILTER (WHERE liters_day >= %(strong)s)::INT AS strong_days,
+                     (ARRAY_AGG(d ORDER BY liters_day DESC, d DESC))[1] AS peak_day,
+                     MAX(liters_day) AS peak_liters{months_sql}
+              FROM daily dl
+              JOIN periods pr ON dl.d BETWEEN pr.s AND pr.e
+              GROUP BY pr.k, dl.person_id
             )
-            SELECT
-              t.person_id,
-              t.person,
-              t.liters_total,
-              COALESCE(a.active_days, 0) AS active_days,
-              COALESCE(s.strong_days, 0) AS strong_days,
-              pk.peak_day AS peak_day,
-              COALESCE(pk.peak_liters, 0) AS peak_liters
-            FROM totals t
-            LEFT JOIN act a ON a.person_id=t.person_id
-            LEFT JOIN strong_days s ON s.person_id=t.person_id
-            LEFT JOIN peak pk ON pk.person_id=t.person_id
-            ORDER BY t.liters_total DESC, t.person ASC;
-            """, (start_date, end_date, start_date, end_date, start_date, end_date))
+            SELECT p.id AS person_id, p.name AS person, pp.*
+            FROM per_person pp
+            JOIN persons p ON p.id = pp.person_id
+            WHERE p.status='ACTIVE'
+            ORDER BY pp.period, pp.liters_total DESC, p.name ASC;
+            """, params)
             rows = cur.fetchall()
 
-    out = []
+    out = {key: [] for key in periods}
     for r in rows:
-        active_days = int(r["active_days"])
-        liters_total = float(r["liters_total"] or 0)
-        avg_active = (liters_total / active_days) if active_days else 0.0
-        out.append({
-            "person_id": r["person_id"],
-            "person": r["person"],
-            "liters_total": liters_total,
-            "active_days": active_days,
-            "avg_liters_per_active_day": avg_active,
-            "strong_days": int(r["strong_days"] or 0),
-            "peak_day": r["peak_day"],
-            "peak_liters": float(r["peak_liters"] or 0),
-        })
+        out[r["period"]].append(r)
     return out
 
+def _user_stats_item(r):
+    active_days = int(r["active_days"])
+    liters_total = float(r["liters_total"] or 0)
+    avg_active = (liters_total / active_days) if active_days else 0.0
+    return {
+        "person_id": r["person_id"],
+        "person": r["person"],
+        "liters_total": liters_total,
+        "active_days": active_days,
+        "avg_liters_per_active_day": avg_active,
+        "strong_days": int(r["strong_days"] or 0),
+        "peak_day": r["peak_day"],
+        "peak_liters": float(r["peak_liters"] or 0),
+    }
 
 def period_activity_summary(start_date: dt.date, end_date: dt.date):
     """
@@ -1178,19 +2089,18 @@ def period_activity_summary(start_date: dt.date, end_date: dt.date):
               SELECT
                 p.id AS person_id,
                 p.name AS name,
-                COALESCE(SUM(e.quantity), 0) AS units_total,
-                COALESCE(SUM(e.volume_liters_total), 0) AS liters_total,
-                COALESCE(SUM(e.price_eur_total), 0) AS euros_total,
-                COUNT(DISTINCT e.consumed_at) AS active_days,
-                MIN(e.consumed_at) AS first_day,
-                MAX(e.consumed_at) AS last_day,
-                COALESCE(SUM(CASE WHEN e.consumed_at <= %s THEN e.volume_liters_total ELSE 0 END), 0) AS first_half_liters,
-                COALESCE(SUM(CASE WHEN e.consumed_at > %s THEN e.volume_liters_total ELSE 0 END), 0) AS last_half_liters
+                COALESCE(SUM(r.units), 0) AS units_total,
+                COALESCE(SUM(r.liters), 0) AS liters_total,
+                COALESCE(SUM(r.euros), 0) AS euros_total,
+                COUNT(DISTINCT r.day) AS active_days,
+                MIN(r.day) AS first_day,
+                MAX(r.day) AS last_day,
+                COALESCE(SUM(CASE WHEN r.day <= %s THEN r.liters ELSE 0 END), 0) AS first_half_liters,
+                COALESCE(SUM(CASE WHEN r.day > %s THEN r.liters ELSE 0 END), 0) AS last_half_liters
               FROM persons p
-              LEFT JOIN drink_events e
-                ON e.person_id = p.id
-               AND e.is_void = FALSE
-               AND e.consumed_at BETWEEN %s AND %s
+              LEFT JOIN person_day_drink r
+                ON r.person_id = p.id
+               AND r.day BETWEEN %s AND %s
               WHERE p.status = 'ACTIVE'
               GROUP BY p.id, p.name
             )
@@ -1198,9 +2108,7 @@ def period_activity_summary(start_date: dt.date, end_date: dt.date):
             FROM per_person
             ORDER BY liters_total DESC, name ASC;
             """, (mid_date, mid_date, start_date, end_date))
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            return [dict(zip(cols, r)) for r in rows]
+            return [dict(r) for r in cur.fetchall()]
 
 def range_drinks_totals(start_date: dt.date, end_date: dt.date):
     """
@@ -1212,115 +2120,158 @@ def range_drinks_totals(start_date: dt.date, end_date: dt.date):
             cur.execute("""
             SELECT
               dt.code,
-              dt.name,
-              SUM(e.quantity) AS units,
-              SUM(COALESCE(e.volume_liters_total, 0)) AS liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.code = e.drink_type
-            JOIN persons p ON p.id = e.person_id
-            WHERE e.is_void = FALSE
-              AND p.status = 'ACTIVE'
-              AND e.consumed_at BETWEEN %s AND %s
-            GROUP BY dt.code, dt.name
-            HAVING SUM(COALESCE(e.volume_liters_total, 0)) > 0 OR SUM(e.quantity) > 0
-            ORDER BY liters DESC, units DESC, dt.name ASC;
+              dt.label AS name,
+              SUM(r.units) AS units,
+              SUM(r.liters) AS liters
+            FROM person_day_drink r
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            JOIN persons p ON p.id = r.person_id
+            WHERE p.status = 'ACTIVE'
+              AND r.day BETWEEN %s AND %s
+            GROUP BY dt.code, dt.label
+            HAVING SUM(r.liters) > 0 OR SUM(r.units) > 0
+            ORDER BY liters DESC, units DESC, dt.label ASC;
             """, (start_date, end_date))
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            return [dict(zip(cols, r)) for r in rows]
+            return [dict(r) for r in cur.fetchall()]
+
+
+def _add_year_extras(item: dict, months_liters, year: int):
+    days_in_year = 366 if _calendar.isleap(year) else 365
+    item["avg_liters_per_calendar_day"] = item["liters_total"] / days_in_year
 
+    months = {m: float(v or 0) for m, v in enumerate(months_liters, start=1)}
+    strongest_m = max(months.items(), key=lambda kv: (kv[1], kv[0]))[0]
+    weakest_m = min(months.items(), key=lambda kv: (kv[1], kv[0]))[0]
+    item["strongest_month"] = strongest_m
+    item["strongest_month_liters"] = months[strongest_m]
+    item["weakest_month"] = weakest_m
+    item["weakest_month_liters"] = months[weakest_m]
+    return item
 
 def user_year_stats(year: int):
     """
-    Stats per ACTIVE person for a calendar year.
+    Stats per ACTIVE person for a calendar year (one query, months from the same pass).
     Adds: avg_liters_per_calendar_day, strongest/weakest month by liters.
     """
-    start_date = dt.date(year, 1, 1)
-    end_date = dt.date(year, 12, 31)
-    days_in_year = 366 if _calendar.isleap(year) else 365
+    rows = _user_stats_rows({"year": (dt.date(year, 1, 1), dt.date(year, 12, 31))}, with_months=True)["year"]
+    return [_add_year_extras(_user_stats_item(r), r["months"], year) for r in rows]
 
-    base = user_stats_range(start_date, end_date)
+def user_stats_periods(periods: dict, year_key: str | None = None):
+    """
+    Stats per ACTIVE person for several calendar ranges in a single query.
+    periods: {key: (start_date, end_date)}; returns {key: rows sorted by liters_total desc}.
+    - liters_total: sum(volume_liters_total) (only BEER contributes)
+    - active_days: count of distinct consumed_at days with any event
+    - strong_days: count of days where liters_day >= STRONG_DAY_THRESHOLD_L (per person)
+    - peak_day / peak_liters: day with max liters_day (per person)
+    Rows of year_key (a full calendar year) also get the user_year_stats extras.
+    """
+    raw = _user_stats_rows(periods, with_months=year_key is not None)
+    out = {}
+    for key, rows in raw.items():
+        items = [_user_stats_item(r) for r in rows]
+        if key == year_key:
+            year = periods[key][0].year
+            items = [_add_year_extras(item, r["months"], year) for item, r in zip(items, rows)]
+        out[key] = items
+    return out
+
+def drink_type_person_totals_periods(periods: dict):
+    """
+    Totals per (drink x person) for several date ranges in a single query.
+    periods: {key: (start_date, end_date)}; returns {key: rows}.
+    Rows include non-ACTIVE persons (active=False) so the caller can derive the
+    global per-drink totals without a second query; rankings should skip them.
+    """
+    params = {}
+    values = []
+    for i, (key, (start, end)) in enumerate(periods.items()):
+        params[f"k{i}"], params[f"s{i}"], params[f"e{i}"] = key, start, end
+        values.append(f"(%(k{i})s, %(s{i})s::date, %(e{i})s::date)")
+    params["min"] = min(start for start, _ in periods.values())
+    params["max"] = max(end for _, end in periods.values())
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-            WITH monthly AS (
-              SELECT e.person_id,
-                     EXTRACT(MONTH FROM e.consumed_at)::INT AS m,
-                     COALESCE(SUM(e.volume_liters_total), 0) AS liters_m
-              FROM drink_events e
-              WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-              GROUP BY e.person_id, m
+            cur.execute(f"""
+            WITH periods(k, s, e) AS (
+              VALUES {", ".join(values)}
             )
-            SELECT p.id AS person_id,
-                   m.m AS m,
-                   COALESCE(m.liters_m, 0) AS liters_m
-            FROM persons p
-            LEFT JOIN monthly m ON m.person_id=p.id
-            WHERE p.status='ACTIVE'
-            ORDER BY p.id, m.m;
-            """, (start_date, end_date))
+            SELECT
+              pr.k AS period,
+              dt.category AS category,
+              dt.label AS label,
+              p.name AS person,
+              (p.status='ACTIVE') AS active,
+              COALESCE(SUM(r.units), 0)::INT AS unidades,
+              COALESCE(SUM(r.liters), 0) AS litros,
+              (dt.volume_liters IS NOT NULL) AS has_liters
+            FROM person_day_drink r
+            JOIN periods pr ON r.day BETWEEN pr.s AND pr.e
+            JOIN drink_types dt ON dt.id = r.drink_type_id
+            JOIN persons p ON p.id = r.person_id
+            WHERE r.day BETWEEN %(min)s AND %(max)s
+            GROUP BY pr.k, dt.category, dt.label, p.id, p.name, p.status, dt.volume_liters
+            HAVING COALESCE(SUM(r.units),0) > 0
+            ORDER BY pr.k, dt.category, dt.label, litros DESC, unidades DESC, p.name ASC;
+            """, params)
             rows = cur.fetchall()
 
-    monthly_map = {}
+    out = {key: [] for key in periods}
+    for r in rows:
+        out[r["period"]].append(r)
+    return out
+
+def drink_type_totals_from_person_rows(rows):
+    """
+    Global totals per drink from drink_type_person_totals_periods rows (all persons),
+    ordered by category and label: {category, label, unidades, litros, has_liters}.
+    """
+    totals = {}
     for r in rows:
-        pid = r["person_id"]
-        if pid not in monthly_map:
-            monthly_map[pid] = {i: 0.0 for i in range(1, 13)}
-        if r["m"] is not None:
-            monthly_map[pid][int(r["m"])] = float(r["liters_m"] or 0)
-
-    for item in base:
-        pid = item["person_id"]
-        liters_total = float(item["liters_total"])
-        item["avg_liters_per_calendar_day"] = liters_total / days_in_year
-
-        months = monthly_map.get(pid, {i: 0.0 for i in range(1, 13)})
-        strongest_m = max(months.items(), key=lambda kv: (kv[1], kv[0]))[0]
-        weakest_m = min(months.items(), key=lambda kv: (kv[1], kv[0]))[0]
-        item["strongest_month"] = strongest_m
-        item["strongest_month_liters"] = months[strongest_m]
-        item["weakest_month"] = weakest_m
-        item["weakest_month_liters"] = months[weakest_m]
-    return base
+        k = (r["category"], r["label"], r["has_liters"])
+        t = totals.get(k)
+        if t is None:
+            totals[k] = {"category": r["category"], "label": r["label"], "unidades": r["unidades"],
+                         "litros": r["litros"], "has_liters": r["has_liters"]}
+        else:
+            t["unidades"] += r["unidades"]
+            t["litros"] += r["litros"]
+    return list(totals.values())
 
 def group_month_summary(year: int):
     """
-    Global monthly summaries for a calendar year (group totals).
-    strong day: group liters_day >= 3.0
+    Global monthly summaries for a calendar year (group totals), all 12 months in one query.
+    strong day: group liters_day >= STRONG_DAY_THRESHOLD_L
     """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            WITH liters_by_day AS (
+              SELECT r.day AS d,
+                     COALESCE(SUM(r.liters), 0) AS liters_day
+              FROM person_day_drink r
+              WHERE r.day BETWEEN %s AND %s
+              GROUP BY d
+            )
+            SELECT
+              EXTRACT(MONTH FROM d)::INT AS m,
+              COALESCE(SUM(liters_day), 0) AS liters_total,
+              COUNT(*)::INT AS active_days,
+              COUNT(*) FILTER (WHERE liters_day >= %s)::INT AS strong_days
+            FROM liters_by_day
+            GROUP BY m;
+            """, (dt.date(year, 1, 1), dt.date(year, 12, 31), STRONG_DAY_THRESHOLD_L))
+            by_month = {int(r["m"]): r for r in cur.fetchall()}
+
     out = []
     for m in range(1, 13):
         days_in_month = _calendar.monthrange(year, m)[1]
-        start_date = dt.date(year, m, 1)
-        end_date = dt.date(year, m, days_in_month)
+        r = by_month.get(m)
 
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                WITH active_days AS (
-                  SELECT e.consumed_at::date AS d
-                  FROM drink_events e
-                  WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-                  GROUP BY d
-                ),
-                liters_by_day AS (
-                  SELECT e.consumed_at::date AS d,
-                         COALESCE(SUM(e.volume_liters_total), 0) AS liters_day
-                  FROM drink_events e
-                  WHERE e.is_void=FALSE AND e.consumed_at BETWEEN %s AND %s
-                  GROUP BY d
-                )
-                SELECT
-                  COALESCE((SELECT SUM(volume_liters_total) FROM drink_events WHERE is_void=FALSE AND consumed_at BETWEEN %s AND %s), 0) AS liters_total,
-                  COALESCE((SELECT COUNT(*) FROM active_days), 0)::INT AS active_days,
-                  COALESCE((SELECT COUNT(*) FROM liters_by_day WHERE liters_day >= 3.0), 0)::INT AS strong_days
-                """, (start_date, end_date, start_date, end_date, start_date, end_date))
-                r = cur.fetchone()
-
-        liters_total = float(r["liters_total"] or 0)
-        active_days = int(r["active_days"] or 0)
-        strong_days = int(r["strong_days"] or 0)
+        liters_total = float(r["liters_total"] or 0) if r else 0.0
+        active_days = int(r["active_days"] or 0) if r else 0
+        strong_days = int(r["strong_days"] or 0) if r else 0
         avg_active = (liters_total / active_days) if active_days else 0.0
         avg_calendar = liters_total / days_in_month
         zero_days = days_in_month - active_days
@@ -1337,47 +2288,32 @@ def group_month_summary(year: int):
         })
     return out
 
-def drink_type_person_totals_range(start_date: dt.date, end_date: dt.date):
-    """Totals per (drink x person) in date range."""
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-            SELECT
-              dt.category AS category,
-              dt.label AS label,
-              p.name AS person,
-              COALESCE(SUM(e.quantity), 0)::INT AS unidades,
-              COALESCE(SUM(e.volume_liters_total), 0) AS litros,
-              (dt.volume_liters IS NOT NULL) AS has_liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            JOIN persons p ON p.id = e.person_id
-            WHERE e.is_void=FALSE
-              AND e.consumed_at BETWEEN %s AND %s
-              AND p.status='ACTIVE'
-            GROUP BY dt.category, dt.label, p.name, dt.volume_liters
-            HAVING COALESCE(SUM(e.quantity),0) > 0
-            ORDER BY dt.category, dt.label, litros DESC, unidades DESC, p.name ASC;
-            """, (start_date, end_date))
-            return cur.fetchall()
 
-def drink_type_totals_range(start_date: dt.date, end_date: dt.date):
-    """Totals per drink (global) in date range."""
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-            SELECT
-              dt.category AS category,
-              dt.label AS label,
-              COALESCE(SUM(e.quantity), 0)::INT AS unidades,
-              COALESCE(SUM(e.volume_liters_total), 0) AS litros,
-              (dt.volume_liters IS NOT NULL) AS has_liters
-            FROM drink_events e
-            JOIN drink_types dt ON dt.id = e.drink_type_id
-            WHERE e.is_void=FALSE
-              AND e.consumed_at BETWEEN %s AND %s
-            GROUP BY dt.category, dt.label, dt.volume_liters
-            HAVING COALESCE(SUM(e.quantity),0) > 0
-            ORDER BY dt.category, dt.label;
-            """, (start_date, end_date))
-            return cur.fetchall()
+# -------------------------
+# Instrumentación (debe ir al final: envuelve lo definido arriba)
+# -------------------------
+# Sin instrumentar: infraestructura y funciones que no tocan la BD (memoria)
+_NOT_INSTRUMENTED = {
+    "track_queries", "get_pool", "pool_stats", "close_pool", "get_conn",
+    "db_function_stats", "slowest_functions", "slow_queries", "reset_db_stats",
+    "beer_year_start_for", "beer_year_range",
+    "invalidate_identity", "identity_cache_stats",
+    "invalidate_drink_catalog", "drink_catalog", "list_drink_types", "get_drink_type",
+    "drink_type_totals_from_person_rows",
+    # Los aciertos de la caché de identidad no tocan la BD; los fallos se miden en _load_assigned_person
+    "get_assigned_person",
+}
+# Privadas que sí van a la BD y conviene medir por separado
+_INSTRUMENTED_PRIVATE = {"_load_assigned_person"}
+
+
+def _instrument_module():
+    g = globals()
+    for name, obj in list(g.items()):
+        if name in _NOT_INSTRUMENTED or (name.startswith("_") and name not in _INSTRUMENTED_PRIVATE):
+            continue
+        if inspect.isfunction(obj) and obj.__module__ == __name__:
+            g[name] = _instrumented(obj)
+
+
+_instrument_module()
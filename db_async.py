@@ -0,0 +1,33 @@
+"""
+Acceso a db.py desde los handlers async del bot.
+
+Las funciones de db.py son síncronas (psycopg2). Si se llaman directamente desde
+un handler bloquean el event loop entero mientras dura la query, así que se
+ejecutan en un ThreadPoolExecutor acotado al tamaño del pool de conexiones:
+
+    person = await run_db(get_assigned_person, tg_id)
+"""
+import os
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DB_POOL_MAX
+
+# Más hilos que conexiones solo serviría para que esperen al pool
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX)))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Ejecuta fn(*args, **kwargs) en el executor de BD y espera el resultado."""
+    loop = asyncio.get_running_loop()
+    # Propaga los contextvars del handler al hilo (run_in_executor no lo hace)
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def shutdown_executor(wait: bool = True):
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,60 @@
+"""
+Comandos de mantenimiento de la base de datos:
+
+    python manage.py migrate          # aplica migraciones de esquema pendientes
+    python manage.py rebuild-rollup   # reconstruye person_day_drink desde drink_events
+                                      # (sube la versión de datos: el bot en marcha descarta sus informes cacheados)
+    python manage.py check-rollup     # compara person_day_drink con drink_events
+"""
+import argparse
+import sys
+
+import db
+
+
+def cmd_migrate(args):
+    report = db.init_db()
+    if report["applied"]:
+        print(f"Migraciones aplicadas: {report['applied']} ({report['migrate_ms']:.1f} ms).")
+    else:
+        print(f"Esquema al día (v{report['schema_version']}).")
+    return 0
+
+
+def cmd_rebuild_rollup(args):
+    n = db.rebuild_person_day_drink()
+    print(f"person_day_drink reconstruida: {n} filas.")
+    return 0
+
+
+def cmd_check_rollup(args):
+    bad = db.check_person_day_drink(limit=args.limit)
+    if not bad:
+        print("person_day_drink consistente con drink_events.")
+        return 0
+    print(f"{len(bad)} diferencias (máx. {args.limit}):")
+    for r in bad:
+        print(
+            f"  persona={r['person_id']} bebida={r['drink_type_id']} día={r['day']} "
+            f"uds {r['raw_units']}/{r['rollup_units']} · L {r['raw_liters']}/{r['rollup_liters']} · € {r['raw_euros']}/{r['rollup_euros']}"
+        )
+    return 1
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Mantenimiento de CirrosisBot")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", help="aplica migraciones pendientes").set_defaults(func=cmd_migrate)
+    sub.add_parser("rebuild-rollup", help="reconstruye el rollup diario").set_defaults(func=cmd_rebuild_rollup)
+
+    p = sub.add_parser("check-rollup", help="comprueba el rollup contra los eventos")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(func=cmd_check_rollup)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
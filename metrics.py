@@ -0,0 +1,300 @@
+"""
+Métricas en formato de texto de Prometheus, servidas en GET /metrics por el
+servidor HTTP embebido (webserver.py).
+
+- Contadores e histogramas propios, con etiquetas. En el camino caliente se
+  reutiliza el hijo ya resuelto (labels() una vez) y un inc/observe es una suma
+  en memoria, sin locks: se actualizan desde el bucle de asyncio.
+
+      UPDATE_SECONDS.labels("callback", "menu:add").observe(0.012)
+
+- Lo que otros módulos ya cuentan (pool, funciones de BD, cachés, outbox,
+  procesador de updates) se lee al servir /metrics, sin coste por operación.
+- Llamadas a la API de Telegram: TelegramMetricsRequest (HTTPXRequest con
+  latencia y errores por método).
+"""
+import time
+import bisect
+import logging
+import functools
+
+from telegram.request import HTTPXRequest
+
+from db import db_function_stats, identity_cache_stats, outbox_stats, pool_stats, slow_queries
+from report_cache import report_cache
+
+log = logging.getLogger(__name__)
+
+# Segundos; los updates y las llamadas a Telegram suelen ir de 10 ms a 1 s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_REGISTRY = []
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        _REGISTRY.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Hijo para esos valores de etiqueta (guárdalo si se usa en un bucle caliente)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise RuntimeError(f"{self.name}: se esperaban etiquetas {self.label_names}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n=1):
+        self.labels().inc(n)
+
+    def _samples(self):
+        return [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(c.value)}"
+                for k, c in list(self._children.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        out = []
+        for k, h in list(self._children.items()):
+            cum = 0
+            for bound, n in zip((*self.buckets, float("inf")), h.counts):
+                cum += n
+                le = 'le="%s"' % _fmt_value(bound)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.label_names, k, le)} {cum}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.label_names, k)} {_fmt_value(h.sum)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.label_names, k)} {cum}")
+        return out
+
+
+class Collected(_Metric):
+    """
+    Métrica leída al servir /metrics: fn() devuelve un número o un dict
+    {tupla de etiquetas: número}.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, fn, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self):
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}" for k, v in items]
+
+
+class timed:
+    """Cronometra el bloque en un hijo de Histogram y cuenta en errors si sale con excepción."""
+
+    __slots__ = ("hist", "errors", "t0")
+
+    def __init__(self, hist: _HistogramChild, errors: _CounterChild | None = None):
+        self.hist = hist
+        self.errors = errors
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.hist.observe(time.perf_counter() - self.t0)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc()
+        return False
+
+
+# --------- Métricas del bot ---------
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Duración de los handlers por tipo y ruta/estado.", ("handler", "route"))
+UPDATE_ERRORS = Counter("bot_update_errors_total", "Handlers terminados con excepción.", ("handler", "route"))
+JOB_SECONDS = Histogram("bot_job_seconds", "Duración de los jobs de la JobQueue.", ("job",))
+JOB_ERRORS = Counter("bot_job_errors_total", "Jobs terminados con excepción.", ("job",))
+TELEGRAM_SECONDS = Histogram("telegram_request_seconds", "Latencia de las llamadas a la Bot API por método.", ("method",))
+TELEGRAM_ERRORS = Counter(
+    "telegram_request_errors_total",
+    "Llamadas a la Bot API fallidas por método y motivo (código HTTP o excepción).",
+    ("method", "reason"),
+)
+SWALLOWED_ERRORS = Counter(
+    "bot_ignored_errors_total",
+    "Errores que el bot registra y deja pasar sin cortar el flujo (p.ej. envío de logros).",
+    ("where",),
+)
+
+
+def instrument_job(fn):
+    """Decorador para jobs de la JobQueue: duración y errores con el nombre de la función."""
+    hist = JOB_SECONDS.labels(fn.__name__)
+    errors = JOB_ERRORS.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(context):
+        with timed(hist, errors):
+            return await fn(context)
+
+    return wrapper
+
+
+class TelegramMetricsRequest(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API (sendMessage, editMessageText...)."""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(api_method, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_SECONDS.labels(api_method).observe(time.perf_counter() - t0)
+        if code >= 400:
+            TELEGRAM_ERRORS.labels(api_method, str(code)).inc()
+        return code, payload
+
+
+# --------- Estado leído al servir /metrics ---------
+def _pool(key):
+    return lambda: pool_stats().get(key, 0)
+
+
+def _db_fn(key, scale=None):
+    if scale is None:
+        return lambda: {(name,): st[key] for name, st in db_function_stats().items()}
+    return lambda: {(name,): st[key] * scale for name, st in db_function_stats().items()}
+
+
+Collected("db_pool_connections", "Conexiones abiertas del pool.", "gauge", _pool("size"))
+Collected("db_pool_idle", "Conexiones libres en el pool.", "gauge", _pool("idle"))
+Collected("db_pool_checked_out", "Conexiones prestadas ahora mismo.", "gauge", _pool("checked_out"))
+Collected("db_pool_waiting", "Hilos esperando una conexión.", "gauge", _pool("waiting"))
+Collected("db_pool_max", "Tamaño máximo del pool.", "gauge", _pool("max"))
+Collected("db_pool_created_total", "Conexiones creadas.", "counter", _pool("created"))
+Collected("db_pool_recycled_total", "Conexiones descartadas por edad o sin salud.", "counter", _pool("recycled"))
+
+Collected("db_function_calls_total", "Llamadas a funciones de db.py.", "counter", _db_fn("calls"), ("fn",))
+Collected("db_function_errors_total", "Llamadas a funciones de db.py con excepción.", "counter", _db_fn("errors"), ("fn",))
+Collected("db_function_rows_total", "Filas devueltas o afectadas por función de db.py.", "counter", _db_fn("rows"), ("fn",))
+Collected("db_function_seconds_total", "Tiempo total en funciones de db.py.", "counter", _db_fn("total_ms", 0.001), ("fn",))
+Collected("db_slow_queries_recent", "Consultas lentas guardadas en memoria.", "gauge", lambda: len(slow_queries(10**6)))
+
+Collected("identity_cache_hits_total", "Aciertos de la caché de identidad.", "counter", lambda: identity_cache_stats()["hits"])
+Collected("identity_cache_misses_total", "Fallos de la caché de identidad.", "counter", lambda: identity_cache_stats()["misses"])
+Collected("identity_cache_entries", "Entradas en la caché de identidad.", "gauge", lambda: identity_cache_stats()["size"])
+
+Collected("report_cache_hits_total", "Aciertos de la caché de informes.", "counter", lambda: report_cache.stats()["hits"])
+Collected("report_cache_misses_total", "Fallos de la caché de informes.", "counter", lambda: report_cache.stats()["misses"])
+Collected("report_cache_evictions_total", "Entradas expulsadas de la caché de informes.", "counter", lambda: report_cache.stats()["evictions"])
+Collected("report_cache_bytes", "Tamaño estimado de la caché de informes.", "gauge", lambda: report_cache.stats()["bytes"])
+
+
+def _outbox():
+    try:
+        return {(status,): n for status, n in outbox_stats().items()}
+    except Exception:
+        log.warning("metrics: no se pudo leer la outbox", exc_info=True)
+        return {}
+
+
+Collected("summary_outbox_messages", "Mensajes de la outbox de resúmenes por estado.", "gauge", _outbox, ("status",))
+
+
+# PerUserUpdateProcessor.stats(): vive en la Application, se pasa a render()
+_UPDATE_PROCESSOR_METRICS = (
+    ("bot_updates_total", "counter", "updates"),
+    ("bot_updates_serialized_total", "counter", "serialized"),
+    ("bot_updates_in_flight", "gauge", "in_flight"),
+    ("bot_updates_users_active", "gauge", "users_active"),
+    ("bot_updates_concurrency", "gauge", "concurrency"),
+)
+
+
+def render(update_processor=None) -> str:
+    """
+    Texto de /metrics. Consulta la BD (outbox): llamar fuera del bucle de
+    eventos (run_db). update_processor: el de la Application, si tiene stats().
+    """
+    lines = []
+    for metric in list(_REGISTRY):
+        try:
+            lines += metric.render()
+        except Exception:
+            log.exception("metrics: error generando %s", metric.name)
+    if update_processor is not None and hasattr(update_processor, "stats"):
+        st = update_processor.stats()
+        for name, kind, key in _UPDATE_PROCESSOR_METRICS:
+            lines += [f"# TYPE {name} {kind}", f"{name} {st[key]}"]
+    return "\n".join(lines) + "\n"
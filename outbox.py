@@ -0,0 +1,89 @@
+"""
+Worker de la outbox de resúmenes (tabla summary_outbox).
+
+Los jobs de resumen ya no envían: encolan un mensaje por destinatario con
+db.enqueue_summary (en la misma transacción que marca el resumen como enviado).
+Este worker reserva lotes de envíos vencidos, los manda con el Broadcaster
+(concurrencia y límites de Telegram) y anota el resultado de cada uno:
+SENT, FAILED (error permanente o demasiados intentos) o PENDING con backoff.
+
+Un reinicio a mitad de lote no pierde nada: lo reservado y no cerrado vuelve a
+estar pendiente al vencer el lease (OUTBOX_LEASE_S). Para que otro worker no
+reenvíe lo que este aún tiene en curso, el lote deja de empezar envíos
+OUTBOX_LEASE_MARGIN_S antes de que venza su lease (lo no enviado vuelve a
+PENDING sin esperar) y complete_outbox_batch solo cierra filas cuya reserva
+sigue siendo suya.
+"""
+import os
+import time
+import logging
+
+from broadcast import Broadcaster
+from db import claim_outbox_batch, complete_outbox_batch
+from db_async import run_db
+from metrics import instrument_job
+
+log = logging.getLogger(__name__)
+
+OUTBOX_BATCH = int(os.environ.get("OUTBOX_BATCH", "50"))
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", "10"))
+OUTBOX_POLL_S = float(os.environ.get("OUTBOX_POLL_S", "10"))
+OUTBOX_LEASE_S = float(os.environ.get("OUTBOX_LEASE_S", "120"))
+# Colchón para el último envío en vuelo (timeout de la petición) y el cierre del lote
+OUTBOX_LEASE_MARGIN_S = float(os.environ.get("OUTBOX_LEASE_MARGIN_S", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_S = float(os.environ.get("OUTBOX_RETRY_BASE_S", "30"))
+OUTBOX_RETRY_MAX_S = float(os.environ.get("OUTBOX_RETRY_MAX_S", "3600"))
+
+# Reintentos rápidos dentro del lote; los lentos los programa la outbox
+outbox_broadcaster = Broadcaster(concurrency=OUTBOX_CONCURRENCY, max_attempts=3)
+
+
+def _outcome(row, result):
+    """(id, attempts, status, message_id, error, retry_in_s) para complete_outbox_batch."""
+    key = (row["id"], row["attempts"])
+    if result["ok"]:
+        return (*key, "SENT", result["message_id"], None, 0)
+    if result["expired"] and not result["attempts"]:
+        # Ni se intentó: al siguiente lote sin backoff
+        return (*key, "PENDING", None, result["error"], 0)
+    if not result["retryable"] or row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+        return (*key, "FAILED", None, result["error"], 0)
+    retry_in = min(OUTBOX_RETRY_MAX_S, OUTBOX_RETRY_BASE_S * (2 ** (row["attempts"] - 1)))
+    return (*key, "PENDING", None, result["error"], retry_in)
+
+
+async def drain_outbox(bot, broadcaster: Broadcaster = outbox_broadcaster, batch: int = OUTBOX_BATCH) -> dict:
+    """Envía lotes hasta que no quede nada vencido. Devuelve {sent, failed, retry, elapsed_s}."""
+    t0 = time.monotonic()
+    totals = {"sent": 0, "failed": 0, "retry": 0}
+    while True:
+        deadline = time.monotonic() + OUTBOX_LEASE_S - OUTBOX_LEASE_MARGIN_S
+        rows = await run_db(claim_outbox_batch, batch, OUTBOX_LEASE_S)
+        if not rows:
+            break
+        result = await broadcaster.deliver(bot, [(r["chat_id"], r["text"]) for r in rows], deadline=deadline)
+        outcomes = [_outcome(row, res) for row, res in zip(rows, result["results"])]
+        closed = await run_db(complete_outbox_batch, outcomes)
+        if closed < len(outcomes):
+            log.warning("outbox: %d envíos del lote ya no eran nuestros (lease vencido)", len(outcomes) - closed)
+
+        for row, (_, _, status, _, error, _) in zip(rows, outcomes):
+            if status == "SENT":
+                totals["sent"] += 1
+            elif status == "FAILED":
+                totals["failed"] += 1
+                log.warning("outbox: %s -> chat %s descartado tras %d intentos: %s",
+                            row["summary_key"], row["chat_id"], row["attempts"], error)
+            else:
+                totals["retry"] += 1
+    totals["elapsed_s"] = time.monotonic() - t0
+    return totals
+
+
+@instrument_job
+async def outbox_job(context):
+    totals = await drain_outbox(context.bot)
+    if totals["sent"] or totals["failed"] or totals["retry"]:
+        log.info("outbox: %d enviados, %d descartados, %d reprogramados en %.1f s",
+                 totals["sent"], totals["failed"], totals["retry"], totals["elapsed_s"])
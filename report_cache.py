@@ -0,0 +1,98 @@
+"""
+Caché en memoria de informes ya renderizados (rankings).
+
+Cada entrada guarda la versión de datos con la que se calculó (ver db.data_version).
+Si al leerla la versión actual es otra, cuenta como fallo y se recalcula, así que
+no hace falta invalidar a mano: basta con que las escrituras suban la versión.
+
+    version = data_version(today.year)   # en BD: la ven todos los procesos
+    txt = report_cache.get(("users_current", today), version)
+    if txt is None:
+        txt = render_users_ranking_current(today)
+        report_cache.put(("users_current", today), version, txt)
+
+Tamaño acotado por número de entradas y por bytes aproximados; expulsa LRU.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", "256"))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+def _sizeof(value) -> int:
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ReportCache:
+    def __init__(self, max_entries: int = REPORT_CACHE_MAX_ENTRIES, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, value, size)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[0] != version:
+                # Calculado con datos antiguos: fuera
+                self._drop(key)
+                self._misses += 1
+                self._stale += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stale": self._stale,
+                "evictions": self._evictions,
+                "hit_rate": (self._hits / lookups) if lookups else 0.0,
+            }
+
+
+report_cache = ReportCache()
@@ -0,0 +1,73 @@
+"""
+Contexto de un update: lo que varios pasos de un mismo update necesitan saber
+(persona asignada, si es admin, años con datos...) se consulta una sola vez y
+se reutiliza hasta que acaba el update.
+
+    rc = request_context(update)
+    person = await rc.person()
+    kb = menu_kb(await rc.is_admin())   # sin otra consulta
+
+El PerUserUpdateProcessor abre el contexto de cada update (begin_update) y
+cuenta las consultas que ejecuta; fuera de él (tests, benchmarks) se crea uno
+al pedirlo.
+"""
+import contextvars
+
+from db import get_assigned_person, list_calendar_years_with_data, list_years_with_data
+from db_async import run_db
+
+_current = contextvars.ContextVar("request_context", default=None)
+
+
+class RequestContext:
+    def __init__(self, update):
+        self.update = update
+        user = getattr(update, "effective_user", None)
+        self.tg_id = user.id if user is not None else None
+        self.db = {"queries": 0, "db_ms": 0.0}  # lo rellena db.track_queries
+        self._memo = {}
+
+    async def _once(self, key, fn, *args):
+        if key not in self._memo:
+            self._memo[key] = await run_db(fn, *args)
+        return self._memo[key]
+
+    def forget(self, *keys: str):
+        """Descarta valores memorizados que el propio update ha cambiado."""
+        for key in keys or list(self._memo):
+            self._memo.pop(key, None)
+
+    async def person(self):
+        if self.tg_id is None:
+            return None
+        return await self._once("person", get_assigned_person, self.tg_id)
+
+    async def is_admin(self) -> bool:
+        # Lo mismo que db.is_admin, sin volver a consultar la persona
+        person = await self.person()
+        return bool(person and person.get("role") == "ADMIN")
+
+    async def calendar_years(self) -> list:
+        return await self._once("calendar_years", list_calendar_years_with_data)
+
+    async def beer_years(self) -> list:
+        return await self._once("beer_years", list_years_with_data)
+
+
+def begin_update(update) -> tuple:
+    """Crea el contexto del update y lo activa. Devuelve (contexto, token para end_update)."""
+    rc = RequestContext(update)
+    return rc, _current.set(rc)
+
+
+def end_update(token):
+    _current.reset(token)
+
+
+def request_context(update) -> RequestContext:
+    """Contexto del update en curso (uno nuevo si no hay o es de otro update)."""
+    rc = _current.get()
+    if rc is None or rc.update is not update:
+        rc = RequestContext(update)
+        _current.set(rc)
+    return rc
@@ -0,0 +1,131 @@
+"""
+Procesado concurrente de updates con orden por usuario.
+
+Con concurrent_updates la Application atiende varios updates a la vez: un
+ranking lento de un usuario ya no retrasa los toques de los demás. Pero los
+updates de un mismo usuario siguen en serie (lock por user_id), porque la
+máquina de estados de context.user_data (set_state/get_state:
+ADD_CAT → ADD_TYPE → ADD_QTY → ADD_DATE) no admite dos handlers intercalados.
+
+    app = Application.builder().concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))...
+
+Cada update se ejecuta dentro de su RequestContext y se cuentan las consultas
+a BD que hace (log DEBUG por update; WARNING si pasa de UPDATE_QUERY_WARN).
+"""
+import os
+import time
+import asyncio
+import logging
+import weakref
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from db import DB_POOL_MAX, track_queries
+from request_context import begin_update, end_update
+
+log = logging.getLogger(__name__)
+
+# Handlers ejecutándose a la vez; más que conexiones solo serviría para esperar al pool
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", str(DB_POOL_MAX)))
+# Updates admitidos en total (los que esperan turno de su usuario incluidos)
+CONCURRENT_UPDATES_QUEUED = int(os.environ.get("CONCURRENT_UPDATES_QUEUED", str(CONCURRENT_UPDATES * 8)))
+UPDATE_QUERY_WARN = int(os.environ.get("UPDATE_QUERY_WARN", "15"))
+
+
+def describe_update(update) -> str:
+    if isinstance(update, Update):
+        if update.callback_query is not None:
+            return f"callback {update.callback_query.data}"
+        if update.message is not None and update.message.text:
+            text = update.message.text
+            return text.split()[0] if text.startswith("/") else "texto"
+    return type(update).__name__
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    El hueco de ejecución (semáforo propio de tamaño concurrency) se pide
+    después del lock del usuario: los updates que esperan a un update anterior
+    de su mismo usuario no ocupan huecos que podrían usar otros usuarios.
+    """
+
+    def __init__(self, concurrency: int = CONCURRENT_UPDATES, queued: int = CONCURRENT_UPDATES_QUEUED):
+        super().__init__(max(queued, concurrency))
+        self.concurrency = concurrency
+        self._running = asyncio.BoundedSemaphore(concurrency)
+        # Un lock vive mientras algún update de ese usuario lo tiene o lo espera
+        self._locks = weakref.WeakValueDictionary()
+        self.in_flight = 0
+        self.serialized = 0  # updates que tuvieron que esperar a otro del mismo usuario
+        self.updates = 0
+        self.queries = 0
+        self.max_queries = 0
+
+    def _lock_for(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def _run(self, update, coroutine):
+        rc, token = begin_update(update)
+        t0 = time.perf_counter()
+        try:
+            with track_queries(rc.db):
+                await coroutine
+        finally:
+            end_update(token)
+            n = rc.db["queries"]
+            self.updates += 1
+            self.queries += n
+            self.max_queries = max(self.max_queries, n)
+            ms = (time.perf_counter() - t0) * 1000
+            if n > UPDATE_QUERY_WARN:
+                log.warning("%s: %d consultas (%.1f ms BD, %.1f ms total)", describe_update(update), n, rc.db["db_ms"], ms)
+            else:
+                log.debug("%s: %d consultas (%.1f ms BD, %.1f ms total)", describe_update(update), n, rc.db["db_ms"], ms)
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await self._run(update, coroutine)
+            return
+
+        lock = self._lock_for(key)
+        if lock.locked():
+            self.serialized += 1
+        async with lock:
+            async with self._running:
+                self.in_flight += 1
+                try:
+                    await self._run(update, coroutine)
+                finally:
+                    self.in_flight -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "users_active": len(self._locks),
+            "serialized": self.serialized,
+            "updates": self.updates,
+            "queries_per_update": round(self.queries / self.updates, 2) if self.updates else 0.0,
+            "max_queries": self.max_queries,
+        }
@@ -0,0 +1,211 @@
+"""
+Servidor HTTP embebido (asyncio, sin dependencias) para el modo webhook y la
+sonda de salud.
+
+- POST WEBHOOK_PATH: update de Telegram. Se comprueba la cabecera
+  X-Telegram-Bot-Api-Secret-Token y el update se encola en la Application,
+  que lo despacha a los mismos handlers que en polling.
+- GET /health: estado del bot, la cola de updates y el pool de BD.
+- GET /metrics: métricas en formato de texto de Prometheus (metrics.py).
+
+En polling el servidor solo se arranca si hay PORT (p.ej. Railway) para servir /health.
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import logging
+import secrets
+
+from telegram import Update
+
+from db import pool_stats
+from db_async import run_db
+from metrics import render as render_metrics
+
+log = logging.getLogger(__name__)
+
+BOT_MODE = os.environ.get("BOT_MODE", "").lower()          # webhook | polling (vacío: según WEBHOOK_URL)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")  # URL pública base, p.ej. https://bot.example.com
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Si no se fija, se genera en cada arranque (set_webhook se llama siempre al arrancar)
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.environ.get("PORT", "0"))
+HTTP_MAX_BODY = 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large"}
+
+
+def webhook_enabled() -> bool:
+    if BOT_MODE:
+        return BOT_MODE == "webhook"
+    return bool(WEBHOOK_URL)
+
+
+class HttpServer:
+    """
+    HTTP/1.1 mínimo con keep-alive. Las rutas son (método, ruta) -> handler async
+    que recibe (headers, body) y devuelve (status, content_type, bytes).
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        log.info("HTTP escuchando en %s:%s (%s)", self.host, self.port, ", ".join(p for _, p in self.routes))
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                if len(parts) != 3:
+                    return
+                method, target, _ = parts
+                path = target.split("?", 1)[0]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+
+                if headers.get("transfer-encoding"):
+                    status, ctype, data = 411, "text/plain", b"chunked no soportado"
+                    body = None
+                else:
+                    length = int(headers.get("content-length", "0") or 0)
+                    if length > HTTP_MAX_BODY:
+                        status, ctype, data = 413, "text/plain", b""
+                        body = None
+                    else:
+                        body = await reader.readexactly(length) if length else b""
+
+                if body is not None:
+                    handler = self.routes.get((method, path))
+                    if handler is not None:
+                        status, ctype, data = await handler(headers, body)
+                    elif any(p == path for _, p in self.routes):
+                        status, ctype, data = 405, "text/plain", b""
+                    else:
+                        status, ctype, data = 404, "text/plain", b""
+
+                close = body is None or headers.get("connection", "").lower() == "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+                    f"Content-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+                    f"{'Connection: close' if close else 'Connection: keep-alive'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            log.exception("HTTP: error atendiendo la petición")
+        finally:
+            writer.close()
+
+
+def _json(status: int, payload) -> tuple:
+    return status, "application/json", json.dumps(payload, default=str).encode()
+
+
+def build_server(app, webhook: bool, port: int | None = None) -> HttpServer:
+    """Servidor con /health, /metrics y, si webhook=True, la ruta del webhook enlazada a app."""
+    server = HttpServer(HTTP_HOST, HTTP_PORT if port is None else port)
+    started = time.monotonic()
+
+    async def health(headers, body):
+        payload = {
+            "status": "ok",
+            "mode": "webhook" if webhook else "polling",
+            "uptime_s": round(time.monotonic() - started, 1),
+            "update_queue": app.update_queue.qsize(),
+            "db_pool": pool_stats(),
+        }
+        if hasattr(app.update_processor, "stats"):
+            payload["updates"] = app.update_processor.stats()
+        return _json(200, payload)
+
+    async def metrics(headers, body):
+        # render consulta la outbox: fuera del bucle de eventos
+        text = await run_db(render_metrics, app.update_processor)
+        return 200, "text/plain; version=0.0.4; charset=utf-8", text.encode()
+
+    async def telegram_update(headers, body):
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return 403, "text/plain", b""
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, "text/plain", b""
+        # Se responde ya; los handlers corren en la Application como en polling
+        await app.update_queue.put(update)
+        return 200, "text/plain", b""
+
+    server.route("GET", "/health", health)
+    server.route("GET", "/metrics", metrics)
+    if webhook:
+        server.route("POST", WEBHOOK_PATH, telegram_update)
+    return server
+
+
+async def run_webhook(app, stop_signals=None):
+    """
+    Arranca la Application en modo webhook con el servidor embebido y bloquea
+    hasta SIGINT/SIGTERM. Devuelve False sin arrancar si set_webhook falla
+    (el llamador puede volver a polling).
+    """
+    import signal
+
+    server = build_server(app, webhook=True, port=HTTP_PORT or 8080)
+    async with app:
+        try:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        except Exception:
+            log.exception("set_webhook falló")
+            return False
+
+        await server.start()
+        await app.start()
+        log.info("Modo webhook: %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in stop_signals or (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+    # Como run_polling: post_shutdown tras app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    return True